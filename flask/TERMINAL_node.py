@@ -93,7 +93,8 @@ class Node:
                 self.print_blockchian_elements()
                 break
 
-            if not Verification.verify_chain(self.blockchain.chain):
+            # Only the blocks added since the last check are verified.
+            if not self.blockchain.verify_chain():
                 self.print_blockchian_elements()
                 print("Invalid Blockchain!")
                 break
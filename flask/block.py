@@ -1,5 +1,7 @@
 from time import time
+from utility.hash_utils import hash_block
 from utility.printable import Printable
+from transaction import Transaction, valid_number
 
 
 class Block(Printable):
@@ -12,11 +14,92 @@ class Block(Printable):
         default).
         :transactions: A list of transaction which are included in the block.
         :proof: The proof of work number that yielded this block.
+        :merkle_root: The Merkle root over the transactions. The proof of
+        work and the hash of blocks with a Merkle root are computed over
+        their fixed-size header; blocks without one (None) were created by
+        older versions and are hashed as a whole.
     """
 
-    def __init__(self, index, previous_hash, transactions, proof, time=time()):
+    def __init__(self, index, previous_hash, transactions, proof, time=time(),
+                 merkle_root=None):
         self.index = index
         self.previous_hash = previous_hash
         self.timestamp = time
         self.transactions = transactions
         self.proof = proof
+        self.merkle_root = merkle_root
+        self.__sealed_hash = None
+
+    def seal(self):
+        """Mark this block as complete and memoize its hash.
+
+        Sealed blocks (the blocks of a chain) must not be changed anymore.
+        """
+        if self.__sealed_hash is None:
+            self.__sealed_hash = hash_block(self)
+        return self
+
+    def hash(self):
+        """Return the hash of this block (memoized once the block is sealed).
+        """
+        if self.__sealed_hash is not None:
+            return self.__sealed_hash
+        return hash_block(self)
+
+    def to_dict(self):
+        """Convert this block into a (JSON serializable) dict."""
+        return {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof,
+            'merkle_root': self.merkle_root
+        }
+
+    def header_dict(self):
+        """Return the header of this block (everything but the transactions)
+        and its hash as a (JSON serializable) dict."""
+        return {
+            'index': self.index,
+            'hash': self.hash(),
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'proof': self.proof,
+            'merkle_root': self.merkle_root,
+            'transaction_count': len(self.transactions)
+        }
+
+    def has_valid_fields(self):
+        """Return whether the header fields have types and ranges which can be
+        stored (the transactions are checked when they are created)."""
+        return (valid_number(self.index, 0) and
+                isinstance(self.index, int) and
+                isinstance(self.previous_hash, str) and
+                valid_number(self.proof) and
+                valid_number(self.timestamp) and
+                (self.merkle_root is None or
+                 isinstance(self.merkle_root, str)))
+
+    @classmethod
+    def from_dict(cls, block):
+        """Create a block from its dict representation.
+
+        Raises ValueError if a field has an invalid type or range (see
+        has_valid_fields()).
+
+        Arguments:
+            :block: The dict (e.g. loaded from JSON) describing the block.
+        """
+        if not isinstance(block['transactions'], list):
+            raise ValueError('Invalid block transactions')
+        converted_block = cls(block['index'],
+                              block['previous_hash'],
+                              [Transaction.from_dict(tx)
+                               for tx in block['transactions']],
+                              block['proof'],
+                              block['timestamp'],
+                              block.get('merkle_root'))
+        if not converted_block.has_valid_fields():
+            raise ValueError('Invalid block fields')
+        return converted_block
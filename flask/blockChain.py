@@ -1,15 +1,39 @@
-from functools import reduce
-import json
-import requests
+import struct
+import threading
+from time import time
 
-from utility.hash_utils import hash_block
-from utility.verification import Verification
+import codec
+import miner
+
+from block_template import build_template
+from utility.hash_utils import block_header, merkle_root
+from utility.rwlock import ReadWriteLock
+from utility.verification import ChainVerifier, Verification
 from block import Block
+from compact_block import CompactBlock
+from ledger import BalanceLedger
+from mempool import Mempool, MempoolFullError
+from peer_client import PEER_ERRORS, PeerClient
+from persistence import DURABILITY, PersistenceWriter
+from storage import BlockStorage, ChainView, StoredChain
 from transaction import Transaction
-from wallet import Wallet
 
 # The reward given to the miners (for creating a new block).
 MINING_REWARD = 10
+# The number of processes searching a proof of work (None: number of cores).
+MINING_WORKERS = None
+# The number of blocks after which a new balance checkpoint is written.
+CHECKPOINT_INTERVAL = 100
+# The number of balance checkpoints which are kept.
+CHECKPOINT_COUNT = 3
+
+# The number of blocks requested per page when syncing with a peer.
+SYNC_PAGE_SIZE = 500
+
+# The kinds of state written by the persistence writer.
+BLOCKS = 'blocks'
+OPEN_TRANSACTIONS = 'open_transactions'
+PEER_NODES = 'peer_nodes'
 
 print(__name__)
 
@@ -19,127 +43,235 @@ class Blockchain:
         transactions and the node on which it's running.
 
     Attributes:
-        :chain: The list of blocks
-        :open_transactions (private): The list of open transactions
+        :chain: A read-only ChainView of the blocks
+        :open_transactions (private): The Mempool of open transactions
         :hosting_node: The connected node (which runs the blockchain).
+        :durability: The durability mode of the persistence writer (see
+        persistence.DURABILITY_MODES).
     """
 
-    def __init__(self, public_key, node_id):
+    def __init__(self, public_key, node_id, durability=DURABILITY):
+        self.__storage = BlockStorage(node_id)
         # The starting block of blockchain.
         genesis_block = Block(0, "", [], 100, 0)
         # Initailizing our (empty) blockchain list.     Making it private.
         self.chain = [genesis_block]
         # Unhandeled transaction.                       Making it private.
-        self.__open_transactions = list()
+        self.__open_transactions = Mempool()
         self.public_key = public_key
         self.__peer_nodes = set()
         self.node_id = node_id
         self.resolve_conflicts = False
+        self.__ledger = BalanceLedger()
+        self.__checkpoint_height = 0
+        # Writers (changes of the chain, the open transactions and the peer
+        # nodes) are serialized; readers of committed state mostly only read
+        # references which writers replace or append to atomically.
+        self.__lock = ReadWriteLock()
+        self.__verifier_lock = threading.Lock()
+        self.__chain_listeners = list()
+        self.__verifier = ChainVerifier()
+        self.__peer_client = PeerClient()
+        # Changes are written to storage by a background thread, so requests
+        # do not wait for the disk (unless the durability mode asks to).
+        self.__writer = PersistenceWriter(self.write_state, durability)
         self.load_data()
 
+    @property
+    def durability(self):
+        return self.__writer.durability
+
     @property
     def chain(self):
-        return self.__chain[:]
+        return ChainView(self.__chain)
 
     @chain.setter
     def chain(self, val):
-        self.__chain = val
+        # The block log is rewritten with the new chain on the next save.
+        self.__chain = StoredChain(self.__storage, val)
+
+    def add_chain_listener(self, listener):
+        """Register a callable which is called whenever the tip of the chain
+        changes (mine_block, add_block, resolve).
+
+        Arguments:
+            :listener: The callable, it gets no arguments.
+        """
+        self.__chain_listeners.append(listener)
+
+    def notify_chain_listeners(self):
+        """Call all registered chain listeners."""
+        for listener in self.__chain_listeners:
+            listener()
+
+    def verify_chain(self, full=False):
+        """Verify the local chain, only checking the blocks added since the
+        last verification unless a full verification is requested.
+
+        Arguments:
+            :full: Whether the whole chain is verified again.
+        """
+        with self.__verifier_lock:
+            return self.__verifier.verify(self.__chain, full)
 
     def get_open_transaction(self):
         """Returns a copy of the open transactions list."""
-        return self.__open_transactions[:]
+        with self.__lock.read_lock():
+            return self.__open_transactions.transactions()
 
     def load_data(self):
-        """Initialize blockchain by loading data from a file"""
+        """Initialize blockchain by loading data from the node's storage."""
         try:
-
-            with open("blockchain-{}.txt".format(self.node_id), 'r') as file:
-                file_content = file.readlines()
-
-            # To remove the "\n" from the load, we are using range selector.
-                blockchain = json.loads(file_content[0][:-1])
-                updated_blockchain = list()
-
-                for block in blockchain:
-                    converted_tx = [Transaction(
-                        tx['sender'],
-                        tx['recipient'],
-                        tx['signature'],
-                        tx['amount']) for tx in block['transactions']]
-
-                    updated_block = Block(
-                        block['index'],
-                        block['previous_hash'],
-                        converted_tx,
-                        block['proof'],
-                        block['timestamp'])
-
-                    updated_blockchain.append(updated_block)
-                self.chain = updated_blockchain
-                open_transaction = json.loads(file_content[1][:-1])
-                updated_transactions = list()
-
-                for tx in open_transaction:
-                    updated_transaction = Transaction(
-                        tx['sender'],
-                        tx['recipient'],
-                        tx['signature'],
-                        tx['amount'])
-                    updated_transactions.append(updated_transaction)
-
-                self.__open_transactions = updated_transactions
-                peer_nodes = json.loads(file_content[2])
-                self.__peer_nodes = set(peer_nodes)
-
-        except (IOError, IndexError):
+            # Only the block index is read; blocks are decoded on demand.
+            if self.__storage.open():
+                self.__chain = StoredChain(self.__storage)
+                self.__open_transactions = Mempool(
+                    self.__storage.load_open_transactions())
+                self.__peer_nodes = self.__storage.load_peer_nodes()
+            else:
+                legacy = self.__storage.load_legacy()
+                if legacy is not None:
+                    # Migrate a chain file of the old single-file format.
+                    print('Migrating legacy chain file')
+                    self.chain, open_transactions, self.__peer_nodes = legacy
+                    self.__open_transactions = Mempool(open_transactions)
+                    self.save_data()
+                else:
+                    self.__writer.wait_written(self.save_blocks())
+
+            # A crash between appending a block and saving the open
+            # transactions may leave already mined transactions behind.
+            self.__open_transactions.remove_all(
+                self.__chain[-1].transactions)
+            self.load_ledger()
+
+        except (IOError, IndexError, ValueError):
             print("Exception HANDLED")
             pass
 
         finally:
             print('Cleaned')
 
-    def save_data(self):
-        """Save blockchain + open transactions to a file."""
-        try:
-            with open("blockchain-{}.txt".format(self.node_id), 'w') as file:
-                new_saveable_chain = [
-                    block.__dict__ for block in
-                    [
-                        Block(new_block.index,
-                              new_block.previous_hash,
-                              [tx.__dict__ for tx in new_block.transactions],
-                              new_block.proof,
-                              new_block.timestamp)
-                        for new_block in self.__chain]
-                ]
-
-                file.write(json.dumps(new_saveable_chain))
-                file.write('\n')
-                new_saveable_tx = [
-                    block.__dict__ for block in self.__open_transactions]
-                file.write(json.dumps(new_saveable_tx))
-                file.write('\n')
-                file.write(json.dumps(list(self.__peer_nodes)))
+    def load_ledger(self):
+        """Restore the balances from the newest matching checkpoint.
 
+        Only the blocks after the checkpoint are replayed; without a
+        checkpoint whose tip hash matches the stored chain, the balances are
+        rebuilt from the whole chain.
+        """
+        for checkpoint in reversed(self.__storage.load_checkpoints()):
+            height = checkpoint['height']
+            if height <= len(self.__chain) and \
+                    self.__chain[height - 1].hash() == \
+                    checkpoint['tip_hash']:
+                self.__ledger.restore(checkpoint['balances'],
+                                      self.__chain[height:],
+                                      self.__open_transactions)
+                self.__checkpoint_height = height
+                return
+        self.__ledger.rebuild(self.__chain, self.__open_transactions)
+        self.__checkpoint_height = 0
+
+    def save_checkpoint(self):
+        """Write a balance checkpoint once enough blocks were added."""
+        with self.__lock.read_lock():
+            height = len(self.__chain)
+            if height - self.__checkpoint_height < CHECKPOINT_INTERVAL:
+                return
+            checkpoint = {
+                'height': height,
+                'tip_hash': self.__chain[-1].hash(),
+                'balances': self.__ledger.snapshot()
+            }
+        checkpoints = [
+            checkpoint for checkpoint in self.__storage.load_checkpoints()
+            if checkpoint['height'] < height]
+        checkpoints.append(checkpoint)
+        try:
+            self.__storage.save_checkpoints(checkpoints[-CHECKPOINT_COUNT:])
+            self.__checkpoint_height = height
         except IOError:
-            print("Saving Failed!!")
-
-    def proof_of_work(self):
-        """Generate a proof of work for the open transactions"""
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        proof = 0
-
-        while not Verification.valid_proof(
-                self.__open_transactions,
-                last_hash,
-                proof
-        ):
-            proof += 1
-        return proof
+            print("Saving checkpoint failed!!")
+
+    def save_data(self):
+        """Save blockchain + open transactions + peer nodes to storage and
+        wait until they are written.
+
+        Only blocks which are not stored yet are appended to the block log.
+        """
+        self.__writer.wait_written(
+            self.__writer.request(BLOCKS, OPEN_TRANSACTIONS, PEER_NODES))
+
+    def save_blocks(self):
+        """Queue appending the blocks which are not stored yet to the block
+        log, returns the ticket to wait for (see wait_saved())."""
+        return self.__writer.request(BLOCKS)
+
+    def save_open_transactions(self):
+        """Queue saving the open transactions, returns the ticket to wait
+        for (see wait_saved())."""
+        return self.__writer.request(OPEN_TRANSACTIONS)
+
+    def save_peer_nodes(self):
+        """Queue saving the peer nodes, returns the ticket to wait for (see
+        wait_saved())."""
+        return self.__writer.request(PEER_NODES)
+
+    def wait_saved(self, ticket):
+        """Wait until a queued change is written if the durability mode
+        acknowledges changes only after they were synced to disk.
+
+        Never call this while holding the lock, so the writes of concurrent
+        requests can be grouped into one. Raises
+        persistence.PersistenceError if the change could not be written.
+        """
+        self.__writer.wait(ticket)
+
+    def write_state(self, kinds):
+        """Write the changed kinds of state to storage (called by the
+        persistence writer, which retries the kinds if an error is raised).
+
+        Arguments:
+            :kinds: The set of changed kinds (BLOCKS, OPEN_TRANSACTIONS,
+            PEER_NODES).
+        """
+        with self.__lock.read_lock():
+            open_transactions = self.__open_transactions.transactions()
+            peer_nodes = self.__peer_nodes
+        # The open transactions are copied before the blocks are written, so
+        # transactions which left them for a block are in the block log.
+        if BLOCKS in kinds:
+            self.__chain.save()
+            self.save_checkpoint()
+        if OPEN_TRANSACTIONS in kinds:
+            self.__storage.save_open_transactions(open_transactions)
+        if PEER_NODES in kinds:
+            self.__storage.save_peer_nodes(peer_nodes)
+
+    def close(self):
+        """Write all queued changes, stop the persistence writer and close the
+        connections to the peer nodes and the memory mapping of the block log
+        (so a new Blockchain can open the same files)."""
+        self.__writer.close()
+        self.__peer_client.close()
+        self.__storage.close()
+
+    def proof_of_work(self, header, cancel_event=None):
+        """Generate a proof of work for a block header.
+
+        Arguments:
+            :header: The header of the new block (see
+            hash_utils.block_header()).
+            :cancel_event: An optional threading.Event which cancels the
+            search; None is returned then.
+        """
+        return miner.proof_of_work(header, MINING_WORKERS, cancel_event)
 
     def get_balance(self, sender=None):
         """Calculate and return balance of the participant.
+
+        Arguments:
+            :sender: The participant (default: the hosting node's key).
         """
         if sender is None:
             if self.public_key is None:
@@ -147,55 +279,37 @@ class Blockchain:
             participant = self.public_key
         else:
             participant = sender
-
-        tx_sender = [
-            [
-                tx.amount for tx in block.transactions
-                if tx.sender == participant
-            ]
-            for block in self.__chain
-        ]
-
-        open_tx_sender = [
-            tx.amount
-            for tx in self.__open_transactions
-            if tx.sender == participant
-        ]
-        tx_sender.append(open_tx_sender)
-        print(tx_sender)
-
-        amount_sent = reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt)
-                             if len(tx_amt) > 0 else tx_sum + 0, tx_sender, 0)
-
-        tx_recipient = [
-            [
-                tx.amount for tx in block.transactions
-                if tx.recipient == participant
-            ]
-            for block in self.__chain
-        ]
-
-        amount_recieved = reduce(
-            lambda tx_sum, tx_amt: tx_sum + sum(tx_amt)
-            if len(tx_amt) > 0 else tx_sum + 0,
-            tx_recipient,
-            0
-        )
         # Returns total balance.
-        return amount_recieved - amount_sent
+        with self.__lock.read_lock():
+            return self.__ledger.get_balance(participant)
+
+    def mempool_status(self):
+        """Return the usage and limits of the mempool."""
+        with self.__lock.read_lock():
+            return self.__open_transactions.status()
+
+    def has_open_transaction(self, tx_id):
+        """Return whether a transaction is open (e.g. to tell a duplicate
+        from an invalid transaction).
+
+        Arguments:
+            :tx_id: The id of the transaction (see Transaction.tx_id()).
+        """
+        return tx_id in self.__open_transactions
 
     def get_last_blockchain_value(self):
         """Returns the last value of the current blockchain."""
         if len(self.__chain) < 1:
             return None
-        return self.__chain[-1]
+        return self.chain.tip
 
     def add_transaction(self,
                         recipient,
                         sender,
                         signature,
                         amount=1.0,
-                        is_receiving=False):
+                        is_receiving=False,
+                        broadcast=True):
         """Append new value as well as last value to blockchain.
 
         Arguments:
@@ -203,153 +317,464 @@ class Blockchain:
             :recipient: The recipient of the coin.
             :amount: The amount of coin sent with the transaction.
             :signature: The signature of the sender.
+            :is_receiving: Whether the transaction was received from a peer
+            (it is not broadcast then).
+            :broadcast: Whether the transaction is broadcast to the peers in
+            the background (see broadcast_transaction()).
+
+        Raises MempoolFullError if the transaction is valid but does not fit
+        into the limits of the mempool.
         """
         transaction = Transaction(sender, recipient, signature, amount)
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.save_data()
-            if not is_receiving:
-                for node in self.__peer_nodes:
-                    url = 'http://{}/broadcast-transaction'.format(node)
-                    try:
-                        response = requests.post(url,
-                                                 json={
-                                                     'sender': sender,
-                                                     'recipient': recipient,
-                                                     'amount': amount,
-                                                     'signature': signature
-                                                 })
-                        if (response.status_code == 400 or
-                                response.status_code == 500):
-                            print('Transaction declined, needs to resolve')
-                            return False
-                    except requests.exceptions.ConnectionError:
-                        continue
-            return True
-        return False
-
-    def mine_block(self):
-        """Create a new block and add open transactions to it."""
+        # Fields which can not be stored are rejected.
+        if not transaction.has_valid_fields():
+            return False
+        # Duplicates are rejected (see has_open_transaction()).
+        if transaction.tx_id() in self.__open_transactions:
+            return False
+        # Check the signature before taking the lock, the check under the
+        # lock then hits the verification cache.
+        if not Verification.verify_transaction(transaction, self.get_balance,
+                                               check_funds=False):
+            return False
+        with self.__lock.write_lock():
+            if not Verification.verify_transaction(transaction,
+                                                   self.get_balance) or \
+                    transaction.tx_id() in self.__open_transactions:
+                return False
+            for tx in self.__open_transactions.make_room(transaction):
+                self.__ledger.remove_pending(tx)
+            self.__open_transactions.add(transaction)
+            self.__ledger.add_pending(transaction)
+            ticket = self.save_open_transactions()
+        self.wait_saved(ticket)
+        if broadcast and not is_receiving:
+            self.broadcast_transaction(transaction)
+        return True
+
+    def broadcast_transaction(self, transaction):
+        """Send a transaction to all peer nodes concurrently, returns the
+        peer_client.Broadcast right away.
+
+        Arguments:
+            :transaction: The transaction which should be broadcast.
+        """
+        def on_response(node, response, timeout):
+            if response.status_code == 400 or response.status_code == 500:
+                print('Transaction declined by {}, needs to resolve'.format(
+                    node))
+
+        return self.__peer_client.broadcast(
+            self.__peer_nodes, '/broadcast-transaction', on_response,
+            json=transaction.to_dict())
+
+    def broadcast_block(self, block):
+        """Send a block to all peer nodes concurrently, returns the
+        peer_client.Broadcast right away.
+
+        Blocks are sent as CompactBlock: peers rebuild them from their
+        mempool and answer 202 with the ids of the transactions they are
+        missing, which are then sent along in a second message. Peers which
+        do not know compact blocks get the full block as JSON, the only
+        format older nodes accept on /broadcast-block.
+
+        Arguments:
+            :block: The block which should be broadcast.
+        """
+        headers = {'Content-Type': codec.BINARY_MIMETYPE}
+
+        def on_response(node, response, timeout):
+            # The follow-up messages only get the time left of the
+            # broadcast deadline.
+            follow_up = None
+            if response.status_code == 202:
+                missing = set(response.json().get('missing', []))
+                follow_up = response = self.__peer_client.post(
+                    node, '/broadcast-compact-block', headers=headers,
+                    timeout=timeout, data=codec.encode_compact_block(
+                        CompactBlock.from_block(block, missing)))
+            elif response.status_code == 404:
+                follow_up = response = self.__peer_client.post(
+                    node, '/broadcast-block', timeout=timeout,
+                    json={'block': block.to_dict()})
+            if response.status_code == 400 or response.status_code == 500:
+                print('BLock declined by {}, needs to resolve'.format(node))
+            if response.status_code == 409:
+                self.resolve_conflicts = True
+            return follow_up
+
+        if block.merkle_root is None:
+            return self.__peer_client.broadcast(
+                self.__peer_nodes, '/broadcast-block', on_response,
+                json={'block': block.to_dict()})
+        return self.__peer_client.broadcast(
+            self.__peer_nodes, '/broadcast-compact-block', on_response,
+            data=codec.encode_compact_block(CompactBlock.from_block(block)),
+            headers=headers)
+
+    def mine_block(self, cancel_event=None, broadcast=True):
+        """Create a new block and add open transactions to it.
+
+        The transactions are selected by block_template.build_template(), so
+        the size of the block is bounded; the remaining ones stay open. The
+        proof of work is searched without holding the lock, so other
+        requests are served meanwhile. If the tip of the chain changed in the
+        meantime, the stale block is discarded and None is returned.
+
+        Arguments:
+            :cancel_event: An optional threading.Event which cancels mining.
+            :broadcast: Whether the block is broadcast to the peers in the
+            background (see broadcast_block()).
+        """
         if self.public_key is None:
             return None
 
-        last_block = self.__chain[-1]
-        hashed_block = hash_block(last_block)
-        proof = self.proof_of_work()
+        with self.__lock.read_lock():
+            last_block = self.__chain[-1]
+            open_transactions = self.__open_transactions.transactions()
+        hashed_block = last_block.hash()
 
+        # The mined balances only change with the tip, which is checked
+        # again before the block is added.
+        copied_transaction = build_template(
+            open_transactions, self.__ledger.get_mined_balance,
+            priority=self.__open_transactions.priority)
         # Miners should be rewarded for there work.
         reward_transaction = Transaction(
             "MINING", self.public_key, '', MINING_REWARD)
+        copied_transaction.append(reward_transaction)
+
+        # The proof of work covers the fixed-size header only.
+        index = last_block.index + 1
+        root = merkle_root(copied_transaction)
+        timestamp = time()
+        proof = self.proof_of_work(
+            block_header(index, hashed_block, root, timestamp), cancel_event)
+        if proof is None:
+            return None
 
-        copied_transaction = self.__open_transactions[:]
-        for tx in copied_transaction:
-            if not Wallet.verify_transaction(tx):
+        with self.__lock.write_lock():
+            # Blocks are decoded again when evicted from the block cache, so
+            # the tip is compared by hash.
+            if self.__chain[-1].hash() != hashed_block:
+                print('Chain changed while mining, block discarded')
                 return None
-        copied_transaction.append(reward_transaction)
-        block = Block(len(self.__chain), hashed_block,
-                      copied_transaction, proof)
-
-        self.__chain.append(block)
-        # Resets the open_transaction to an empty list.
-        self.__open_transactions = []
-        self.save_data()
-        for node in self.__peer_nodes:
-            url = 'http://{}/broadcast-block'.format(node)
-            converted_block = block.__dict__.copy()
-            converted_block['transactions'] = [
-                tx.__dict__ for tx in converted_block['transactions']]
-            try:
-                response = requests.post(url, json={'block': converted_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('BLock declined, needs to resolve')
-                if response.status_code == 409:
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
-                continue
+            block = Block(index, hashed_block, copied_transaction, proof,
+                          timestamp, root)
+
+            self.__chain.append(block)
+            self.__ledger.apply_block(block)
+            # Removes the mined transactions; transactions which arrived
+            # while mining stay open for the next block.
+            for tx in self.__open_transactions.remove_all(copied_transaction):
+                self.__ledger.remove_pending(tx)
+            ticket = self.__writer.request(BLOCKS, OPEN_TRANSACTIONS)
+        try:
+            self.wait_saved(ticket)
+        finally:
+            # The block was added even if saving it failed.
+            self.notify_chain_listeners()
+        if broadcast:
+            self.broadcast_block(block)
         return block
 
+    def reconstruct_block(self, compact):
+        """Rebuild a block received as CompactBlock from the open
+        transactions.
+
+        Returns the block and an empty list, or None and the ids of the
+        transactions which are missing.
+
+        Arguments:
+            :compact: The CompactBlock which was received.
+        """
+        with self.__lock.read_lock():
+            block = compact.to_block(self.__open_transactions.get)
+            if block is None:
+                return None, compact.missing(self.__open_transactions.get)
+        return block, []
+
     def add_block(self, block):
         """Add a block which was received via broadcasting to the local
-        blockchain."""
-        transactions = [Transaction(
-            tx['sender'],
-            tx['recipient'],
-            tx['signature'],
-            tx['amount'])
-            for tx in block['transactions']]
+        blockchain.
+
+        Arguments:
+            :block: The Block or its dict representation.
+        """
+        try:
+            if isinstance(block, Block):
+                converted_block = block
+            else:
+                converted_block = Block.from_dict(block)
+        except (KeyError, TypeError, ValueError):
+            return False
+        if not converted_block.has_valid_fields() or \
+                not all(tx.has_valid_fields()
+                        for tx in converted_block.transactions):
+            return False
+        proof_is_valid = Verification.valid_block_proof(converted_block)
+
+        with self.__lock.write_lock():
+            hashes_matched = self.__chain[-1].hash() == \
+                converted_block.previous_hash
+            if not proof_is_valid or not hashes_matched:
+                return False
+
+            self.__chain.append(converted_block)
+            self.__ledger.apply_block(converted_block)
+            # Evicts the included transactions by id.
+            for tx in self.__open_transactions.remove_all(
+                    converted_block.transactions):
+                self.__ledger.remove_pending(tx)
+            ticket = self.__writer.request(BLOCKS, OPEN_TRANSACTIONS)
+        self.wait_saved(ticket)
+        self.notify_chain_listeners()
+        return True
+
+    def fetch_chain(self, node):
+        """Download the chain of a peer node, returns None if it can not be
+        downloaded or decoded.
+
+        Arguments:
+            :node: The address of the peer node.
+        """
+        try:
+            response = self.__peer_client.get(
+                node, '/chain', headers={'Accept': codec.BINARY_MIMETYPE})
+            # Peers which do not speak the binary format answer in JSON.
+            return codec.decode_blocks(response.content)
+        except PEER_ERRORS + (KeyError, TypeError, ValueError,
+                              struct.error):
+            return None
+
+    def find_common_ancestor(self, node, peer_length):
+        """Return the height of the last block which the local chain shares
+        with the chain of a peer node (-1: none), None if the peer has no
+        /headers endpoint.
+
+        The headers of the peer are compared from the top down in pages
+        which double in size, so a peer which only extends the local chain
+        costs a single header.
+
+        Arguments:
+            :node: The address of the peer node.
+            :peer_length: The length of the peer's chain.
+        """
+        height = min(len(self.__chain), peer_length) - 1
+        page = 1
+        while height >= 0:
+            start = max(height - page + 1, 0)
+            response = self.__peer_client.get(
+                node, '/headers', params={'start': start, 'stop': height + 1})
+            if response.status_code == 404:
+                return None
+            for header in reversed(response.json()):
+                if header['hash'] == self.__chain[header['index']].hash():
+                    return header['index']
+            height = start - 1
+            page = min(page * 2, SYNC_PAGE_SIZE)
+        return -1
+
+    def fetch_missing_blocks(self, node, peer_length):
+        """Download the blocks of a peer's chain which the local chain is
+        missing, in pages.
+
+        Returns the height of the common ancestor and the blocks after it,
+        or None if they can not be downloaded or decoded. Peers without the
+        /headers and /blocks endpoints send their whole chain, the common
+        ancestor is searched locally then.
+
+        Arguments:
+            :node: The address of the peer node.
+            :peer_length: The length of the peer's chain (None: unknown).
+        """
+        try:
+            ancestor = None
+            if peer_length is not None:
+                ancestor = self.find_common_ancestor(node, peer_length)
+            if ancestor is None:
+                chain = self.fetch_chain(node)
+                if chain is None:
+                    return None
+                # Find the common ancestor locally.
+                ancestor = -1
+                for height in range(min(len(chain), len(self.__chain))):
+                    if chain[height].hash() != self.__chain[height].hash():
+                        break
+                    ancestor = height
+                return ancestor, chain[ancestor + 1:]
+            blocks = list()
+            start = ancestor + 1
+            while start < peer_length:
+                response = self.__peer_client.get(
+                    node, '/blocks',
+                    params={'start': start,
+                            'stop': min(start + SYNC_PAGE_SIZE, peer_length)},
+                    headers={'Accept': codec.BINARY_MIMETYPE})
+                page = codec.decode_blocks(response.content)
+                if not page:
+                    break
+                blocks.extend(page)
+                start += len(page)
+            return ancestor, blocks
+        except PEER_ERRORS + (ValueError, KeyError, TypeError, IndexError,
+                              struct.error):
+            return None
 
-        proof_is_valid = Verification.valid_proof(
-            transactions[:-1], block['previous_hash'], block['proof'])
+    def valid_missing_blocks(self, ancestor, blocks, local_length):
+        """Verify that downloaded blocks make a longer valid chain on top of
+        the local block at the height ancestor.
+
+        Arguments:
+            :ancestor: The height of the common ancestor (-1: none).
+            :blocks: The blocks after the ancestor.
+            :local_length: The length of the local chain.
+        """
+        if ancestor + 1 + len(blocks) <= local_length:
+            return False
+        if ancestor >= 0:
+            blocks = [self.__chain[ancestor]] + blocks
+        return Verification.verify_chain(blocks, check_signatures=True)
+
+    def find_longer_chains(self, local_length):
+        """Query the chain length of all peer nodes concurrently, returns
+        (node, length) of the peers whose chain is longer than local_length,
+        longest first.
+
+        Peers which do not report their length (older nodes without
+        /chain/tip) follow at the end with the length None; unreachable
+        peers are left out.
+
+        Arguments:
+            :local_length: The length of the local chain.
+        """
+        peer_nodes = list(self.__peer_nodes)
+        responses = self.__peer_client.get_all(peer_nodes, '/chain/tip')
+        candidates = list()
+        unknown = list()
+        for node in peer_nodes:
+            if node not in responses:
+                continue
+            try:
+                length = int(responses[node].json()['length'])
+            except (ValueError, KeyError, TypeError):
+                unknown.append((node, None))
+                continue
+            if length > local_length:
+                candidates.append((node, length))
+        candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        return candidates + unknown
 
-        hashes_matched = hash_block(self.chain[-1]) == block['previous_hash']
+    def resolve(self):
+        """Checks all peer nodes' blockchains and adopts the longest valid
+        one.
 
-        if not proof_is_valid or not hashes_matched:
+        Only peers which report a longer chain are synced with, from the
+        longest down until one is valid. Only the blocks after the common
+        ancestor are downloaded; the blocks of the next peer are downloaded
+        while the current ones are verified.
+        """
+        local_length = len(self.__chain)
+        candidates = self.find_longer_chains(local_length)
+        winner = None
+        if candidates:
+            download = self.__peer_client.submit(self.fetch_missing_blocks,
+                                                 *candidates[0])
+        for position in range(len(candidates)):
+            missing = download.result()
+            if position + 1 < len(candidates):
+                download = self.__peer_client.submit(
+                    self.fetch_missing_blocks, *candidates[position + 1])
+            if missing is not None and \
+                    self.valid_missing_blocks(*missing, local_length):
+                winner = missing
+                download.cancel()
+                break
+        self.resolve_conflicts = False
+        if winner is None:
             return False
+        return self.adopt_blocks(*winner)
 
-        converted_block = Block(
-            block['index'],
-            block['previous_hash'],
-            transactions, block['proof'],
-            block['timestamp'])
-
-        self.__chain.append(converted_block)
-        stored_transactions = self.__open_transactions[:]
-
-        for itx in block['transactions']:
-            for open_tx in stored_transactions:
-                if open_tx.sender == itx['sender'] and \
-                        open_tx.recipient == itx['recipient'] and \
-                        open_tx.amount == itx['amount'] and \
-                        open_tx.signature == itx['signature']:
-                    try:
-                        self.__open_transactions.remove(open_tx)
-                    except ValueError:
-                        print('Item was already removed')
-        self.save_data()
+    def adopt_blocks(self, ancestor, blocks):
+        """Replace the blocks after the height ancestor with verified blocks
+        of a longer chain, returns False if the local chain changed so that
+        they no longer fit or are no longer longer.
+
+        On a fork, only the blocks after the fork point are rolled back: the
+        block log is truncated there, the balances are reverted block by
+        block and the still valid transactions of the orphaned blocks are
+        put back into the mempool. The cost depends on the depth of the
+        fork, not on the length of the chain.
+
+        Arguments:
+            :ancestor: The height of the common ancestor (-1: none).
+            :blocks: The blocks after the ancestor.
+        """
+        with self.__lock.write_lock():
+            length = len(self.__chain)
+            if ancestor + 1 + len(blocks) <= length or ancestor >= length:
+                return False
+            if ancestor >= 0 and \
+                    self.__chain[ancestor].hash() != blocks[0].previous_hash:
+                return False
+            orphaned = self.__chain[ancestor + 1:]
+            if orphaned:
+                # Roll back to the fork point.
+                self.__chain.truncate(ancestor + 1)
+                for block in reversed(orphaned):
+                    self.__ledger.revert_block(block)
+                self.__checkpoint_height = min(self.__checkpoint_height,
+                                               ancestor + 1)
+                with self.__verifier_lock:
+                    self.__verifier.rewind(self.__chain, ancestor + 1)
+            for block in blocks:
+                self.__chain.append(block)
+                self.__ledger.apply_block(block)
+                for tx in self.__open_transactions.remove_all(
+                        block.transactions):
+                    self.__ledger.remove_pending(tx)
+            if orphaned:
+                self.requeue_transactions(orphaned, blocks)
+            ticket = self.__writer.request(BLOCKS, OPEN_TRANSACTIONS)
+        self.wait_saved(ticket)
+        self.notify_chain_listeners()
         return True
 
-    def resolve(self):
-        """Checks all peer nodes' blockchains and replaces the local one with
-        longer valid ones."""
-        winner_chain = self.chain
-        replace = False
-        for node in self.__peer_nodes:
-            url = 'http://{}/chain'.format(node)
+    def requeue_transactions(self, orphaned, adopted):
+        """Rebuild the open transactions after a reorganization (called
+        with the lock held).
+
+        The transactions of the orphaned blocks (except the mining rewards)
+        and the open transactions are put back in this order if their
+        signature is valid, their sender can still pay them and they are not
+        included in the adopted blocks.
+
+        Arguments:
+            :orphaned: The blocks which were rolled back.
+            :adopted: The blocks which replaced them.
+        """
+        included = set(tx.tx_id() for block in adopted
+                       for tx in block.transactions)
+        # The last transaction of a block is the mining reward.
+        candidates = [tx for block in orphaned
+                      for tx in block.transactions[:-1]]
+        candidates.extend(self.__open_transactions)
+        candidates = [tx for tx in candidates if tx.tx_id() not in included]
+        results = Verification.verify_signatures(candidates)
+        self.__open_transactions = Mempool()
+        self.__ledger.reset_pending([])
+        for tx, valid in zip(candidates, results):
+            if not valid or tx.tx_id() in self.__open_transactions or \
+                    tx.amount > self.__ledger.get_balance(tx.sender):
+                continue
             try:
-                response = requests.get(url)
-                node_chain = response.json()
-
-                node_chain = [
-                    Block(block['index'],
-                          block['previous_hash'],
-                          [
-                              Transaction(
-                                  tx['sender'],
-                                  tx['recipient'],
-                                  tx['signature'],
-                                  tx['amount']) for tx in block['transactions']
-                    ],
-                        block['proof'],
-                        block['timestamp']) for block in node_chain
-                ]
-
-                node_chain_length = len(node_chain)
-                local_chain_length = len(winner_chain)
-
-                if node_chain_length > local_chain_length and \
-                        Verification.verify_chain(node_chain):
-                    winner_chain = node_chain
-                    replace = True
-
-            except requests.exceptions.ConnectionError:
+                evicted = self.__open_transactions.make_room(tx)
+            except MempoolFullError:
                 continue
-        self.resolve_conflicts = False
-        # Replace the local chain with the winner chain
-        self.chain = winner_chain
-        if replace:
-            self.__open_transactions = []
-        self.save_data()
-        return replace
+            for evicted_tx in evicted:
+                self.__ledger.remove_pending(evicted_tx)
+            self.__open_transactions.add(tx)
+            self.__ledger.add_pending(tx)
 
     def add_peer_node(self, node):
         """Adds a new node to the peer node set.
@@ -357,8 +782,12 @@ class Blockchain:
         Arguments:
             :node: The node URL which should be added.
         """
-        self.__peer_nodes.add(node)
-        self.save_data()
+        with self.__lock.write_lock():
+            # The set is replaced, not changed, so broadcasts can iterate
+            # over it without a lock.
+            self.__peer_nodes = self.__peer_nodes | {node}
+            ticket = self.save_peer_nodes()
+        self.wait_saved(ticket)
 
     def remove_peer_node(self, node):
         """Removes a node from the peer node set.
@@ -366,8 +795,11 @@ class Blockchain:
         Arguments:
             :node: The node URL which should be removed.
         """
-        self.__peer_nodes.discard(node)
-        self.save_data()
+        with self.__lock.write_lock():
+            self.__peer_nodes = self.__peer_nodes - {node}
+            ticket = self.save_peer_nodes()
+        self.__peer_client.remove(node)
+        self.wait_saved(ticket)
 
     def get_peer_nodes(self):
         """Return a list of all connected peer nodes."""
@@ -0,0 +1,66 @@
+"""Selects the transactions of the next block from the open transactions."""
+
+from mempool import transaction_size
+from utility.verification import Verification
+
+# The maximum number of transactions of a block (without the mining reward).
+MAX_BLOCK_TRANSACTIONS = 1000
+# The maximum total size (in bytes, see mempool.transaction_size()) of the
+# transactions of a block (without the mining reward).
+MAX_BLOCK_BYTES = 1024 * 1024
+
+
+def build_template(transactions, get_balance, max_count=None, max_bytes=None,
+                   priority=None):
+    """Return the transactions which go into the next block.
+
+    The transactions are taken in arrival order (or by descending priority,
+    ties in arrival order) until the maximum count or size is reached.
+    Transactions with an invalid signature or whose sender can not pay them
+    from the mined balance are skipped; they and the transactions beyond the
+    limits stay open for later blocks.
+
+    Arguments:
+        :transactions: The open transactions in arrival order.
+        :get_balance: A callable returning the balance of an address in the
+        mined blocks (without open transactions).
+        :max_count: The maximum number of transactions (default:
+        MAX_BLOCK_TRANSACTIONS).
+        :max_bytes: The maximum total size of the transactions (default:
+        MAX_BLOCK_BYTES).
+        :priority: An optional callable returning the priority of a
+        transaction (see mempool.PRIORITY).
+    """
+    max_count = MAX_BLOCK_TRANSACTIONS if max_count is None else max_count
+    max_bytes = MAX_BLOCK_BYTES if max_bytes is None else max_bytes
+    if priority is not None:
+        # The sort is stable, also in reverse.
+        transactions = sorted(transactions, key=priority, reverse=True)
+    selected = list()
+    selected_size = 0
+    spent = dict()
+    position = 0
+    while position < len(transactions):
+        # Takes the next transactions which fit into the remaining room and
+        # verifies their signatures as one batch.
+        batch = list()
+        batch_size = 0
+        while position < len(transactions) and \
+                len(selected) + len(batch) < max_count:
+            tx_size = transaction_size(transactions[position])
+            if selected_size + batch_size + tx_size > max_bytes:
+                break
+            batch.append((transactions[position], tx_size))
+            batch_size += tx_size
+            position += 1
+        if not batch:
+            break
+        results = Verification.verify_signatures([tx for tx, _ in batch])
+        for (tx, tx_size), valid in zip(batch, results):
+            amount = spent.get(tx.sender, 0) + tx.amount
+            if not valid or amount > get_balance(tx.sender):
+                continue
+            selected.append(tx)
+            selected_size += tx_size
+            spent[tx.sender] = amount
+    return selected
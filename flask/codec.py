@@ -0,0 +1,365 @@
+"""Provides the compact binary encoding of blocks and transactions.
+
+Hex strings (RSA and Ed25519 keys, signatures, hashes) are stored as raw
+bytes, numbers as fixed-width integers or doubles and every address is
+stored once in an address table which the transactions refer to by id.
+Payloads which start with '{' or '[' are decoded as JSON, so data written by
+older versions stays readable.
+"""
+
+import binascii
+import json
+import struct
+
+from block import Block
+from compact_block import CompactBlock
+from transaction import Transaction
+
+# The version of the binary block/transaction encoding.
+FORMAT_VERSION = 3
+# The versions which can still be decoded (1: blocks without Merkle root,
+# 2: no Ed25519 string tag).
+SUPPORTED_VERSIONS = (1, 2, 3)
+# The mimetype used for binary payloads exchanged with peers.
+BINARY_MIMETYPE = 'application/octet-stream'
+
+UINT8 = struct.Struct('>B')
+UINT32 = struct.Struct('>I')
+UINT64 = struct.Struct('>Q')
+INT64 = struct.Struct('>q')
+DOUBLE = struct.Struct('>d')
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# Type tags of encoded values.
+TAG_INT = b'i'
+TAG_FLOAT = b'f'
+TAG_HEX = b'h'
+TAG_TEXT = b'u'
+TAG_ED25519 = b'e'
+# The prefix of Ed25519 keys and signatures (see wallet.ED25519_PREFIX).
+ED25519_PREFIX = 'ed25519:'
+
+
+class AddressTable:
+    """Maps addresses (sender and recipient keys) to compact integer ids.
+
+    Attributes:
+        :addresses: The list of known addresses, the position is the id.
+    """
+
+    def __init__(self, addresses=None):
+        self.addresses = list()
+        self.__ids = dict()
+        for address in addresses or []:
+            self.add(address)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def add(self, address):
+        """Return the id of an address, assigning a new one if unknown.
+
+        Arguments:
+            :address: The address which should be looked up.
+        """
+        address_id = self.__ids.get(address)
+        if address_id is None:
+            address_id = len(self.addresses)
+            self.addresses.append(address)
+            self.__ids[address] = address_id
+        return address_id
+
+    def get(self, address_id):
+        """Return the address of an id."""
+        return self.addresses[address_id]
+
+    def truncate(self, length):
+        """Forget the addresses added after the first length ones.
+
+        Arguments:
+            :length: The number of addresses which are kept.
+        """
+        for address in self.addresses[length:]:
+            del self.__ids[address]
+        del self.addresses[length:]
+
+
+class Reader:
+    """Reads encoded values sequentially from a bytes buffer."""
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, layout):
+        value, = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return value
+
+    def read(self, length):
+        value = bytes(self.data[self.offset:self.offset + length])
+        if len(value) < length:
+            raise ValueError('Truncated payload')
+        self.offset += length
+        return value
+
+
+def encode_number(value):
+    """Encode an int or float keeping its type (str() of it is hashed).
+
+    Raises ValueError for other types (also bool, which would be decoded as
+    int) and ints which do not fit into 64 bits.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Can not encode {!r} as number'.format(value))
+    if isinstance(value, int):
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise ValueError('Integer {} out of range'.format(value))
+        return TAG_INT + INT64.pack(value)
+    return TAG_FLOAT + DOUBLE.pack(value)
+
+
+def decode_number(reader):
+    tag = reader.read(1)
+    if tag == TAG_INT:
+        return reader.unpack(INT64)
+    if tag == TAG_FLOAT:
+        return reader.unpack(DOUBLE)
+    raise ValueError('Unknown number tag {!r}'.format(tag))
+
+
+def unhexlify_exact(value):
+    """Return the bytes of a lowercase hex string or None for other strings.
+    """
+    try:
+        raw = binascii.unhexlify(value)
+    except (binascii.Error, ValueError):
+        return None
+    if not value or binascii.hexlify(raw).decode('ascii') != value:
+        return None
+    return raw
+
+
+def encode_string(value):
+    """Encode a string, storing lowercase hex strings (also tagged Ed25519
+    keys and signatures) as raw bytes.
+
+    Raises ValueError if the value is not a string.
+    """
+    if not isinstance(value, str):
+        raise ValueError('Can not encode {!r} as string'.format(value))
+    tag = TAG_HEX
+    raw = unhexlify_exact(value)
+    if raw is None and value.startswith(ED25519_PREFIX):
+        tag = TAG_ED25519
+        raw = unhexlify_exact(value[len(ED25519_PREFIX):])
+    if raw is not None:
+        return tag + UINT32.pack(len(raw)) + raw
+    raw = value.encode('utf8')
+    return TAG_TEXT + UINT32.pack(len(raw)) + raw
+
+
+def decode_string(reader):
+    tag = reader.read(1)
+    raw = reader.read(reader.unpack(UINT32))
+    if tag == TAG_HEX:
+        return binascii.hexlify(raw).decode('ascii')
+    if tag == TAG_ED25519:
+        return ED25519_PREFIX + binascii.hexlify(raw).decode('ascii')
+    if tag == TAG_TEXT:
+        return raw.decode('utf8')
+    raise ValueError('Unknown string tag {!r}'.format(tag))
+
+
+def encode_transaction(tx, addresses):
+    """Encode a transaction, registering its addresses in the table.
+
+    Arguments:
+        :tx: The transaction which should be encoded.
+        :addresses: The AddressTable the address ids refer to.
+    """
+    return (UINT32.pack(addresses.add(tx.sender)) +
+            UINT32.pack(addresses.add(tx.recipient)) +
+            encode_number(tx.amount) +
+            encode_string(tx.signature))
+
+
+def decode_transaction(reader, addresses):
+    sender = addresses.get(reader.unpack(UINT32))
+    recipient = addresses.get(reader.unpack(UINT32))
+    amount = decode_number(reader)
+    signature = decode_string(reader)
+    return Transaction(sender, recipient, signature, amount)
+
+
+def encode_block(block, addresses):
+    """Encode a block, registering its addresses in the table.
+
+    Arguments:
+        :block: The block which should be encoded.
+        :addresses: The AddressTable the address ids refer to.
+    """
+    parts = [UINT8.pack(FORMAT_VERSION),
+             UINT64.pack(block.index),
+             encode_string(block.previous_hash),
+             encode_number(block.timestamp),
+             encode_number(block.proof),
+             # An empty string marks a block without Merkle root.
+             encode_string(block.merkle_root or ''),
+             UINT32.pack(len(block.transactions))]
+    parts.extend(encode_transaction(tx, addresses)
+                 for tx in block.transactions)
+    return b''.join(parts)
+
+
+def decode_block(payload, addresses):
+    """Decode a block encoded by encode_block() or as JSON.
+
+    Arguments:
+        :payload: The encoded block.
+        :addresses: The AddressTable the address ids refer to.
+    """
+    if payload[:1] == b'{':
+        return Block.from_dict(json.loads(bytes(payload).decode()))
+    reader = Reader(payload)
+    version = reader.unpack(UINT8)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unknown block format version {}'.format(version))
+    index = reader.unpack(UINT64)
+    previous_hash = decode_string(reader)
+    timestamp = decode_number(reader)
+    proof = decode_number(reader)
+    root = None
+    if version >= 2:
+        root = decode_string(reader) or None
+    transactions = [decode_transaction(reader, addresses)
+                    for _ in range(reader.unpack(UINT32))]
+    return Block(index, previous_hash, transactions, proof, timestamp, root)
+
+
+def encode_address_table(addresses):
+    """Encode a whole address table."""
+    return UINT32.pack(len(addresses)) + b''.join(
+        encode_string(address) for address in addresses.addresses)
+
+
+def decode_address_table(reader):
+    return AddressTable(decode_string(reader)
+                        for _ in range(reader.unpack(UINT32)))
+
+
+def encode_blocks(blocks):
+    """Encode a list of blocks into a self-contained payload (e.g. for peers).
+
+    Arguments:
+        :blocks: The blocks which should be encoded.
+    """
+    addresses = AddressTable()
+    encoded = [encode_block(block, addresses) for block in blocks]
+    return (UINT8.pack(FORMAT_VERSION) + encode_address_table(addresses) +
+            UINT32.pack(len(encoded)) +
+            b''.join(UINT32.pack(len(block)) + block for block in encoded))
+
+
+def decode_blocks(data):
+    """Decode a payload created by encode_blocks() or a JSON list of blocks.
+
+    Arguments:
+        :data: The encoded blocks.
+    """
+    if data[:1] == b'[':
+        return [Block.from_dict(block)
+                for block in json.loads(bytes(data).decode())]
+    reader = Reader(data)
+    version = reader.unpack(UINT8)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unknown format version {}'.format(version))
+    addresses = decode_address_table(reader)
+    blocks = list()
+    for _ in range(reader.unpack(UINT32)):
+        length = reader.unpack(UINT32)
+        blocks.append(decode_block(reader.read(length), addresses))
+    return blocks
+
+
+def encode_compact_block(compact):
+    """Encode a CompactBlock into a self-contained payload for peers.
+
+    The transaction ids are stored as raw 32 byte hashes.
+
+    Arguments:
+        :compact: The CompactBlock which should be encoded.
+    """
+    addresses = AddressTable()
+    prefilled = b''.join(UINT32.pack(position) +
+                         encode_transaction(tx, addresses)
+                         for position, tx in sorted(compact.prefilled.items()))
+    return b''.join([UINT8.pack(FORMAT_VERSION),
+                     UINT64.pack(compact.index),
+                     encode_string(compact.previous_hash),
+                     encode_number(compact.timestamp),
+                     encode_number(compact.proof),
+                     encode_string(compact.merkle_root),
+                     UINT32.pack(len(compact.tx_ids))] +
+                    [encode_string(tx_id) for tx_id in compact.tx_ids] +
+                    [encode_address_table(addresses),
+                     UINT32.pack(len(compact.prefilled)),
+                     prefilled])
+
+
+def decode_compact_block(data):
+    """Decode a payload created by encode_compact_block().
+
+    Arguments:
+        :data: The encoded CompactBlock.
+    """
+    reader = Reader(data)
+    version = reader.unpack(UINT8)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unknown format version {}'.format(version))
+    index = reader.unpack(UINT64)
+    previous_hash = decode_string(reader)
+    timestamp = decode_number(reader)
+    proof = decode_number(reader)
+    root = decode_string(reader)
+    tx_ids = [decode_string(reader) for _ in range(reader.unpack(UINT32))]
+    addresses = decode_address_table(reader)
+    prefilled = dict()
+    for _ in range(reader.unpack(UINT32)):
+        position = reader.unpack(UINT32)
+        if position >= len(tx_ids):
+            raise ValueError('Prefilled transaction out of range')
+        prefilled[position] = decode_transaction(reader, addresses)
+    return CompactBlock(index, previous_hash, timestamp, proof, root, tx_ids,
+                        prefilled)
+
+
+def encode_transactions(transactions):
+    """Encode a list of transactions into a self-contained payload.
+
+    Arguments:
+        :transactions: The transactions which should be encoded.
+    """
+    addresses = AddressTable()
+    encoded = [encode_transaction(tx, addresses) for tx in transactions]
+    return (UINT8.pack(FORMAT_VERSION) + encode_address_table(addresses) +
+            UINT32.pack(len(encoded)) + b''.join(encoded))
+
+
+def decode_transactions(data):
+    """Decode a payload created by encode_transactions() or a JSON list.
+
+    Arguments:
+        :data: The encoded transactions.
+    """
+    if data[:1] == b'[':
+        return [Transaction.from_dict(tx)
+                for tx in json.loads(bytes(data).decode())]
+    reader = Reader(data)
+    version = reader.unpack(UINT8)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError('Unknown format version {}'.format(version))
+    addresses = decode_address_table(reader)
+    return [decode_transaction(reader, addresses)
+            for _ in range(reader.unpack(UINT32))]
@@ -0,0 +1,76 @@
+from block import Block
+
+
+class CompactBlock:
+    """A block announced by its header and the ids of its transactions.
+
+    Peers usually have the transactions of a new block in their mempool
+    already, so only the transactions they can not have (the mining reward)
+    or asked for are sent along in full.
+
+    Attributes:
+        :index: The index of the block.
+        :previous_hash: The hash of the previous block.
+        :timestamp: The timestamp of the block.
+        :proof: The proof of work of the block.
+        :merkle_root: The Merkle root over the transactions.
+        :tx_ids: The ids of the transactions (see Transaction.tx_id()).
+        :prefilled: A dict of the transactions sent in full by position.
+    """
+
+    def __init__(self, index, previous_hash, timestamp, proof, merkle_root,
+                 tx_ids, prefilled):
+        self.index = index
+        self.previous_hash = previous_hash
+        self.timestamp = timestamp
+        self.proof = proof
+        self.merkle_root = merkle_root
+        self.tx_ids = tx_ids
+        self.prefilled = prefilled
+
+    @classmethod
+    def from_block(cls, block, prefilled_ids=()):
+        """Create the compact form of a block.
+
+        Arguments:
+            :block: The block (with a Merkle root).
+            :prefilled_ids: The ids of further transactions which are sent
+            in full, e.g. the ones a peer asked for.
+        """
+        tx_ids = [tx.tx_id() for tx in block.transactions]
+        prefilled = {position: tx
+                     for position, tx in enumerate(block.transactions)
+                     if tx.tx_id() in prefilled_ids}
+        # The last transaction is the mining reward.
+        if block.transactions:
+            prefilled[len(tx_ids) - 1] = block.transactions[-1]
+        return cls(block.index, block.previous_hash, block.timestamp,
+                   block.proof, block.merkle_root, tx_ids, prefilled)
+
+    def missing(self, get_transaction):
+        """Return the ids of the transactions which are neither prefilled nor
+        known.
+
+        Arguments:
+            :get_transaction: A callable returning a known transaction by its
+            id or None, e.g. Mempool.get.
+        """
+        return [tx_id for position, tx_id in enumerate(self.tx_ids)
+                if position not in self.prefilled and
+                get_transaction(tx_id) is None]
+
+    def to_block(self, get_transaction):
+        """Rebuild the block, returns None if a transaction is missing.
+
+        Arguments:
+            :get_transaction: A callable returning a known transaction by its
+            id or None, e.g. Mempool.get.
+        """
+        transactions = list()
+        for position, tx_id in enumerate(self.tx_ids):
+            tx = self.prefilled.get(position) or get_transaction(tx_id)
+            if tx is None:
+                return None
+            transactions.append(tx)
+        return Block(self.index, self.previous_hash, transactions, self.proof,
+                     self.timestamp, self.merkle_root)
@@ -0,0 +1,118 @@
+class BalanceLedger:
+    """Keeps the balance of every address up to date as blocks are added.
+
+    Looking up a balance does not depend on the length of the chain: the
+    totals of the mined blocks are updated once per block and the amounts
+    spent by open transactions are tracked in a separate pending overlay.
+
+    Attributes:
+        :received: The total amount received per address in mined blocks.
+        :sent: The total amount sent per address in mined blocks.
+        :pending: The amount sent per address by open transactions.
+        :pending_count: The number of open transactions per address.
+    """
+
+    def __init__(self):
+        self.received = dict()
+        self.sent = dict()
+        self.pending = dict()
+        self.pending_count = dict()
+
+    def apply_block(self, block):
+        """Add the transactions of a newly appended block to the totals.
+
+        Arguments:
+            :block: The block which was appended to the chain.
+        """
+        for tx in block.transactions:
+            self.sent[tx.sender] = self.sent.get(tx.sender, 0) + tx.amount
+            self.received[tx.recipient] = \
+                self.received.get(tx.recipient, 0) + tx.amount
+
+    def revert_block(self, block):
+        """Remove the transactions of a block which was rolled back (e.g.
+        the block of an abandoned fork) from the totals.
+
+        Arguments:
+            :block: The block which was removed from the tip of the chain.
+        """
+        for tx in block.transactions:
+            self.sent[tx.sender] -= tx.amount
+            self.received[tx.recipient] -= tx.amount
+
+    def rebuild(self, chain, open_transactions):
+        """Recalculate all totals, e.g. after the chain was replaced.
+
+        Arguments:
+            :chain: The blocks of the chain.
+            :open_transactions: The open transactions.
+        """
+        self.received = dict()
+        self.sent = dict()
+        for block in chain:
+            self.apply_block(block)
+        self.reset_pending(open_transactions)
+
+    def snapshot(self):
+        """Return the totals of the mined blocks as a serializable dict."""
+        return {'received': dict(self.received), 'sent': dict(self.sent)}
+
+    def restore(self, state, chain, open_transactions):
+        """Restore the totals of a snapshot and replay the blocks after it.
+
+        Arguments:
+            :state: A dict returned by snapshot().
+            :chain: The blocks which were appended after the snapshot.
+            :open_transactions: The open transactions.
+        """
+        self.received = dict(state['received'])
+        self.sent = dict(state['sent'])
+        for block in chain:
+            self.apply_block(block)
+        self.reset_pending(open_transactions)
+
+    def add_pending(self, transaction):
+        """Add the amount of a new open transaction to the overlay."""
+        self.pending[transaction.sender] = \
+            self.pending.get(transaction.sender, 0) + transaction.amount
+        self.pending_count[transaction.sender] = \
+            self.pending_count.get(transaction.sender, 0) + 1
+
+    def remove_pending(self, transaction):
+        """Remove the amount of a transaction which is no longer open (e.g.
+        because it was added to a block) from the overlay."""
+        sender = transaction.sender
+        count = self.pending_count.get(sender, 0) - 1
+        if count > 0:
+            self.pending_count[sender] = count
+            self.pending[sender] -= transaction.amount
+        else:
+            # Drop the entries instead of keeping float rounding residues.
+            self.pending_count.pop(sender, None)
+            self.pending.pop(sender, None)
+
+    def reset_pending(self, open_transactions):
+        """Recalculate the overlay from the remaining open transactions."""
+        self.pending = dict()
+        self.pending_count = dict()
+        for tx in open_transactions:
+            self.add_pending(tx)
+
+    def get_mined_balance(self, participant):
+        """Return the balance of a participant in the mined blocks only.
+
+        Arguments:
+            :participant: The address whose balance should be returned.
+        """
+        return (self.received.get(participant, 0) -
+                self.sent.get(participant, 0))
+
+    def get_balance(self, participant):
+        """Return the balance of a participant, less its open transactions.
+
+        Arguments:
+            :participant: The address whose balance should be returned.
+        """
+        return (self.received.get(participant, 0) -
+                (self.sent.get(participant, 0) +
+                 self.pending.get(participant, 0)))
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+import json
+
+# The maximum number of open transactions.
+MAX_COUNT = 5000
+# The maximum total size (in bytes, see transaction_size()) of the open
+# transactions.
+MAX_BYTES = 4 * 1024 * 1024
+# The maximum number of open transactions of one sender.
+MAX_PER_SENDER = 100
+# A callable returning the priority of a transaction which decides which
+# transactions are evicted (None: the oldest ones).
+PRIORITY = None
+
+
+class MempoolFullError(Exception):
+    """Raised when a transaction is not admitted to the mempool because of
+    its limits."""
+
+
+def transaction_size(transaction):
+    """Return the size of a transaction as sent to peers (JSON)."""
+    return len(json.dumps(transaction.to_dict()).encode())
+
+
+class Mempool:
+    """The open transactions in the order they arrived, indexed by their id
+    (see Transaction.tx_id()).
+
+    Adding, looking up and removing a transaction does not depend on the
+    number of open transactions, so clearing the transactions of a block
+    costs O(block size).
+
+    The number and total size of the open transactions as well as the number
+    of open transactions per sender are limited. When the mempool is full,
+    the oldest transactions are evicted to admit a new one; with a priority
+    hook, the transactions with the lowest priority are evicted instead and
+    a new transaction is rejected unless it has a higher priority than the
+    ones it would evict.
+
+    Arguments:
+        :transactions: The transactions which are added first (transactions
+        beyond the limits are dropped).
+        :max_count: The maximum number of open transactions (default:
+        MAX_COUNT).
+        :max_bytes: The maximum total size of the open transactions
+        (default: MAX_BYTES).
+        :max_per_sender: The maximum number of open transactions per sender
+        (default: MAX_PER_SENDER).
+        :priority: A callable returning the priority (a number) of a
+        transaction, e.g. the fee it pays (default: PRIORITY).
+    """
+
+    def __init__(self, transactions=None, max_count=None, max_bytes=None,
+                 max_per_sender=None, priority=None):
+        self.max_count = MAX_COUNT if max_count is None else max_count
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        self.max_per_sender = (MAX_PER_SENDER if max_per_sender is None
+                               else max_per_sender)
+        self.priority = PRIORITY if priority is None else priority
+        self.size_bytes = 0
+        self.__transactions = OrderedDict()
+        self.__sizes = dict()
+        self.__sender_counts = dict()
+        for tx in transactions or []:
+            try:
+                self.make_room(tx)
+            except MempoolFullError:
+                continue
+            self.add(tx)
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __iter__(self):
+        return iter(self.__transactions.values())
+
+    def __contains__(self, tx_id):
+        return tx_id in self.__transactions
+
+    def make_room(self, transaction):
+        """Evict open transactions until a new transaction fits into the
+        limits, returns the evicted transactions.
+
+        Raises MempoolFullError (without evicting anything) if the
+        transaction can not be admitted.
+
+        Arguments:
+            :transaction: The transaction which should be added next.
+        """
+        sender = transaction.sender
+        if self.__sender_counts.get(sender, 0) >= self.max_per_sender:
+            raise MempoolFullError(
+                'Too many open transactions of the sender')
+        size = transaction_size(transaction)
+        if size > self.max_bytes:
+            raise MempoolFullError('Transaction is too large')
+        count = len(self.__transactions) + 1
+        total = self.size_bytes + size
+        if count <= self.max_count and total <= self.max_bytes:
+            return []
+        if self.priority is None:
+            candidates = self.__transactions.values()
+        else:
+            new_priority = self.priority(transaction)
+            # sorted() is stable, so older transactions go first on ties.
+            candidates = sorted(self.__transactions.values(),
+                                key=self.priority)
+        evicted = list()
+        for tx in candidates:
+            if count <= self.max_count and total <= self.max_bytes:
+                break
+            if self.priority is not None and \
+                    self.priority(tx) >= new_priority:
+                break
+            evicted.append(tx)
+            count -= 1
+            total -= self.__sizes[tx.tx_id()]
+        if count > self.max_count or total > self.max_bytes:
+            raise MempoolFullError('Mempool is full')
+        for tx in evicted:
+            self.remove(tx.tx_id())
+        return evicted
+
+    def add(self, transaction):
+        """Add a transaction, returns False if it is already open.
+
+        The limits are not checked, call make_room() first.
+
+        Arguments:
+            :transaction: The transaction which should be added.
+        """
+        tx_id = transaction.tx_id()
+        if tx_id in self.__transactions:
+            return False
+        size = transaction_size(transaction)
+        self.__transactions[tx_id] = transaction
+        self.__sizes[tx_id] = size
+        self.size_bytes += size
+        self.__sender_counts[transaction.sender] = \
+            self.__sender_counts.get(transaction.sender, 0) + 1
+        return True
+
+    def get(self, tx_id):
+        """Return the open transaction with an id or None."""
+        return self.__transactions.get(tx_id)
+
+    def remove(self, tx_id):
+        """Remove the transaction with an id, returns it or None."""
+        transaction = self.__transactions.pop(tx_id, None)
+        if transaction is not None:
+            self.size_bytes -= self.__sizes.pop(tx_id)
+            count = self.__sender_counts[transaction.sender] - 1
+            if count:
+                self.__sender_counts[transaction.sender] = count
+            else:
+                del self.__sender_counts[transaction.sender]
+        return transaction
+
+    def remove_all(self, transactions):
+        """Remove the open transactions which are in a list of transactions
+        (e.g. the transactions of a new block), returns the removed ones.
+
+        Arguments:
+            :transactions: The transactions which should be removed.
+        """
+        removed = list()
+        for tx in transactions:
+            open_tx = self.remove(tx.tx_id())
+            if open_tx is not None:
+                removed.append(open_tx)
+        return removed
+
+    def clear(self):
+        """Remove all open transactions."""
+        self.__transactions.clear()
+        self.__sizes.clear()
+        self.__sender_counts.clear()
+        self.size_bytes = 0
+
+    def transactions(self):
+        """Return a list of the open transactions in arrival order."""
+        return list(self.__transactions.values())
+
+    def status(self):
+        """Return the usage and limits as a (JSON serializable) dict."""
+        return {
+            'count': len(self.__transactions),
+            'bytes': self.size_bytes,
+            'max_count': self.max_count,
+            'max_bytes': self.max_bytes,
+            'max_per_sender': self.max_per_sender
+        }
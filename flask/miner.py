@@ -0,0 +1,110 @@
+"""Provides the (multi-core) proof of work search."""
+
+import os
+import queue
+
+from utility.hash_utils import PrefixHasher
+from utility.verification import MP_CONTEXT, Verification
+
+# The nonces below this value are tried in-process before worker processes
+# are started, since most proofs are found long before starting processes
+# would pay off.
+SEQUENTIAL_NONCES = 4096
+# The number of nonces a worker tests between checks of the stop event.
+CHECK_INTERVAL = 1024
+
+
+def search_range(prefix, start, stop, step=1):
+    """Return the first valid proof in range(start, stop, step) or None.
+
+    The prefix is hashed once, so testing a nonce only costs hashing the
+    nonce itself. The accepted proofs are the same as the ones of
+    Verification.valid_proof() and Verification.valid_block_proof().
+
+    Arguments:
+        :prefix: The bytes preceding the proof.
+        :start: The first nonce which is tested.
+        :stop: The nonce at which the search ends (None: never).
+        :step: The distance between two tested nonces.
+    """
+    hasher = PrefixHasher(prefix)
+    proof = start
+    while stop is None or proof < stop:
+        if Verification.valid_hash(hasher.hexdigest(str(proof).encode())):
+            return proof
+        proof += step
+    return None
+
+
+def search_worker(prefix, start, step, stop_event, results):
+    """Test every step-th nonce from start until a proof is found or the
+    search is stopped, then put the proof into the results queue."""
+    proof = start
+    while not stop_event.is_set():
+        found = search_range(prefix, proof, proof + CHECK_INTERVAL * step,
+                             step)
+        if found is not None:
+            results.put(found)
+            stop_event.set()
+            return
+        proof += CHECK_INTERVAL * step
+
+
+def search_cancellable(prefix, start, step, cancel_event):
+    """Search in-process from start until a proof is found or the search is
+    cancelled (returns None then)."""
+    proof = start
+    while cancel_event is None or not cancel_event.is_set():
+        found = search_range(prefix, proof, proof + CHECK_INTERVAL * step,
+                             step)
+        if found is not None:
+            return found
+        proof += CHECK_INTERVAL * step
+    return None
+
+
+def proof_of_work(prefix, workers=None, cancel_event=None):
+    """Search a valid proof, splitting the nonce space across processes.
+
+    Every worker tests an interleaved share of the nonces; all workers are
+    stopped as soon as one of them finds a valid proof or the search is
+    cancelled.
+
+    Arguments:
+        :prefix: The bytes preceding the proof, i.e. the block header (see
+        hash_utils.block_header()).
+        :workers: The number of processes (default: number of cores).
+        :cancel_event: An optional threading.Event which cancels the search;
+        None is returned then.
+    """
+    proof = search_range(prefix, 0, SEQUENTIAL_NONCES)
+    if proof is not None:
+        return proof
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return search_cancellable(prefix, SEQUENTIAL_NONCES, 1, cancel_event)
+
+    stop_event = MP_CONTEXT.Event()
+    results = MP_CONTEXT.Queue()
+    processes = [
+        MP_CONTEXT.Process(
+            target=search_worker,
+            args=(prefix, SEQUENTIAL_NONCES + offset, workers, stop_event,
+                  results),
+            daemon=True)
+        for offset in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        while cancel_event is None or not cancel_event.is_set():
+            try:
+                return results.get(timeout=0.1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) \
+                        and results.empty():
+                    raise RuntimeError('All mining workers died')
+        return None
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join()
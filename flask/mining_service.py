@@ -0,0 +1,118 @@
+import threading
+
+from persistence import PersistenceError
+
+# The default number of seconds the service waits between two blocks.
+MINING_INTERVAL = 10
+# The number of seconds waited after a failed round, doubled with every
+# further failed round up to MAX_ERROR_DELAY.
+ERROR_DELAY = 1
+MAX_ERROR_DELAY = 60
+
+
+class MiningService:
+    """Mines blocks on a background thread.
+
+    Every round mines the open transactions present when the round starts,
+    so transactions which arrive meanwhile go into the next block. When a
+    block from another node changes the chain, the running round is
+    cancelled and restarted on the new tip. A round which fails with an
+    error is logged and retried after a growing delay, so the service keeps
+    running.
+
+    Attributes:
+        :blockchain: The Blockchain blocks are mined for.
+        :interval: The number of seconds waited between two rounds.
+        :blocks_mined: The number of blocks mined by the service.
+        :restarts: The number of rounds cancelled because of a new tip.
+        :errors: The number of rounds which failed with an error.
+        :last_block: The last block mined by the service.
+    """
+
+    def __init__(self, blockchain, interval=MINING_INTERVAL):
+        self.blockchain = blockchain
+        self.interval = interval
+        self.blocks_mined = 0
+        self.restarts = 0
+        self.errors = 0
+        self.last_block = None
+        self.__thread = None
+        self.__stop_event = threading.Event()
+        self.__cancel_event = threading.Event()
+        blockchain.add_chain_listener(self.chain_changed)
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self):
+        """Start mining in the background, returns False if already running.
+        """
+        if self.is_running():
+            return False
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+        return True
+
+    def stop(self):
+        """Stop mining and wait for the background thread to finish."""
+        self.__stop_event.set()
+        self.__cancel_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def chain_changed(self):
+        """Cancel the running round because the tip of the chain changed."""
+        self.__cancel_event.set()
+
+    def status(self):
+        """Return the state of the service as a (JSON serializable) dict."""
+        return {
+            'running': self.is_running(),
+            'interval': self.interval,
+            'blocks_mined': self.blocks_mined,
+            'restarts': self.restarts,
+            'errors': self.errors,
+            'last_block_index': (self.last_block.index
+                                 if self.last_block is not None else None)
+        }
+
+    def run(self):
+        """Mine rounds until the service is stopped."""
+        error_delay = ERROR_DELAY
+        while not self.__stop_event.is_set():
+            self.__cancel_event.clear()
+            try:
+                if self.blockchain.resolve_conflicts:
+                    # Don't mine on a tip the other nodes already rejected.
+                    self.blockchain.resolve()
+                block = self.blockchain.mine_block(self.__cancel_event)
+            except PersistenceError:
+                # The block was added, the writer keeps retrying to save it.
+                print('Saving the mined block failed')
+                self.blocks_mined += 1
+                self.__stop_event.wait(self.interval)
+                continue
+            except Exception as error:
+                print('Mining round failed!! ({!r})'.format(error))
+                self.errors += 1
+                self.__stop_event.wait(error_delay)
+                error_delay = min(error_delay * 2, MAX_ERROR_DELAY)
+                continue
+            error_delay = ERROR_DELAY
+            if block is not None:
+                self.blocks_mined += 1
+                self.last_block = block
+            elif self.__stop_event.is_set():
+                break
+            elif self.__cancel_event.is_set():
+                # Restart right away on the new tip.
+                self.restarts += 1
+                continue
+            elif self.blockchain.public_key is None:
+                print('Mining stopped, no wallet')
+                break
+            else:
+                print('Mining round failed')
+            self.__stop_event.wait(self.interval)
@@ -1,13 +1,33 @@
-from flask import Flask, jsonify, request, send_from_directory
+import struct
+
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 
-from wallet import Wallet
+import codec
+from wallet import KEY_TYPES, Wallet
+from block import Block
 from blockChain import Blockchain
+from mempool import MempoolFullError
+from mining_service import MiningService
+from persistence import DURABILITY, DURABILITY_MODES, PersistenceError
+from transaction import Transaction, valid_number
+
+# The maximum number of blocks sent for one /blocks request.
+MAX_PAGE_BLOCKS = 500
+# The maximum number of headers sent for one /headers request.
+MAX_PAGE_HEADERS = 2000
 
 app = Flask(__name__)
 CORS(app)
 
 
+@app.errorhandler(PersistenceError)
+def saving_failed(error):
+    # The change was made but is not on disk yet (it is retried).
+    response = {'message': 'Saving Failed!!'}
+    return jsonify(response), 500
+
+
 @app.route('/', methods=['GET'])
 def get_node_ui():
     return send_from_directory('ui', 'node.html')
@@ -20,10 +40,25 @@ def get_netowrk_ui():
 
 @app.route('/wallet', methods=['POST'])
 def create_keys():
-    wallet.create_keys()
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values, dict):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    key_type = values.get('key_type', 'rsa')
+    if key_type not in KEY_TYPES:
+        response = {
+            'message': 'Unknown key type',
+            'key_types': list(KEY_TYPES)
+        }
+        return jsonify(response), 400
+    wallet.create_keys(key_type)
     if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        global blockchain, mining_service
+        mining_service.stop()
+        blockchain.close()
+        blockchain = Blockchain(wallet.public_key, port,
+                                blockchain.durability)
+        mining_service = MiningService(blockchain)
         response = {
             'funds': blockchain.get_balance(),
             'public_key': wallet.public_key,
@@ -40,8 +75,12 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        global blockchain, mining_service
+        mining_service.stop()
+        blockchain.close()
+        blockchain = Blockchain(wallet.public_key, port,
+                                blockchain.durability)
+        mining_service = MiningService(blockchain)
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -82,12 +121,24 @@ def broadcast_transaction():
     if not all(key in values for key in required):
         response = {'message': 'Some data is missing'}
         return jsonify(response), 400
-    success = blockchain.add_transaction(
-        values['recipient'],
-        values['sender'],
-        values['signature'],
-        values['amount'],
-        is_receiving=True)
+    try:
+        Transaction.from_dict(values)
+    except (TypeError, ValueError):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    try:
+        success = blockchain.add_transaction(
+            values['recipient'],
+            values['sender'],
+            values['signature'],
+            values['amount'],
+            is_receiving=True)
+    except MempoolFullError as error:
+        response = {
+            'message': str(error),
+            'mempool': blockchain.mempool_status()
+        }
+        return jsonify(response), 503
     if success:
         response = {
             'message': "Sucessfully added transaction",
@@ -99,6 +150,12 @@ def broadcast_transaction():
             }
         }
         return jsonify(response), 201
+    elif blockchain.has_open_transaction(Transaction(
+            values['sender'], values['recipient'], values['signature'],
+            values['amount']).tx_id()):
+        # Peers relay the same transaction, this is not a conflict.
+        response = {'message': 'Transaction already known'}
+        return jsonify(response), 200
     else:
         response = {
             'message': "Creating a transaction failed"
@@ -108,22 +165,65 @@ def broadcast_transaction():
 
 @app.route('/broadcast-block', methods=['POST'])
 def broadcast_block():
-    values = request.get_json()
+    if request.mimetype == codec.BINARY_MIMETYPE:
+        try:
+            values = {'block': codec.decode_blocks(request.get_data())[0]}
+        except (KeyError, TypeError, ValueError, IndexError, struct.error):
+            values = None
+    else:
+        values = request.get_json()
     if not values:
         response = {'message': 'No data found'}
         return jsonify(response), 400
     if 'block' not in values:
         response = {'message': 'Some data is missing'}
         return jsonify(response), 400
-    block = values['block']
-    if block['index'] == blockchain.chain[-1].index + 1:
+    try:
+        block = values['block']
+        if not isinstance(block, Block):
+            block = Block.from_dict(block)
+    except (KeyError, TypeError, ValueError):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    tip = blockchain.chain.tip
+    if block.index == tip.index + 1:
+        if blockchain.add_block(block):
+            response = {'message': 'Block added'}
+            return jsonify(response), 201
+        else:
+            response = {'message': 'Block invalid'}
+            return jsonify(response), 500
+    elif block.index > tip.index:
+        response = {
+            'message': 'Blockchain seems to differ from local blockchain.'}
+        blockchain.resolve_conflicts = True
+        return jsonify(response), 200
+    else:
+        response = {
+            'message': 'Blockchain seems to be shorter, block not added'}
+        return jsonify(response), 409
+
+
+@app.route('/broadcast-compact-block', methods=['POST'])
+def broadcast_compact_block():
+    try:
+        compact = codec.decode_compact_block(request.get_data())
+    except (ValueError, IndexError, struct.error):
+        response = {'message': 'No data found'}
+        return jsonify(response), 400
+    tip = blockchain.chain.tip
+    if compact.index == tip.index + 1:
+        block, missing = blockchain.reconstruct_block(compact)
+        if block is None:
+            response = {'message': 'Transactions missing', 'missing': missing}
+            return jsonify(response), 202
         if blockchain.add_block(block):
             response = {'message': 'Block added'}
             return jsonify(response), 201
         else:
             response = {'message': 'Block invalid'}
             return jsonify(response), 500
-    elif block['index'] > blockchain.chain[-1].index:
+    elif compact.index > tip.index:
         response = {
             'message': 'Blockchain seems to differ from local blockchain.'}
         blockchain.resolve_conflicts = True
@@ -156,9 +256,18 @@ def add_transaction():
     recipient = values['recipient']
     amount = values['amount']
     signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
-    success = blockchain.add_transaction(
-        recipient, wallet.public_key, signature, amount)
+    try:
+        success = blockchain.add_transaction(
+            recipient, wallet.public_key, signature, amount, broadcast=False)
+    except MempoolFullError as error:
+        response = {
+            'message': str(error),
+            'mempool': blockchain.mempool_status()
+        }
+        return jsonify(response), 503
     if success:
+        broadcast = blockchain.broadcast_transaction(Transaction(
+            wallet.public_key, recipient, signature, amount))
         response = {
             'message': "Sucessfully added transaction",
             'transaction': {
@@ -169,8 +278,14 @@ def add_transaction():
             },
             'funds': blockchain.get_balance()
         }
+        # Only wait for the peers if the client asks to.
+        if values.get('wait'):
+            response['peers'] = broadcast.results()
         return jsonify(response), 201
-
+    elif blockchain.has_open_transaction(Transaction(
+            wallet.public_key, recipient, signature, amount).tx_id()):
+        response = {'message': 'Transaction is already open'}
+        return jsonify(response), 409
     else:
         response = {
             'message': "Creating a transaction failed"
@@ -180,19 +295,29 @@ def add_transaction():
 
 @app.route('/mine', methods=['POST'])
 def mine():
-    block = blockchain.mine_block()
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values, dict):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    block = blockchain.mine_block(broadcast=False)
+    peers = None
+    if block is not None:
+        broadcast = blockchain.broadcast_block(block)
+        # Only wait for the peers if the client asks to.
+        if values.get('wait'):
+            peers = broadcast.results()
     if blockchain.resolve_conflicts:
         response = {'message': 'Resolve conflicts first, block not added!'}
         return jsonify(response), 409
     if block is not None:
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
+        dict_block = block.to_dict()
         response = {
             'message': 'Block Added Sucessfully',
             'block': dict_block,
             'current_funds': blockchain.get_balance()
         }
+        if peers is not None:
+            response['peers'] = peers
         return jsonify(response), 201
     else:
         response = {
@@ -202,6 +327,49 @@ def mine():
         return jsonify(response), 500
 
 
+@app.route('/mining/start', methods=['POST'])
+def start_mining():
+    if wallet.public_key is None:
+        response = {
+            'message': 'Mining needs a wallet',
+            'wallet_set_up': False
+        }
+        return jsonify(response), 400
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values, dict):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    if 'interval' in values:
+        interval = values['interval']
+        if not valid_number(interval, 0):
+            response = {
+                'message': 'The interval must be a non-negative number'
+            }
+            return jsonify(response), 400
+        mining_service.interval = interval
+    if mining_service.start():
+        response = {'message': 'Mining started'}
+    else:
+        response = {'message': 'Mining is already running'}
+    response['status'] = mining_service.status()
+    return jsonify(response), 200
+
+
+@app.route('/mining/stop', methods=['POST'])
+def stop_mining():
+    mining_service.stop()
+    response = {
+        'message': 'Mining stopped',
+        'status': mining_service.status()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/mining/status', methods=['GET'])
+def mining_status():
+    return jsonify(mining_service.status()), 200
+
+
 @app.route('/resolve-conflicts', methods=['POST'])
 def resolve_conflicts():
     replaced = blockchain.resolve()
@@ -215,20 +383,75 @@ def resolve_conflicts():
 @app.route('/transactions', methods=['GET'])
 def get_open_transactions():
     transactions = blockchain.get_open_transaction()
-    dict_transactions = [tx.__dict__ for tx in transactions]
+    dict_transactions = [tx.to_dict() for tx in transactions]
     return jsonify(dict_transactions), 200
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
     chain_data = blockchain.chain
-    dict_chain = [block.__dict__.copy() for block in chain_data]
-    for dict_block in dict_chain:
-        dict_block['transactions'] = [
-            tx.__dict__ for tx in dict_block['transactions']]
+    if request.accept_mimetypes.best == codec.BINARY_MIMETYPE:
+        return Response(codec.encode_blocks(chain_data),
+                        mimetype=codec.BINARY_MIMETYPE)
+    dict_chain = [block.to_dict() for block in chain_data]
     return jsonify(dict_chain), 200
 
 
+def page_range(max_page):
+    """Return the (start, stop) heights of a page requested by the start and
+    stop query parameters, limited to max_page blocks."""
+    length = len(blockchain.chain)
+    start = max(request.args.get('start', 0, type=int), 0)
+    stop = min(request.args.get('stop', length, type=int), length,
+               start + max_page)
+    return start, max(stop, start)
+
+
+@app.route('/blocks', methods=['GET'])
+def get_blocks():
+    start, stop = page_range(MAX_PAGE_BLOCKS)
+    blocks = blockchain.chain.slice(start, stop)
+    if request.accept_mimetypes.best == codec.BINARY_MIMETYPE:
+        return Response(codec.encode_blocks(blocks),
+                        mimetype=codec.BINARY_MIMETYPE)
+    return jsonify([block.to_dict() for block in blocks]), 200
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    start, stop = page_range(MAX_PAGE_HEADERS)
+    headers = [block.header_dict()
+               for block in blockchain.chain.slice(start, stop)]
+    return jsonify(headers), 200
+
+
+@app.route('/chain/tip', methods=['GET'])
+def get_chain_tip():
+    tip = blockchain.chain.tip
+    response = {
+        'length': tip.index + 1,
+        'height': tip.index,
+        'tip_hash': tip.hash()
+    }
+    return jsonify(response), 200
+
+
+@app.route('/verify-chain', methods=['POST'])
+def verify_chain():
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values, dict):
+        response = {'message': 'Some data is invalid'}
+        return jsonify(response), 400
+    full = bool(values.get('full', False))
+    valid = blockchain.verify_chain(full)
+    response = {
+        'valid': valid,
+        'full': full,
+        'message': 'Chain is valid' if valid else 'Chain is invalid!'
+    }
+    return jsonify(response), 200
+
+
 @app.route('/node', methods=['POST'])
 def add_node():
     values = request.get_json()
@@ -266,6 +489,11 @@ def remove_node(node_url):
     return jsonify(response), 200
 
 
+@app.route('/verification-cache', methods=['GET'])
+def get_verification_cache():
+    return jsonify(Wallet.cache_stats()), 200
+
+
 @app.route('/nodes', methods=["GET"])
 def get_nodes():
     nodes = blockchain.get_peer_nodes()
@@ -275,12 +503,27 @@ def get_nodes():
     return jsonify(response), 200
 
 
+def init_node(node_port, durability=DURABILITY):
+    """Set up the wallet, blockchain and mining service of the node.
+
+    Arguments:
+        :node_port: The port the node is served on (also names its files).
+        :durability: The durability mode of the blockchain's persistence
+        writer (see persistence.DURABILITY_MODES).
+    """
+    global port, wallet, blockchain, mining_service
+    port = node_port
+    wallet = Wallet(port)
+    blockchain = Blockchain(wallet.public_key, port, durability)
+    mining_service = MiningService(blockchain)
+
+
 if __name__ == "__main__":
     from argparse import ArgumentParser
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-d', '--durability', choices=DURABILITY_MODES,
+                        default=DURABILITY)
     args = parser.parse_args()
-    port = args.port
-    wallet = Wallet(port)
-    blockchain = Blockchain(wallet.public_key, port)
-    app.run(host='0.0.0.0', port=port)
+    init_node(args.port, args.durability)
+    app.run(host='0.0.0.0', port=port, threaded=True)
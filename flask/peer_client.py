@@ -0,0 +1,222 @@
+"""Provides the HTTP client used to talk to peer nodes."""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+from time import monotonic
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The number of seconds to wait for a connection to a peer.
+CONNECT_TIMEOUT = 3.05
+# The number of seconds to wait for a peer's response.
+READ_TIMEOUT = 10
+# The number of retries of a failed request.
+RETRIES = 2
+# The backoff between retries (0s, 2 * factor, 4 * factor, ... seconds).
+BACKOFF_FACTOR = 0.2
+# The number of keep-alive connections kept open per peer.
+POOL_SIZE = 4
+# The number of threads sending broadcasts to peers.
+BROADCAST_WORKERS = 16
+# The number of seconds a broadcast waits for the response of a peer.
+BROADCAST_DEADLINE = 5
+# The smallest timeout of a request (requests rejects a timeout of 0).
+MIN_TIMEOUT = 0.001
+# The errors raised for peers which can not be reached (in time).
+PEER_ERRORS = (requests.exceptions.ConnectionError,
+               requests.exceptions.Timeout)
+
+
+class Broadcast:
+    """A message which is being sent to many peer nodes concurrently.
+
+    Arguments:
+        :futures: A dict of the futures of the requests per peer node.
+        :deadline: The number of seconds to wait for the peers.
+    """
+
+    def __init__(self, futures, deadline):
+        self.__futures = futures
+        self.__deadline = monotonic() + deadline
+
+    def results(self, wait_for_peers=True):
+        """Return the result per peer node: the status code of its response
+        or the error (the peer is 'unreachable', did not answer before the
+        deadline ('timeout') or is still being sent to ('pending')).
+
+        Arguments:
+            :wait_for_peers: Whether to wait for the peers until the deadline.
+        """
+        if wait_for_peers:
+            wait(self.__futures.values(),
+                 timeout=max(0, self.__deadline - monotonic()))
+        results = dict()
+        for node, future in self.__futures.items():
+            if not future.done():
+                if monotonic() >= self.__deadline:
+                    results[node] = {'error': 'timeout'}
+                else:
+                    results[node] = {'error': 'pending'}
+            elif future.exception() is not None:
+                results[node] = {'error': 'unreachable'}
+            else:
+                results[node] = {'status_code': future.result().status_code}
+        return results
+
+
+class PeerClient:
+    """Sends requests to peer nodes over persistent (keep-alive) connections.
+
+    Every peer gets its own requests.Session, so the connections to a peer
+    are reused across messages instead of opening one per message. Requests
+    which fail to connect are retried with exponential backoff; GET requests
+    are also retried on read errors and on 502, 503 and 504 responses. Since
+    the peer may already have processed a POST, POSTs are only retried when
+    the connection failed.
+
+    Arguments:
+        :connect_timeout: The seconds to wait for a connection (default:
+        CONNECT_TIMEOUT).
+        :read_timeout: The seconds to wait for a response (default:
+        READ_TIMEOUT).
+        :retries: The number of retries (default: RETRIES).
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, retries=None):
+        self.timeout = (
+            CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            READ_TIMEOUT if read_timeout is None else read_timeout)
+        self.retries = RETRIES if retries is None else retries
+        self.__sessions = dict()
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(
+            max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast')
+
+    def create_session(self):
+        """Create a session with a retrying keep-alive connection pool."""
+        options = dict(total=self.retries,
+                       backoff_factor=BACKOFF_FACTOR,
+                       status_forcelist=(502, 503, 504),
+                       raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=frozenset(['GET']), **options)
+        except TypeError:
+            # urllib3 before 1.26 (as pinned in requirements.txt).
+            retry = Retry(method_whitelist=frozenset(['GET']), **options)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session(self, node):
+        """Return the session of a peer node, creating it if necessary."""
+        with self.__lock:
+            session = self.__sessions.get(node)
+            if session is None:
+                session = self.create_session()
+                self.__sessions[node] = session
+            return session
+
+    def request(self, method, node, path, timeout=None, **kwargs):
+        """Send a request to a peer node and return the response.
+
+        Raises one of PEER_ERRORS if the peer can not be reached in time.
+
+        Arguments:
+            :method: The HTTP method.
+            :node: The address (host:port) of the peer node.
+            :path: The path of the endpoint, e.g. '/chain'.
+            :timeout: A (connect, read) tuple or a number of seconds
+            overriding the timeouts of the client.
+            :kwargs: Further arguments of requests.Session.request().
+        """
+        url = 'http://{}{}'.format(node, path)
+        return self.session(node).request(
+            method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, node, path, **kwargs):
+        return self.request('GET', node, path, **kwargs)
+
+    def post(self, node, path, **kwargs):
+        return self.request('POST', node, path, **kwargs)
+
+    def broadcast(self, nodes, path, on_response=None,
+                  deadline=BROADCAST_DEADLINE, **kwargs):
+        """POST a message to many peer nodes concurrently and return the
+        Broadcast right away.
+
+        Arguments:
+            :nodes: The addresses of the peer nodes.
+            :path: The path of the endpoint, e.g. '/broadcast-block'.
+            :on_response: An optional callable which gets the node, the
+            response of every peer which answered and the (connect, read)
+            timeout left until the deadline. It may send a follow-up request
+            with that timeout and return its response, which then replaces
+            the first one.
+            :deadline: The number of seconds to wait for a peer.
+            :kwargs: Further arguments of requests.Session.request().
+        """
+        end = monotonic() + deadline
+        timeout = (min(self.timeout[0], deadline),
+                   min(self.timeout[1], deadline))
+
+        def send(node):
+            response = self.post(node, path, timeout=timeout, **kwargs)
+            if on_response is not None:
+                # A follow-up request after the deadline times out at once.
+                left = max(end - monotonic(), MIN_TIMEOUT)
+                follow_up = on_response(node, response,
+                                        (min(self.timeout[0], left),
+                                         min(self.timeout[1], left)))
+                # Error responses are falsy, so compare with None.
+                if follow_up is not None:
+                    response = follow_up
+            return response
+
+        futures = {node: self.__executor.submit(send, node) for node in nodes}
+        return Broadcast(futures, deadline)
+
+    def get_all(self, nodes, path, deadline=BROADCAST_DEADLINE, **kwargs):
+        """GET a path from many peer nodes concurrently, returns a dict of
+        the responses of the peers which answered before the deadline.
+
+        Arguments:
+            :nodes: The addresses of the peer nodes.
+            :path: The path of the endpoint, e.g. '/chain/tip'.
+            :deadline: The number of seconds to wait for the peers.
+            :kwargs: Further arguments of requests.Session.request().
+        """
+        timeout = (min(self.timeout[0], deadline),
+                   min(self.timeout[1], deadline))
+        futures = {
+            node: self.__executor.submit(self.get, node, path,
+                                         timeout=timeout, **kwargs)
+            for node in nodes}
+        wait(futures.values(), timeout=deadline)
+        return {node: future.result() for node, future in futures.items()
+                if future.done() and future.exception() is None}
+
+    def submit(self, function, *args):
+        """Run a callable on the threads of the client (e.g. to download
+        from a peer meanwhile), returns its future."""
+        return self.__executor.submit(function, *args)
+
+    def remove(self, node):
+        """Close the connections to a peer node which was removed."""
+        with self.__lock:
+            session = self.__sessions.pop(node, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        """Close the connections to all peer nodes and stop broadcasting."""
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions = dict()
+        for session in sessions:
+            session.close()
+        self.__executor.shutdown(wait=False)
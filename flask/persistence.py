@@ -0,0 +1,127 @@
+import atexit
+import threading
+
+# 'fsync': a change is acknowledged once it was written and synced to disk.
+# 'async': a change is acknowledged right away and written in the background.
+DURABILITY_MODES = ('fsync', 'async')
+# The default durability mode.
+DURABILITY = 'fsync'
+# The number of seconds to wait before a failed write is retried.
+RETRY_DELAY = 1
+
+
+class PersistenceError(IOError):
+    """Raised when changes which are waited for could not be written."""
+
+
+class PersistenceWriter:
+    """Writes the state of a blockchain to storage on a background thread.
+
+    Changes are queued as the kinds of state which need to be written. The
+    writer coalesces all kinds queued while it was busy into one write
+    (group commit), so a burst of transactions costs one write of the open
+    transactions instead of one per transaction. Pending writes are flushed
+    when the writer is closed or the interpreter exits.
+
+    A failed write is retried (its kinds stay queued) until it succeeds or
+    the writer is closed; the changes waited for raise PersistenceError
+    instead of being acknowledged.
+
+    Arguments:
+        :write: The callable writing the state, it gets the set of changed
+        kinds.
+        :durability: One of DURABILITY_MODES.
+    """
+
+    def __init__(self, write, durability=DURABILITY):
+        if durability not in DURABILITY_MODES:
+            raise ValueError('Unknown durability mode {}'.format(durability))
+        self.durability = durability
+        self.__write = write
+        self.__condition = threading.Condition()
+        self.__dirty = set()
+        self.__requested = 0
+        self.__written = 0
+        self.__failed = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def request(self, *kinds):
+        """Queue writing some kinds of state and return a ticket for wait().
+
+        Arguments:
+            :kinds: The kinds of state which changed.
+        """
+        with self.__condition:
+            if self.__closed:
+                # Write right away once the writer thread is gone.
+                self.__write(set(kinds))
+                return self.__written
+            self.__dirty.update(kinds)
+            self.__requested += 1
+            self.__condition.notify_all()
+            return self.__requested
+
+    def wait(self, ticket):
+        """Wait until the changes of a ticket are written, unless the
+        durability mode acknowledges changes right away.
+
+        Raises PersistenceError if writing the changes failed.
+        """
+        if self.durability == 'fsync':
+            self.wait_written(ticket)
+
+    def wait_written(self, ticket):
+        with self.__condition:
+            while self.__written < ticket:
+                if self.__failed >= ticket or not self.__thread.is_alive():
+                    raise PersistenceError('Saving Failed!!')
+                self.__condition.wait()
+
+    def flush(self):
+        """Wait until all queued changes are written."""
+        with self.__condition:
+            ticket = self.__requested
+        self.wait_written(ticket)
+
+    def close(self):
+        """Write all queued changes and stop the writer thread."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+        atexit.unregister(self.close)
+
+    def run(self):
+        """Write the queued changes until the writer is closed."""
+        while True:
+            with self.__condition:
+                while not self.__dirty and not self.__closed:
+                    self.__condition.wait()
+                if not self.__dirty:
+                    return
+                kinds = self.__dirty
+                self.__dirty = set()
+                ticket = self.__requested
+            failed = True
+            try:
+                self.__write(kinds)
+                failed = False
+            except Exception as error:
+                print('Saving Failed!! ({})'.format(error))
+            finally:
+                with self.__condition:
+                    if failed:
+                        # Keep the kinds queued, so they are written again.
+                        self.__dirty.update(kinds)
+                        self.__failed = ticket
+                    else:
+                        self.__written = ticket
+                    self.__condition.notify_all()
+            if failed:
+                with self.__condition:
+                    if self.__closed:
+                        return
+                    self.__condition.wait(RETRY_DELAY)
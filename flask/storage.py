@@ -0,0 +1,560 @@
+"""Provides the append-only storage engine of the blockchain."""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+import codec
+from block import Block
+from transaction import Transaction
+from utility.cache import LRUCache
+
+# Every record of the block log starts with the length of its payload and
+# the CRC32 checksum of the payload.
+RECORD_HEADER = struct.Struct('>II')
+# Every entry of the block index is the log offset of the block at that
+# height.
+INDEX_ENTRY = struct.Struct('>Q')
+# The number of decoded blocks kept in memory.
+BLOCK_CACHE_SIZE = 512
+
+
+class BlockStorage:
+    """Persists the blockchain of a node.
+
+    Blocks are appended to a log segment as length-prefixed, checksummed
+    records, so saving a new block costs O(block) instead of O(chain). The
+    open transactions and the peer nodes live in their own small files which
+    are replaced atomically. A crash in the middle of a write leaves the
+    previous state readable: a torn record at the end of the log is dropped on
+    the next load and the small files are never written in place.
+
+    A height->offset index next to the log allows opening the storage without
+    reading the blocks; single blocks are decoded on demand from a memory
+    mapping of the log.
+
+    Blocks and open transactions are stored in the binary encoding of the
+    codec module. The addresses the stored blocks refer to are kept once in
+    an append-only address file which is written before the block log.
+
+    Attributes:
+        :node_id: The node (port) the storage belongs to.
+        :height: The number of blocks stored in the block log.
+        :addresses: The AddressTable of the stored blocks.
+    """
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.height = 0
+        self.__offsets = list()
+        self.__map = None
+        # Guards the memory mapping, which is replaced when the log grows.
+        self.__map_lock = threading.Lock()
+        self.addresses = codec.AddressTable()
+        self.log_path = 'blockchain-{}.log'.format(node_id)
+        self.index_path = 'blockchain-{}.idx'.format(node_id)
+        self.address_path = 'blockchain-{}.addr'.format(node_id)
+        self.mempool_path = 'mempool-{}.dat'.format(node_id)
+        self.peers_path = 'peers-{}.txt'.format(node_id)
+        self.checkpoint_path = 'blockchain-{}.ckpt'.format(node_id)
+        self.legacy_path = 'blockchain-{}.txt'.format(node_id)
+
+    @staticmethod
+    def encode_record(payload):
+        """Frame a payload as a length-prefixed, checksummed record.
+
+        Arguments:
+            :payload: The bytes which should be framed.
+        """
+        return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def encode_blocks(self, blocks):
+        """Encode blocks into log records and append new addresses.
+
+        The address file is written before the records referring to it, so a
+        crash never leaves the log with unknown address ids. The new
+        addresses only count as known once they are synced to disk; if
+        encoding or writing fails, they are forgotten (and removed from the
+        address file again) so the next save writes them.
+
+        Arguments:
+            :blocks: The blocks which should be encoded.
+        """
+        known = len(self.addresses)
+        try:
+            records = [self.encode_record(codec.encode_block(block,
+                                                             self.addresses))
+                       for block in blocks]
+            if len(self.addresses) > known:
+                with open(self.address_path, 'ab') as file:
+                    size = file.seek(0, os.SEEK_END)
+                    try:
+                        file.write(b''.join(
+                            self.encode_record(codec.encode_string(address))
+                            for address in self.addresses.addresses[known:]))
+                        file.flush()
+                        os.fsync(file.fileno())
+                    except BaseException:
+                        file.truncate(size)
+                        raise
+        except BaseException:
+            self.addresses.truncate(known)
+            raise
+        return records
+
+    def load_addresses(self):
+        """Load the address table of the stored blocks."""
+        self.addresses = codec.AddressTable()
+        try:
+            with open(self.address_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                end = 0
+                while True:
+                    payload = self.read_record(file, end, size)
+                    if payload is None:
+                        break
+                    self.addresses.add(
+                        codec.decode_string(codec.Reader(payload)))
+                    end += RECORD_HEADER.size + len(payload)
+        except IOError:
+            return
+        if end < size:
+            with open(self.address_path, 'r+b') as file:
+                file.truncate(end)
+
+    def open(self):
+        """Open the block log by reading its index and return the height.
+
+        Entries of the index which point at a torn record are dropped and
+        records which were appended after the last index update are indexed,
+        so only the tail of the log is read.
+        """
+        self.close()
+        self.load_addresses()
+        try:
+            with open(self.log_path, 'rb') as file:
+                log_size = os.fstat(file.fileno()).st_size
+                offsets = self.read_index()
+                # Drop index entries whose record is missing or torn.
+                while offsets and self.read_record(
+                        file, offsets[-1], log_size) is None:
+                    offsets.pop()
+                end = 0
+                if offsets:
+                    payload = self.read_record(file, offsets[-1], log_size)
+                    end = offsets[-1] + RECORD_HEADER.size + len(payload)
+                # Index the records appended after the last index update.
+                indexed = len(offsets)
+                while True:
+                    payload = self.read_record(file, end, log_size)
+                    if payload is None:
+                        break
+                    offsets.append(end)
+                    end += RECORD_HEADER.size + len(payload)
+        except IOError:
+            self.__offsets = list()
+            self.height = 0
+            return 0
+        if end < log_size:
+            print('Dropping torn block log tail')
+            with open(self.log_path, 'r+b') as file:
+                file.truncate(end)
+        if len(offsets) != indexed or end < log_size:
+            self.write_atomic(self.index_path, b''.join(
+                INDEX_ENTRY.pack(offset) for offset in offsets))
+        self.__offsets = offsets
+        self.height = len(offsets)
+        return self.height
+
+    def close(self):
+        """Release the memory mapping of the block log."""
+        with self.__map_lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+
+    def read_index(self):
+        """Return the list of log offsets stored in the block index."""
+        try:
+            with open(self.index_path, 'rb') as file:
+                data = file.read()
+        except IOError:
+            return list()
+        count = len(data) // INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size)[0]
+                for i in range(count)]
+
+    @staticmethod
+    def read_record(file, offset, log_size):
+        """Read the payload of the record at an offset of the block log.
+
+        Returns None if there is no intact record at the offset.
+
+        Arguments:
+            :file: The opened block log.
+            :offset: The offset of the record.
+            :log_size: The size of the block log.
+        """
+        if offset + RECORD_HEADER.size > log_size:
+            return None
+        file.seek(offset)
+        length, checksum = RECORD_HEADER.unpack(
+            file.read(RECORD_HEADER.size))
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def read_block(self, height):
+        """Decode the stored block at a height.
+
+        Return None if no block is stored at the height (e.g. because it was
+        truncated while the caller read the chain).
+
+        Arguments:
+            :height: The index of the block in the chain.
+        """
+        with self.__map_lock:
+            if height >= len(self.__offsets):
+                return None
+            offset = self.__offsets[height]
+            if self.__map is None or offset + RECORD_HEADER.size > len(
+                    self.__map):
+                self.remap()
+            length, _ = RECORD_HEADER.unpack_from(self.__map, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > len(self.__map):
+                self.remap()
+            payload = self.__map[start:start + length]
+        return codec.decode_block(payload, self.addresses)
+
+    def remap(self):
+        """Map the current content of the block log into memory."""
+        if self.__map is not None:
+            self.__map.close()
+        with open(self.log_path, 'rb') as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def append_blocks(self, blocks):
+        """Append blocks to the end of the block log.
+
+        If writing the log or the index fails, both are cut back to their
+        previous size, so a retry does not append the blocks a second time.
+
+        Arguments:
+            :blocks: The blocks which follow the stored ones.
+        """
+        if not blocks:
+            return
+        records = self.encode_blocks(blocks)
+        with open(self.log_path, 'ab') as log_file:
+            offset = log_file.seek(0, os.SEEK_END)
+            try:
+                log_file.write(b''.join(records))
+                log_file.flush()
+                os.fsync(log_file.fileno())
+                offsets = list()
+                end = offset
+                for record in records:
+                    offsets.append(end)
+                    end += len(record)
+                # The index is written after the log: a crash in between is
+                # repaired by open(), which indexes the unindexed records.
+                with open(self.index_path, 'ab') as index_file:
+                    index_size = index_file.seek(0, os.SEEK_END)
+                    try:
+                        index_file.write(b''.join(
+                            INDEX_ENTRY.pack(o) for o in offsets))
+                        index_file.flush()
+                    except BaseException:
+                        index_file.truncate(index_size)
+                        raise
+            except BaseException:
+                log_file.truncate(offset)
+                raise
+        self.__offsets.extend(offsets)
+        self.height += len(blocks)
+
+    def truncate_blocks(self, height):
+        """Drop the stored blocks from a height on, e.g. the blocks of an
+        abandoned fork.
+
+        The log is cut before the index: a crash in between leaves index
+        entries without records, which open() drops.
+
+        Arguments:
+            :height: The number of blocks which are kept.
+        """
+        if height >= self.height:
+            return
+        end = self.__offsets[height]
+        with self.__map_lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            with open(self.log_path, 'r+b') as file:
+                file.truncate(end)
+                file.flush()
+                os.fsync(file.fileno())
+            with open(self.index_path, 'r+b') as file:
+                size = os.fstat(file.fileno()).st_size
+                file.truncate(min(size, height * INDEX_ENTRY.size))
+            del self.__offsets[height:]
+        self.height = height
+
+    def rewrite_blocks(self, blocks):
+        """Replace the whole block log, e.g. after the chain was replaced.
+
+        Arguments:
+            :blocks: The complete new chain.
+        """
+        records = self.encode_blocks(blocks)
+        offsets = list()
+        offset = 0
+        for record in records:
+            offsets.append(offset)
+            offset += len(record)
+        with self.__map_lock:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            self.write_atomic(self.log_path, b''.join(records))
+            self.write_atomic(self.index_path, b''.join(
+                INDEX_ENTRY.pack(o) for o in offsets))
+            self.__offsets = offsets
+        self.height = len(blocks)
+
+    def load_open_transactions(self):
+        """Load the open transactions from their file."""
+        try:
+            with open(self.mempool_path, 'rb') as file:
+                return codec.decode_transactions(file.read())
+        except (IOError, ValueError, struct.error):
+            return []
+
+    def save_open_transactions(self, transactions):
+        """Atomically replace the stored open transactions."""
+        self.write_atomic(self.mempool_path,
+                          codec.encode_transactions(transactions))
+
+    def load_peer_nodes(self):
+        """Load the peer nodes from their file."""
+        return set(self.read_json(self.peers_path, []))
+
+    def save_peer_nodes(self, peer_nodes):
+        """Atomically replace the stored peer nodes."""
+        self.write_json(self.peers_path, sorted(peer_nodes))
+
+    def load_checkpoints(self):
+        """Load the list of balance checkpoints (oldest first)."""
+        return self.read_json(self.checkpoint_path, [])
+
+    def save_checkpoints(self, checkpoints):
+        """Atomically replace the stored balance checkpoints."""
+        self.write_json(self.checkpoint_path, checkpoints)
+
+    def load_legacy(self):
+        """Read a chain file of the old single-file format.
+
+        Returns a (blocks, open transactions, peer nodes) tuple or None if no
+        readable legacy file exists.
+        """
+        try:
+            with open(self.legacy_path, 'r') as file:
+                file_content = file.readlines()
+            blocks = [Block.from_dict(block)
+                      for block in json.loads(file_content[0])]
+            open_transactions = [Transaction.from_dict(tx)
+                                 for tx in json.loads(file_content[1])]
+            peer_nodes = set(json.loads(file_content[2]))
+        except (IOError, IndexError, ValueError):
+            return None
+        return blocks, open_transactions, peer_nodes
+
+    def read_json(self, path, default):
+        """Read a small JSON file, falling back to a default value."""
+        try:
+            with open(path, 'r') as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return default
+
+    def write_json(self, path, value):
+        """Atomically replace a small JSON file."""
+        self.write_atomic(path, json.dumps(value).encode())
+
+    @staticmethod
+    def write_atomic(path, data):
+        """Write data to a temporary file and move it over the target path.
+
+        Arguments:
+            :path: The file which should be replaced.
+            :data: The new content of the file.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+
+class StoredChain:
+    """A list-like view of the chain which decodes stored blocks on demand.
+
+    Blocks of the block log are decoded lazily into a bounded LRU cache, so
+    memory use tracks the working set instead of the chain length. Blocks
+    which are not saved yet are held in memory until save() is called. All
+    blocks of the chain are sealed, i.e. their hash is memoized.
+
+    The number of stored blocks and the pending blocks are kept in one
+    tuple which changes are swapped in atomically, so the chain can be read
+    without a lock while blocks are appended and saved (e.g. by a background
+    writer thread). Truncating the chain (for a reorganization) only changes
+    the tuple; the block log is cut on the next save. Every truncation starts
+    a new generation of the tuple, and cached blocks are keyed by generation
+    and height, so a block a reader decoded before the truncation is never
+    served for the replacing block at the same height.
+
+    Attributes:
+        :storage: The BlockStorage holding the saved blocks.
+        :pending: The blocks which are not saved yet.
+    """
+
+    def __init__(self, storage, blocks=None):
+        self.storage = storage
+        self.__cache = LRUCache(BLOCK_CACHE_SIZE)
+        self.__state_lock = threading.Lock()
+        # Serializes saving and truncating.
+        self.__save_lock = threading.Lock()
+        self.__truncate_height = None
+        # A chain created from a list of blocks replaces the stored one.
+        self.__replaced = blocks is not None
+        if self.__replaced:
+            self.__state = (0, tuple(block.seal() for block in blocks), 0)
+        else:
+            self.__state = (storage.height, (), 0)
+
+    @property
+    def pending(self):
+        return list(self.__state[1])
+
+    def __len__(self):
+        stored, pending, _ = self.__state
+        return stored + len(pending)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def __getitem__(self, key):
+        stored, pending, generation = self.__state
+        length = stored + len(pending)
+        if isinstance(key, slice):
+            return [self[height] for height in range(*key.indices(length))]
+        height = key + length if key < 0 else key
+        if height < 0 or height >= length:
+            raise IndexError('chain index out of range')
+        if height >= stored:
+            return pending[height - stored]
+        block = self.__cache.get((generation, height))
+        if block is None:
+            block = self.storage.read_block(height)
+            if block is None:
+                # The block was truncated meanwhile, read the current chain.
+                return self[key]
+            block.seal()
+            self.__cache.put((generation, height), block)
+        return block
+
+    def append(self, block):
+        """Append a (not yet saved) block to the chain."""
+        block.seal()
+        with self.__state_lock:
+            stored, pending, generation = self.__state
+            self.__state = (stored, pending + (block,), generation)
+
+    def truncate(self, height):
+        """Drop the blocks from a height on (e.g. the blocks of an abandoned
+        fork).
+
+        Arguments:
+            :height: The number of blocks which are kept.
+        """
+        with self.__save_lock, self.__state_lock:
+            stored, pending, generation = self.__state
+            if height >= stored:
+                self.__state = (stored, pending[:height - stored],
+                                generation)
+                return
+            self.__state = (height, (), generation + 1)
+            if self.__truncate_height is None or \
+                    height < self.__truncate_height:
+                self.__truncate_height = height
+        self.__cache.clear()
+
+    def save(self):
+        """Write the pending blocks to the block log.
+
+        Blocks appended while writing stay pending for the next save.
+        """
+        with self.__save_lock:
+            stored, pending, generation = self.__state
+            if self.__replaced:
+                self.storage.rewrite_blocks(pending)
+                self.__replaced = False
+            else:
+                if self.__truncate_height is not None:
+                    self.storage.truncate_blocks(self.__truncate_height)
+                    self.__truncate_height = None
+                self.storage.append_blocks(pending)
+            for height, block in enumerate(pending, stored):
+                self.__cache.put((generation, height), block)
+            with self.__state_lock:
+                self.__state = (stored + len(pending),
+                                self.__state[1][len(pending):], generation)
+
+
+class ChainView:
+    """A read-only view of the chain which does not copy the blocks.
+
+    The view offers no way to change the chain; it reads the blocks of the
+    chain it was created for and is meant to be used right away (e.g. during
+    one request), not kept around.
+
+    Attributes:
+        :height: The index of the tip (the last block).
+        :tip: The last block of the chain.
+    """
+
+    def __init__(self, chain):
+        self.__chain = chain
+
+    def __len__(self):
+        return len(self.__chain)
+
+    def __iter__(self):
+        return iter(self.__chain)
+
+    def __getitem__(self, key):
+        return self.__chain[key]
+
+    @property
+    def height(self):
+        return len(self.__chain) - 1
+
+    @property
+    def tip(self):
+        return self.__chain[-1]
+
+    def block(self, height):
+        """Return the block at a height (index) of the chain."""
+        return self.__chain[height]
+
+    def slice(self, start, stop=None):
+        """Return the list of blocks from height start up to (excluding)
+        height stop."""
+        return self.__chain[start:stop]
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the node import each other by their plain names.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blockChain  # noqa: E402
+from fake_peers import FakeNetwork  # noqa: E402
+from peer_client import PeerClient  # noqa: E402
+from wallet import Wallet  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def node_dir(tmp_path, monkeypatch):
+    """Run every test in an empty directory, the files of a node are created
+    in the working directory."""
+    monkeypatch.chdir(tmp_path)
+    # Search proofs in-process.
+    monkeypatch.setattr(blockChain, 'MINING_WORKERS', 1)
+    return tmp_path
+
+
+@pytest.fixture
+def make_wallet():
+    """Return a function creating a wallet with new keys."""
+    def make(node_id, key_type='rsa'):
+        wallet = Wallet(node_id)
+        wallet.create_keys(key_type)
+        return wallet
+    return make
+
+
+@pytest.fixture
+def make_blockchain():
+    """Return a function creating a Blockchain, which is closed after the
+    test."""
+    blockchains = list()
+
+    def make(public_key, node_id, durability='fsync'):
+        blockchain = blockChain.Blockchain(public_key, node_id, durability)
+        blockchains.append(blockchain)
+        return blockchain
+    yield make
+    for blockchain in blockchains:
+        blockchain.close()
+
+
+@pytest.fixture
+def send():
+    """Return a function signing a transaction of a wallet and adding it to
+    a blockchain."""
+    def sign_and_add(blockchain, wallet, recipient, amount):
+        signature = wallet.sign_transaction(wallet.public_key, recipient,
+                                            amount)
+        return blockchain.add_transaction(recipient, wallet.public_key,
+                                          signature, amount, broadcast=False)
+    return sign_and_add
+
+
+@pytest.fixture
+def network(monkeypatch):
+    """Route the requests of every PeerClient to fake peers (see
+    fake_peers.FakeNetwork)."""
+    network = FakeNetwork()
+    monkeypatch.setattr(PeerClient, 'create_session',
+                        lambda client: network.create_session())
+    return network
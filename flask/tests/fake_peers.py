@@ -0,0 +1,133 @@
+"""A stubbed HTTP layer which routes the requests of PeerClient to fake
+peers instead of the network."""
+
+import json
+from urllib.parse import urlencode, urlsplit
+
+import requests
+
+import codec
+
+
+class FakeResponse:
+    """The parts of a requests.Response the node uses."""
+
+    def __init__(self, status_code=200, json_body=None, content=b'',
+                 content_type='application/octet-stream'):
+        if json_body is not None:
+            content = json.dumps(json_body).encode()
+            content_type = 'application/json'
+        self.status_code = status_code
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+    def __bool__(self):
+        # Like requests.Response, error responses are falsy.
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """Passes requests to the handler of the addressed peer.
+
+    Peers without a handler can not be reached.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.closed = False
+
+    def request(self, method, url, timeout=None, **kwargs):
+        parts = urlsplit(url)
+        # The query parameters are recorded as part of the path.
+        query = urlencode(kwargs.get('params') or {})
+        self.network.requests.append(
+            (method, parts.netloc, parts.path + ('?' + query if query else ''),
+             timeout))
+        handler = self.network.peers.get(parts.netloc)
+        if handler is None:
+            raise requests.exceptions.ConnectionError(url)
+        return handler(method, parts.path, **kwargs)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeNetwork:
+    """The fake peers and the requests sent to them.
+
+    Attributes:
+        :peers: Maps the address of a peer to a handler, which gets the
+        method, the path and the keyword arguments of a request and returns
+        a FakeResponse.
+        :requests: The (method, node, path, timeout) of every request.
+        :sessions: The sessions created by the peer clients.
+    """
+
+    def __init__(self):
+        self.peers = dict()
+        self.requests = list()
+        self.sessions = list()
+
+    def create_session(self):
+        session = FakeSession(self)
+        self.sessions.append(session)
+        return session
+
+    def paths(self, node):
+        """Return the (method, path) of the requests sent to a peer."""
+        return [(method, path) for method, peer, path, _ in self.requests
+                if peer == node]
+
+
+def not_found():
+    return FakeResponse(404, content=b'<h1>Not Found</h1>',
+                        content_type='text/html')
+
+
+def chain_peer(blockchain, length=None, tip=True, sync=True):
+    """Return a handler serving the chain of a Blockchain like a node.
+
+    Arguments:
+        :blockchain: The Blockchain whose chain is served.
+        :length: The length reported by /chain/tip (default: the length of
+        the chain).
+        :tip: Whether the peer knows /chain/tip (older nodes don't).
+        :sync: Whether the peer knows /headers and /blocks.
+    """
+    def handle(method, path, params=None, **kwargs):
+        chain = list(blockchain.chain)
+        if path == '/chain/tip' and tip:
+            return FakeResponse(json_body={
+                'length': length or len(chain),
+                'height': len(chain) - 1,
+                'tip_hash': chain[-1].hash()})
+        if path == '/chain':
+            return FakeResponse(content=codec.encode_blocks(chain))
+        if path in ('/headers', '/blocks') and sync:
+            blocks = chain[params['start']:params['stop']]
+            if path == '/headers':
+                return FakeResponse(
+                    json_body=[block.header_dict() for block in blocks])
+            return FakeResponse(content=codec.encode_blocks(blocks))
+        return not_found()
+    return handle
+
+
+def app_peer(client):
+    """Return a handler passing requests to the test client of a Flask app,
+    e.g. node.app serving another Blockchain."""
+    def handle(method, path, params=None, **kwargs):
+        response = client.open(path, method=method, query_string=params,
+                               json=kwargs.get('json'),
+                               data=kwargs.get('data'),
+                               headers=kwargs.get('headers'))
+        return FakeResponse(response.status_code, content=response.data,
+                            content_type=response.content_type)
+    return handle
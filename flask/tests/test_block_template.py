@@ -0,0 +1,52 @@
+import pytest
+
+from block_template import build_template
+from mempool import transaction_size
+from transaction import Transaction
+
+
+@pytest.fixture
+def sign(make_wallet):
+    """Return a function creating a signed transaction of one wallet."""
+    wallet = make_wallet(1)
+
+    def make(recipient, amount):
+        return Transaction(wallet.public_key, recipient,
+                           wallet.sign_transaction(wallet.public_key,
+                                                   recipient, amount), amount)
+    return make
+
+
+def rich(address):
+    return 100
+
+
+def test_count_limit(sign):
+    transactions = [sign('bob', amount) for amount in range(1, 5)]
+    assert build_template(transactions, rich, max_count=3) == \
+        transactions[:3]
+
+
+def test_byte_limit(sign):
+    transactions = [sign('bob', amount) for amount in range(1, 4)]
+    max_bytes = sum(transaction_size(tx) for tx in transactions[:2])
+    assert build_template(transactions, rich, max_bytes=max_bytes) == \
+        transactions[:2]
+
+
+def test_invalid_and_unaffordable_transactions_are_skipped(sign):
+    valid = sign('bob', 1)
+    forged = Transaction(valid.sender, 'carol', valid.signature, 1)
+    expensive = sign('dave', 8)
+    affordable = sign('erin', 2)
+    selected = build_template([valid, forged, expensive, affordable],
+                              lambda address: 4, max_count=3)
+    # The skipped transactions don't use up the room of the block.
+    assert selected == [valid, affordable]
+
+
+def test_priority_decides_the_order(sign):
+    transactions = [sign('bob', amount) for amount in (1, 3, 2)]
+    selected = build_template(transactions, rich, max_count=2,
+                              priority=lambda tx: tx.amount)
+    assert [tx.amount for tx in selected] == [3, 2]
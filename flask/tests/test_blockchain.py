@@ -0,0 +1,227 @@
+import threading
+
+import blockChain
+import block_template
+import mempool
+import storage
+from ledger import BalanceLedger
+from storage import BlockStorage
+
+
+def test_checkpoint_is_restored(make_wallet, make_blockchain, send,
+                                monkeypatch):
+    monkeypatch.setattr(blockChain, 'CHECKPOINT_INTERVAL', 2)
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    for _ in range(3):
+        blockchain.mine_block()
+    assert send(blockchain, wallet, 'bob', 4)
+    blockchain.mine_block()
+    blockchain.close()
+
+    def rebuild(*args):
+        raise AssertionError('balances were rebuilt from the whole chain')
+    monkeypatch.setattr(BalanceLedger, 'rebuild', rebuild)
+    restored = make_blockchain(wallet.public_key, 1)
+    assert len(restored.chain) == 5
+    assert restored.get_balance() == 36
+    assert restored.get_balance('bob') == 4
+
+
+def test_stale_checkpoint_is_ignored(make_wallet, make_blockchain,
+                                     monkeypatch):
+    monkeypatch.setattr(blockChain, 'CHECKPOINT_INTERVAL', 2)
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    for _ in range(2):
+        blockchain.mine_block()
+    blockchain.close()
+    # A checkpoint whose tip hash does not match the stored chain.
+    storage = BlockStorage(1)
+    checkpoints = storage.load_checkpoints()
+    assert checkpoints
+    for checkpoint in checkpoints:
+        checkpoint['tip_hash'] = 'ff' * 32
+        checkpoint['balances']['received'][wallet.public_key] = 1000
+    storage.save_checkpoints(checkpoints)
+    restored = make_blockchain(wallet.public_key, 1)
+    assert restored.get_balance() == 20
+
+
+def test_received_block_notifies_chain_listeners(make_wallet,
+                                                 make_blockchain):
+    local = make_blockchain(make_wallet(1).public_key, 1)
+    peer = make_blockchain(make_wallet(2).public_key, 2)
+    calls = list()
+    peer.add_chain_listener(lambda: calls.append(True))
+    assert peer.add_block(local.mine_block().to_dict())
+    assert calls == [True]
+
+
+def test_mined_block_notifies_chain_listeners(make_wallet, make_blockchain):
+    blockchain = make_blockchain(make_wallet(1).public_key, 1)
+    calls = list()
+    blockchain.add_chain_listener(lambda: calls.append(True))
+    assert blockchain.mine_block(broadcast=False) is not None
+    assert calls == [True]
+
+
+def test_concurrent_transactions_do_not_overspend(make_wallet,
+                                                  make_blockchain, send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    results = list()
+    threads = [threading.Thread(target=lambda name=name: results.append(
+        send(blockchain, wallet, name, 2)))
+        for name in ('bob{}'.format(i) for i in range(8))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 5
+    assert blockchain.get_balance() == 0
+
+
+def test_async_durability_writes_on_close(make_wallet, make_blockchain,
+                                          send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1, 'async')
+    assert blockchain.durability == 'async'
+    blockchain.mine_block()
+    assert send(blockchain, wallet, 'bob', 4)
+    blockchain.close()
+    restored = make_blockchain(wallet.public_key, 1)
+    assert len(restored.chain) == 2
+    assert len(restored.get_open_transaction()) == 1
+    assert restored.get_balance() == 6
+
+
+def test_close_releases_the_block_log_mapping(make_wallet, make_blockchain,
+                                              monkeypatch):
+    wallet = make_wallet(1)
+    mined = make_blockchain(wallet.public_key, 1)
+    mined.mine_block()
+    mined.close()
+    maps = list()
+    mmap_class = storage.mmap.mmap
+
+    def record(*args, **kwargs):
+        mapping = mmap_class(*args, **kwargs)
+        maps.append(mapping)
+        return mapping
+    monkeypatch.setattr(storage.mmap, 'mmap', record)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    assert blockchain.chain[1].index == 1
+    assert maps and not maps[-1].closed
+    blockchain.close()
+    assert all(mapping.closed for mapping in maps)
+
+
+def test_duplicate_transaction_is_rejected(make_wallet, make_blockchain,
+                                           send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    assert send(blockchain, wallet, 'bob', 4)
+    assert not send(blockchain, wallet, 'bob', 4)
+    assert len(blockchain.get_open_transaction()) == 1
+    assert blockchain.get_balance() == 6
+    # The mined transaction leaves the mempool and the overlay.
+    blockchain.mine_block()
+    assert blockchain.get_open_transaction() == []
+    assert blockchain.get_balance() == 16
+
+
+def test_evicted_transaction_releases_its_funds(make_wallet, make_blockchain,
+                                                send, monkeypatch):
+    monkeypatch.setattr(mempool, 'MAX_COUNT', 2)
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    for recipient in ('bob', 'carol', 'dave'):
+        assert send(blockchain, wallet, recipient, 3)
+    assert [tx.recipient for tx in blockchain.get_open_transaction()] == \
+        ['carol', 'dave']
+    assert blockchain.get_balance() == 4
+
+
+def test_transactions_beyond_the_template_stay_open(make_wallet,
+                                                    make_blockchain, send,
+                                                    monkeypatch):
+    monkeypatch.setattr(block_template, 'MAX_BLOCK_TRANSACTIONS', 2)
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    for recipient in ('bob', 'carol', 'dave'):
+        assert send(blockchain, wallet, recipient, 1)
+    block = blockchain.mine_block()
+    assert [tx.recipient for tx in block.transactions[:-1]] == \
+        ['bob', 'carol']
+    assert [tx.recipient for tx in blockchain.get_open_transaction()] == \
+        ['dave']
+
+
+def test_fork_is_rolled_back_and_transactions_requeued(make_wallet,
+                                                       make_blockchain,
+                                                       send):
+    alice = make_wallet(1)
+    bob = make_wallet(2)
+    local = make_blockchain(alice.public_key, 1)
+    peer = make_blockchain(bob.public_key, 2)
+    shared = local.mine_block(broadcast=False)
+    assert peer.add_block(shared.to_dict())
+
+    # The local node mines a block with a transaction of alice, the peer
+    # mines a longer fork on the shared block.
+    assert send(local, alice, 'carol', 3)
+    orphaned = local.mine_block(broadcast=False)
+    assert len(orphaned.transactions) == 2
+    for _ in range(2):
+        peer.mine_block(broadcast=False)
+
+    assert local.adopt_blocks(1, peer.chain.slice(2))
+    assert [block.hash() for block in local.chain] == \
+        [block.hash() for block in peer.chain]
+    # The reward of the orphaned block is gone, the transaction is open
+    # again and still reserves alice's funds.
+    assert [tx.tx_id() for tx in local.get_open_transaction()] == \
+        [orphaned.transactions[0].tx_id()]
+    assert local.get_balance() == 7
+    assert local.get_balance(bob.public_key) == 20
+    assert local.verify_chain()
+
+    # The rolled back block log is read back after a restart.
+    local.close()
+    restarted = make_blockchain(alice.public_key, 1)
+    assert [block.hash() for block in restarted.chain] == \
+        [block.hash() for block in peer.chain]
+    assert len(restarted.get_open_transaction()) == 1
+
+
+def test_adopt_blocks_rejects_shorter_chain(make_wallet, make_blockchain):
+    alice = make_wallet(1)
+    local = make_blockchain(alice.public_key, 1)
+    peer = make_blockchain(make_wallet(2).public_key, 2)
+    for _ in range(2):
+        local.mine_block(broadcast=False)
+    peer.mine_block(broadcast=False)
+    assert not local.adopt_blocks(0, peer.chain.slice(1))
+    assert len(local.chain) == 3
+
+
+def test_mined_block_survives_eviction_of_the_tip(make_wallet,
+                                                  make_blockchain,
+                                                  monkeypatch):
+    monkeypatch.setattr(storage, 'BLOCK_CACHE_SIZE', 1)
+    blockchain = make_blockchain(make_wallet(1).public_key, 1)
+    blockchain.mine_block(broadcast=False)
+    proof_of_work = blockchain.proof_of_work
+
+    def evicting_proof_of_work(header, cancel_event=None):
+        # A concurrent read evicts the tip from the block cache.
+        blockchain.chain.block(0)
+        return proof_of_work(header, cancel_event)
+    monkeypatch.setattr(blockchain, 'proof_of_work', evicting_proof_of_work)
+    assert blockchain.mine_block(broadcast=False) is not None
+    assert len(blockchain.chain) == 3
@@ -0,0 +1,78 @@
+import pytest
+
+import codec
+from block import Block
+from transaction import Transaction
+from utility.hash_utils import hash_block, merkle_root
+
+
+def make_blocks():
+    transactions = [
+        Transaction('ab' * 64, 'cd' * 64, 'ef' * 64, 2.5),
+        Transaction('cd' * 64, 'ab' * 64, 'ef' * 64, 3),
+        Transaction('MINING', 'ab' * 64, '', 10)]
+    genesis = Block(0, '', [], 100, 0)
+    return [genesis, Block(1, hash_block(genesis), transactions, 7, 1.5)]
+
+
+@pytest.mark.parametrize('amount', [0, 5, 2 ** 63 - 1, 0.1, 2.5, 1e-9])
+def test_amount_round_trip_keeps_type(amount):
+    tx = Transaction('aa' * 8, 'bb' * 8, 'cc' * 8, amount)
+    decoded, = codec.decode_transactions(codec.encode_transactions([tx]))
+    assert decoded.amount == amount
+    assert type(decoded.amount) is type(amount)
+    # str() of the amount is signed, so the type must survive.
+    assert str(decoded.amount) == str(amount)
+
+
+@pytest.mark.parametrize('value', ['', 'ab' * 20, 'MINING', 'ABCD', 'abc',
+                                   'ed25519:' + 'ef' * 32, 'ed25519:xyz',
+                                   'café'])
+def test_string_round_trip(value):
+    assert codec.decode_string(
+        codec.Reader(codec.encode_string(value))) == value
+
+
+def test_blocks_round_trip():
+    blocks = make_blocks()
+    decoded = codec.decode_blocks(codec.encode_blocks(blocks))
+    assert [block.to_dict() for block in decoded] == \
+        [block.to_dict() for block in blocks]
+    assert hash_block(decoded[1]) == hash_block(blocks[1])
+
+
+def test_decode_blocks_reads_json():
+    blocks = make_blocks()
+    payload = codec.json.dumps([block.to_dict() for block in blocks])
+    assert [hash_block(block) for block in
+            codec.decode_blocks(payload.encode())] == \
+        [hash_block(block) for block in blocks]
+
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(ValueError):
+        codec.decode_blocks(b'\x09' + codec.encode_blocks(make_blocks())[1:])
+
+
+def test_merkle_root_round_trip():
+    blocks = make_blocks()
+    block = blocks[1]
+    blocks[1] = Block(block.index, block.previous_hash, block.transactions,
+                      block.proof, block.timestamp,
+                      merkle_root(block.transactions))
+    decoded = codec.decode_blocks(codec.encode_blocks(blocks))
+    assert decoded[0].merkle_root is None
+    assert decoded[1].merkle_root == blocks[1].merkle_root
+    assert hash_block(decoded[1]) == hash_block(blocks[1])
+
+
+@pytest.mark.parametrize('value', [True, False, 2 ** 63, -2 ** 63 - 1, '1',
+                                   None])
+def test_encode_number_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        codec.encode_number(value)
+
+
+def test_encode_string_rejects_non_strings():
+    with pytest.raises(ValueError):
+        codec.encode_string(5)
@@ -0,0 +1,97 @@
+import pytest
+
+import codec
+import node
+from compact_block import CompactBlock
+from fake_peers import app_peer
+from transaction import Transaction
+
+
+@pytest.fixture
+def node_peer(make_wallet, make_blockchain, network, monkeypatch):
+    """A peer served by the routes of the node (at 'peer:2')."""
+    peer = make_blockchain(make_wallet(2).public_key, 2)
+    monkeypatch.setattr(node, 'blockchain', peer, raising=False)
+    network.peers['peer:2'] = app_peer(node.app.test_client())
+    return peer
+
+
+def receive(blockchain, tx):
+    assert blockchain.add_transaction(tx.recipient, tx.sender, tx.signature,
+                                      tx.amount, is_receiving=True)
+
+
+def test_compact_block_round_trip(make_wallet, make_blockchain, send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block(broadcast=False)
+    for recipient in ('bob', 'carol', 'dave'):
+        assert send(blockchain, wallet, recipient, 1)
+    block = blockchain.mine_block(broadcast=False)
+    transactions = block.transactions
+    compact = codec.decode_compact_block(codec.encode_compact_block(
+        CompactBlock.from_block(block, {transactions[0].tx_id()})))
+    assert compact.tx_ids == [tx.tx_id() for tx in transactions]
+    assert sorted(compact.prefilled) == [0, 3]
+    known = {tx.tx_id(): tx for tx in transactions[1:3]}
+    assert compact.to_block(known.get).hash() == block.hash()
+    assert compact.missing({}.get) == [tx.tx_id() for tx in transactions[1:3]]
+
+
+def test_compact_block_requests_missing_transactions(make_wallet,
+                                                     make_blockchain, send):
+    alice = make_wallet(1)
+    local = make_blockchain(alice.public_key, 1)
+    peer = make_blockchain(make_wallet(2).public_key, 2)
+    assert peer.add_block(local.mine_block(broadcast=False))
+    assert send(local, alice, 'bob', 1)
+    assert send(local, alice, 'carol', 2)
+    # The peer only knows the first transaction.
+    known = local.get_open_transaction()[0]
+    receive(peer, known)
+    block = local.mine_block(broadcast=False)
+
+    unknown, missing = peer.reconstruct_block(CompactBlock.from_block(block))
+    assert unknown is None
+    assert missing == [tx.tx_id() for tx in block.transactions[:-1]
+                       if tx.tx_id() != known.tx_id()]
+
+    rebuilt, missing = peer.reconstruct_block(
+        CompactBlock.from_block(block, set(missing)))
+    assert missing == []
+    assert rebuilt.hash() == block.hash()
+    assert peer.add_block(rebuilt)
+    assert peer.get_open_transaction() == []
+    assert peer.get_balance('carol') == 2
+
+
+def test_missing_transactions_are_resent(make_wallet, make_blockchain, send,
+                                         network, node_peer):
+    alice = make_wallet(1)
+    local = make_blockchain(alice.public_key, 1)
+    local.add_peer_node('peer:2')
+    assert node_peer.add_block(local.mine_block(broadcast=False))
+    assert send(local, alice, 'bob', 1)
+    assert send(local, alice, 'carol', 2)
+    receive(node_peer, local.get_open_transaction()[0])
+    block = local.mine_block(broadcast=False)
+    assert local.broadcast_block(block).results() == \
+        {'peer:2': {'status_code': 201}}
+    assert network.paths('peer:2') == [('POST', '/broadcast-compact-block'),
+                                       ('POST', '/broadcast-compact-block')]
+    assert node_peer.chain.tip.hash() == block.hash()
+
+
+def test_known_transactions_are_not_resent(make_wallet, make_blockchain,
+                                           send, network, node_peer):
+    alice = make_wallet(1)
+    local = make_blockchain(alice.public_key, 1)
+    local.add_peer_node('peer:2')
+    assert node_peer.add_block(local.mine_block(broadcast=False))
+    assert send(local, alice, 'bob', 1)
+    receive(node_peer, local.get_open_transaction()[0])
+    block = local.mine_block(broadcast=False)
+    assert local.broadcast_block(block).results() == \
+        {'peer:2': {'status_code': 201}}
+    assert network.paths('peer:2') == [('POST', '/broadcast-compact-block')]
+    assert node_peer.get_open_transaction() == []
@@ -0,0 +1,21 @@
+from block import Block
+from ledger import BalanceLedger
+from transaction import Transaction
+
+
+def test_balance_tracks_blocks_and_open_transactions():
+    ledger = BalanceLedger()
+    ledger.rebuild([
+        Block(0, '', [], 100, 0),
+        Block(1, 'ab', [Transaction('MINING', 'alice', '', 10)], 1, 1)],
+        [Transaction('alice', 'bob', 'ss', 3)])
+    assert ledger.get_balance('alice') == 7
+    assert ledger.get_balance('bob') == 0
+    ledger.apply_block(Block(2, 'cd', [Transaction('alice', 'bob', 'ss', 3),
+                                       Transaction('MINING', 'bob', '', 10)],
+                             1, 2))
+    ledger.reset_pending([])
+    assert ledger.get_balance('alice') == 7
+    assert ledger.get_balance('bob') == 13
+    ledger.add_pending(Transaction('bob', 'alice', 'ss', 5))
+    assert ledger.get_balance('bob') == 8
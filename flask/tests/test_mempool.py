@@ -0,0 +1,80 @@
+import pytest
+
+from mempool import Mempool, MempoolFullError, transaction_size
+from transaction import Transaction
+
+
+def make_tx(sender='aa', amount=1, recipient='bb'):
+    return Transaction(sender, recipient, 'cc' * 8, amount)
+
+
+def admit(mempool, tx):
+    evicted = mempool.make_room(tx)
+    mempool.add(tx)
+    return evicted
+
+
+def test_duplicates_are_not_added():
+    mempool = Mempool()
+    tx = make_tx()
+    assert mempool.add(tx)
+    assert not mempool.add(make_tx())
+    assert len(mempool) == 1
+    assert tx.tx_id() in mempool
+    assert mempool.get(tx.tx_id()) is tx
+
+
+def test_oldest_transactions_are_evicted_by_count():
+    mempool = Mempool(max_count=3)
+    transactions = [make_tx(amount=i) for i in range(5)]
+    evicted = [tx for tx in transactions for tx in admit(mempool, tx)]
+    assert evicted == transactions[:2]
+    assert mempool.transactions() == transactions[2:]
+
+
+def test_transactions_are_evicted_by_size():
+    small = make_tx(amount=1)
+    mempool = Mempool(max_bytes=2 * transaction_size(small))
+    admit(mempool, small)
+    admit(mempool, make_tx(amount=2))
+    assert admit(mempool, make_tx(amount=3)) == [small]
+    assert mempool.size_bytes <= mempool.max_bytes
+
+
+def test_too_large_transaction_is_rejected():
+    mempool = Mempool(max_bytes=10)
+    with pytest.raises(MempoolFullError):
+        mempool.make_room(make_tx())
+
+
+def test_sender_limit_is_enforced():
+    mempool = Mempool(max_per_sender=2)
+    admit(mempool, make_tx(amount=1))
+    admit(mempool, make_tx(amount=2))
+    with pytest.raises(MempoolFullError):
+        mempool.make_room(make_tx(amount=3))
+    admit(mempool, make_tx(sender='dd', amount=3))
+    mempool.remove(make_tx(amount=1).tx_id())
+    admit(mempool, make_tx(amount=3))
+    assert len(mempool) == 3
+
+
+def test_priority_decides_eviction():
+    mempool = Mempool(max_count=2, priority=lambda tx: tx.amount)
+    low = make_tx(amount=1)
+    admit(mempool, make_tx(amount=5))
+    admit(mempool, low)
+    assert admit(mempool, make_tx(amount=3)) == [low]
+    with pytest.raises(MempoolFullError):
+        mempool.make_room(make_tx(amount=2))
+    assert sorted(tx.amount for tx in mempool) == [3, 5]
+
+
+def test_remove_all_returns_removed_transactions():
+    mempool = Mempool()
+    transactions = [make_tx(amount=i) for i in range(3)]
+    for tx in transactions:
+        admit(mempool, tx)
+    removed = mempool.remove_all([transactions[1], make_tx(amount=9)])
+    assert removed == [transactions[1]]
+    assert mempool.status()['count'] == 2
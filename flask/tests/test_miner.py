@@ -0,0 +1,54 @@
+import threading
+
+import miner
+from transaction import Transaction
+from utility.verification import Verification
+
+TRANSACTIONS = [Transaction('MINING', 'ab' * 8, '', 10)]
+LAST_HASH = 'cd' * 32
+
+
+def first_proof():
+    proof = 0
+    while not Verification.valid_proof(TRANSACTIONS, LAST_HASH, proof):
+        proof += 1
+    return proof
+
+
+def test_prefix_search_matches_valid_proof():
+    proof = first_proof()
+    prefix = Verification.proof_prefix(TRANSACTIONS, LAST_HASH)
+    assert miner.search_range(prefix, 0, None) == proof
+    assert miner.search_range(prefix, 0, proof) is None
+
+
+def test_workers_find_a_valid_proof(monkeypatch):
+    # Skip the in-process search, so the worker processes are started.
+    monkeypatch.setattr(miner, 'SEQUENTIAL_NONCES', 0)
+    prefix = Verification.proof_prefix(TRANSACTIONS, LAST_HASH)
+    proof = miner.proof_of_work(prefix, workers=2)
+    assert Verification.valid_proof(TRANSACTIONS, LAST_HASH, proof)
+
+
+def test_workers_are_spawned(monkeypatch):
+    monkeypatch.setattr(miner, 'SEQUENTIAL_NONCES', 0)
+    started = list()
+    process_class = miner.MP_CONTEXT.Process
+
+    def record(*args, **kwargs):
+        process = process_class(*args, **kwargs)
+        started.append(process._start_method)
+        return process
+    monkeypatch.setattr(miner.MP_CONTEXT, 'Process', record)
+    prefix = Verification.proof_prefix(TRANSACTIONS, LAST_HASH)
+    assert miner.proof_of_work(prefix, workers=2) is not None
+    assert started == ['spawn', 'spawn']
+
+
+def test_cancelled_search_returns_none(monkeypatch):
+    monkeypatch.setattr(miner, 'SEQUENTIAL_NONCES', 0)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    prefix = Verification.proof_prefix(TRANSACTIONS, LAST_HASH)
+    for workers in (1, 2):
+        assert miner.proof_of_work(prefix, workers, cancel_event) is None
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import mining_service
+from block import Block
+from mining_service import MiningService
+from persistence import PersistenceError
+
+
+class FakeBlockchain:
+    """Stands in for Blockchain; the first round runs until cancelled."""
+
+    public_key = 'ab' * 8
+    resolve_conflicts = False
+
+    def __init__(self):
+        self.listeners = list()
+        self.rounds = 0
+        self.round_started = threading.Event()
+
+    def add_chain_listener(self, listener):
+        self.listeners.append(listener)
+
+    def mine_block(self, cancel_event=None):
+        self.rounds += 1
+        self.round_started.set()
+        if self.rounds == 1:
+            cancel_event.wait(5)
+            if cancel_event.is_set():
+                return None
+        return Block(self.rounds, '', [], 1, 0)
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_round_is_restarted_when_the_chain_changes():
+    blockchain = FakeBlockchain()
+    service = MiningService(blockchain, interval=60)
+    assert service.start()
+    assert not service.start()
+    assert blockchain.round_started.wait(5)
+    for listener in blockchain.listeners:
+        listener()
+    wait_for(lambda: service.blocks_mined == 1)
+    service.stop()
+    assert not service.is_running()
+    status = service.status()
+    assert status['restarts'] == 1
+    assert status['last_block_index'] == 2
+
+
+def test_stop_cancels_the_running_round():
+    blockchain = FakeBlockchain()
+    service = MiningService(blockchain, interval=60)
+    service.start()
+    assert blockchain.round_started.wait(5)
+    service.stop()
+    assert not service.is_running()
+    assert service.status()['blocks_mined'] == 0
+    assert blockchain.rounds == 1
+
+
+def test_failed_save_does_not_stop_mining():
+    class FailingSave(FakeBlockchain):
+        def mine_block(self, cancel_event=None):
+            self.rounds += 1
+            if self.rounds == 1:
+                raise PersistenceError('Saving Failed!!')
+            return Block(self.rounds, '', [], 1, 0)
+    blockchain = FailingSave()
+    service = MiningService(blockchain, interval=0.01)
+    service.start()
+    wait_for(lambda: blockchain.rounds >= 3)
+    service.stop()
+    assert service.status()['blocks_mined'] >= 3
+
+
+def test_failed_round_is_retried_after_a_delay(monkeypatch):
+    monkeypatch.setattr(mining_service, 'ERROR_DELAY', 0.01)
+
+    class FailingRound(FakeBlockchain):
+        def mine_block(self, cancel_event=None):
+            self.rounds += 1
+            if self.rounds <= 2:
+                raise RuntimeError('peer answered garbage')
+            return Block(self.rounds, '', [], 1, 0)
+    blockchain = FailingRound()
+    service = MiningService(blockchain, interval=60)
+    service.start()
+    wait_for(lambda: service.blocks_mined == 1)
+    assert service.is_running()
+    service.stop()
+    status = service.status()
+    assert status['errors'] == 2
+    assert status['last_block_index'] == 3
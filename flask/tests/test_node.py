@@ -0,0 +1,139 @@
+import pytest
+
+import codec
+import node
+import persistence
+from mining_service import MiningService
+from storage import BlockStorage
+
+
+@pytest.fixture
+def blockchain(make_wallet, make_blockchain, monkeypatch):
+    """The Blockchain served by the routes of the node."""
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    monkeypatch.setattr(node, 'wallet', wallet, raising=False)
+    monkeypatch.setattr(node, 'blockchain', blockchain, raising=False)
+    return blockchain
+
+
+@pytest.fixture
+def client(blockchain):
+    return node.app.test_client()
+
+
+@pytest.fixture
+def mining_service(blockchain, monkeypatch):
+    """The MiningService of the node, which is stopped after the test."""
+    mining_service = MiningService(blockchain)
+    monkeypatch.setattr(node, 'mining_service', mining_service,
+                        raising=False)
+    yield mining_service
+    mining_service.stop()
+
+
+def test_headers_and_blocks_are_paged(blockchain, client, monkeypatch):
+    monkeypatch.setattr(node, 'MAX_PAGE_BLOCKS', 2)
+    for _ in range(4):
+        blockchain.mine_block(broadcast=False)
+    headers = client.get('/headers?start=1&stop=3').get_json()
+    assert [header['hash'] for header in headers] == \
+        [block.hash() for block in blockchain.chain.slice(1, 3)]
+    assert headers[0]['transaction_count'] == 1
+    response = client.get('/blocks?start=1',
+                          headers={'Accept': codec.BINARY_MIMETYPE})
+    assert [block.hash() for block in codec.decode_blocks(response.data)] \
+        == [block.hash() for block in blockchain.chain.slice(1, 3)]
+    blocks = client.get('/blocks?start=4&stop=9').get_json()
+    assert [block['index'] for block in blocks] == [4]
+    assert client.get('/blocks?start=7').get_json() == []
+
+
+def test_failed_save_is_reported_and_retried(blockchain, client,
+                                             monkeypatch):
+    monkeypatch.setattr(persistence, 'RETRY_DELAY', 0.01)
+    blockchain.mine_block(broadcast=False)
+    save = BlockStorage.save_open_transactions
+    failures = list()
+
+    def flaky_save(storage, transactions):
+        if not failures:
+            failures.append(True)
+            raise IOError('disk full')
+        save(storage, transactions)
+    monkeypatch.setattr(BlockStorage, 'save_open_transactions', flaky_save)
+    response = client.post('/transaction',
+                           json={'recipient': 'bob', 'amount': 2})
+    assert response.status_code == 500
+    assert response.get_json() == {'message': 'Saving Failed!!'}
+    # The change was made and is written by the retry.
+    assert len(blockchain.get_open_transaction()) == 1
+    blockchain.close()
+    assert len(BlockStorage(1).load_open_transactions()) == 1
+
+
+@pytest.mark.parametrize('field, value', [
+    ('amount', 10 ** 30), ('amount', -1), ('amount', True),
+    ('amount', float('inf')), ('recipient', 5), ('signature', None)])
+def test_invalid_transaction_fields_are_rejected(client, field, value):
+    values = {'sender': 'aa', 'recipient': 'bb', 'signature': 'cc',
+              'amount': 1}
+    values[field] = value
+    response = client.post('/broadcast-transaction', json=values)
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Some data is invalid'}
+
+
+@pytest.mark.parametrize('field, value', [
+    ('index', -1), ('index', 1.5), ('proof', 2 ** 64),
+    ('previous_hash', 7), ('transactions', 'tx')])
+def test_invalid_block_fields_are_rejected(blockchain, client, field,
+                                           value):
+    values = blockchain.chain.tip.to_dict()
+    values['index'] = 1
+    values[field] = value
+    response = client.post('/broadcast-block', json={'block': values})
+    assert response.status_code == 400
+    assert len(blockchain.chain) == 1
+
+
+@pytest.mark.parametrize('interval', ['soon', -1, None])
+def test_invalid_mining_interval_is_rejected(client, mining_service,
+                                             interval):
+    response = client.post('/mining/start', json={'interval': interval})
+    assert response.status_code == 400
+    assert not mining_service.status()['running']
+
+
+def test_mining_is_started_with_the_interval(client, mining_service):
+    response = client.post('/mining/start', json={'interval': 60})
+    assert response.status_code == 200
+    assert response.get_json()['status']['interval'] == 60
+    assert mining_service.status()['running']
+
+
+@pytest.mark.parametrize('body', [[1, 2], 'full', 5])
+def test_verify_chain_rejects_a_body_which_is_no_object(client, body):
+    response = client.post('/verify-chain', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Some data is invalid'}
+
+
+@pytest.mark.parametrize('path', ['/mine', '/mining/start'])
+@pytest.mark.parametrize('body', [['interval'], 'wait', 5])
+def test_mining_rejects_a_body_which_is_no_object(blockchain, client,
+                                                 mining_service, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Some data is invalid'}
+    assert len(blockchain.chain) == 1
+    assert not mining_service.status()['running']
+
+
+@pytest.mark.parametrize('body', [['ed25519'], 'ed25519'])
+def test_wallet_rejects_a_body_which_is_no_object(client, body):
+    public_key = node.wallet.public_key
+    response = client.post('/wallet', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Some data is invalid'}
+    assert node.wallet.public_key == public_key
@@ -0,0 +1,154 @@
+import time
+
+from urllib3.util.retry import Retry
+
+import peer_client
+from block import Block
+from fake_peers import FakeResponse, not_found
+from peer_client import PeerClient
+
+
+def test_sessions_are_kept_per_peer(network):
+    network.peers['a:1'] = lambda method, path, **kwargs: FakeResponse()
+    network.peers['b:2'] = lambda method, path, **kwargs: FakeResponse()
+    client = PeerClient()
+    client.get('a:1', '/chain')
+    client.post('a:1', '/broadcast-block')
+    client.get('b:2', '/chain')
+    assert len(network.sessions) == 2
+    client.remove('a:1')
+    assert network.sessions[0].closed
+    assert not network.sessions[1].closed
+    client.close()
+    assert network.sessions[1].closed
+
+
+def test_timeouts(network):
+    network.peers['a:1'] = lambda method, path, **kwargs: FakeResponse()
+    client = PeerClient(connect_timeout=1, read_timeout=2)
+    client.get('a:1', '/chain')
+    client.get('a:1', '/chain', timeout=0.5)
+    assert [timeout for _, _, _, timeout in network.requests] == \
+        [(1, 2), 0.5]
+
+
+def test_only_gets_are_retried_after_a_response():
+    client = PeerClient(retries=3)
+    session = client.create_session()
+    retry = session.get_adapter('http://a:1').max_retries
+    assert retry.total == 3
+    assert retry.is_retry('GET', 503)
+    assert not retry.is_retry('POST', 503)
+    assert retry.backoff_factor == peer_client.BACKOFF_FACTOR
+    session.close()
+
+
+def test_broadcast_results(network):
+    def slow(method, path, **kwargs):
+        time.sleep(0.5)
+        return FakeResponse()
+    network.peers['a:1'] = lambda method, path, **kwargs: FakeResponse(201)
+    network.peers['b:2'] = slow
+    client = PeerClient()
+    answered = list()
+    broadcast = client.broadcast(
+        ['a:1', 'b:2', 'c:3'], '/broadcast-transaction',
+        lambda node, response, timeout: answered.append(node), deadline=0.2,
+        json={})
+    assert broadcast.results() == {'a:1': {'status_code': 201},
+                                   'b:2': {'error': 'timeout'},
+                                   'c:3': {'error': 'unreachable'}}
+    assert answered == ['a:1']
+    # The deadline caps the request timeouts.
+    assert ('POST', 'b:2', '/broadcast-transaction', (0.2, 0.2)) in \
+        network.requests
+    client.close()
+
+
+def test_transactions_and_blocks_are_broadcast(make_wallet, make_blockchain,
+                                               send, network):
+    received = list()
+
+    def peer(method, path, json=None, data=None, **kwargs):
+        # An older peer which does not know compact blocks and only reads
+        # JSON.
+        if path == '/broadcast-compact-block':
+            return not_found()
+        if json is None:
+            return FakeResponse(400)
+        if path == '/broadcast-block':
+            received.append((path, Block.from_dict(json['block']).hash()))
+            return FakeResponse(409)
+        received.append((path, json))
+        return FakeResponse(201)
+    network.peers['a:1'] = peer
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.add_peer_node('a:1')
+    block = blockchain.mine_block(broadcast=False)
+    assert send(blockchain, wallet, 'bob', 2)
+    tx = blockchain.get_open_transaction()[0]
+    assert blockchain.broadcast_transaction(tx).results() == \
+        {'a:1': {'status_code': 201}}
+    assert received == [('/broadcast-transaction', tx.to_dict())]
+    assert blockchain.broadcast_block(block).results() == \
+        {'a:1': {'status_code': 409}}
+    # The full block is sent as JSON instead of the compact one.
+    assert received[-1] == ('/broadcast-block', block.hash())
+    # The peer rejected the block, the chains have to be resolved.
+    assert blockchain.resolve_conflicts
+    # The follow-up only gets the time left of the broadcast deadline.
+    first, follow_up = [timeout for method, node, path, timeout
+                        in network.requests if 'block' in path]
+    assert first == (peer_client.CONNECT_TIMEOUT,
+                     peer_client.BROADCAST_DEADLINE)
+    assert follow_up[1] < peer_client.BROADCAST_DEADLINE
+
+
+def test_follow_up_gets_the_time_left_of_the_deadline(network):
+    def slow(method, path, **kwargs):
+        if path == '/broadcast-block':
+            time.sleep(0.15)
+        return FakeResponse(202)
+    network.peers['a:1'] = slow
+    client = PeerClient()
+    timeouts = list()
+
+    def on_response(node, response, timeout):
+        timeouts.append(timeout)
+        return client.post(node, '/follow-up', timeout=timeout)
+    broadcast = client.broadcast(['a:1'], '/broadcast-block', on_response,
+                                 deadline=0.2)
+    assert broadcast.results() == {'a:1': {'status_code': 202}}
+    connect, read = timeouts[0]
+    assert connect == read and 0 < read <= 0.05
+    assert network.requests[-1] == ('POST', 'a:1', '/follow-up',
+                                    (connect, read))
+    client.close()
+
+
+def test_get_all_leaves_out_unreachable_peers(network):
+    network.peers['a:1'] = lambda method, path, **kwargs: FakeResponse(
+        json_body={'length': 3})
+    client = PeerClient()
+    responses = client.get_all(['a:1', 'b:2'], '/chain/tip')
+    assert list(responses) == ['a:1']
+    assert responses['a:1'].json() == {'length': 3}
+    client.close()
+
+
+def test_retry_of_older_urllib3(monkeypatch):
+    class OldRetry(Retry):
+        """Retry of urllib3 before 1.26, which calls allowed_methods
+        method_whitelist."""
+
+        def __init__(self, method_whitelist=None, **options):
+            if 'allowed_methods' in options:
+                raise TypeError('unexpected keyword argument')
+            super().__init__(allowed_methods=method_whitelist, **options)
+    monkeypatch.setattr(peer_client, 'Retry', OldRetry)
+    session = PeerClient().create_session()
+    retry = session.get_adapter('http://a:1').max_retries
+    assert isinstance(retry, OldRetry)
+    assert retry.allowed_methods == frozenset(['GET'])
+    session.close()
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import persistence
+from persistence import PersistenceError, PersistenceWriter
+
+
+class BlockingWrite:
+    """Records the written kinds; the first write waits until released."""
+
+    def __init__(self):
+        self.writes = list()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, kinds):
+        self.started.set()
+        if not self.writes:
+            self.release.wait(5)
+        self.writes.append(set(kinds))
+
+
+def test_changes_queued_while_writing_are_coalesced():
+    write = BlockingWrite()
+    writer = PersistenceWriter(write)
+    writer.request('blocks')
+    assert write.started.wait(5)
+    tickets = [writer.request('transactions'), writer.request('peers'),
+               writer.request('transactions')]
+    write.release.set()
+    writer.wait(tickets[-1])
+    assert write.writes == [{'blocks'}, {'transactions', 'peers'}]
+    writer.close()
+
+
+def test_fsync_mode_waits_until_written():
+    write = BlockingWrite()
+    writer = PersistenceWriter(write, 'fsync')
+    ticket = writer.request('blocks')
+    waited = threading.Event()
+    thread = threading.Thread(target=lambda: writer.wait(ticket) or
+                              waited.set())
+    thread.start()
+    assert not waited.wait(0.1)
+    write.release.set()
+    assert waited.wait(5)
+    writer.close()
+
+
+def test_async_mode_acknowledges_right_away():
+    write = BlockingWrite()
+    writer = PersistenceWriter(write, 'async')
+    writer.wait(writer.request('blocks'))
+    assert write.writes == []
+    write.release.set()
+    writer.close()
+    assert write.writes == [{'blocks'}]
+
+
+def test_close_flushes_and_later_requests_write_directly():
+    write = BlockingWrite()
+    write.release.set()
+    writer = PersistenceWriter(write, 'async')
+    writer.request('blocks')
+    writer.close()
+    writer.request('peers')
+    assert write.writes == [{'blocks'}, {'peers'}]
+
+
+def test_unknown_durability_mode_is_rejected():
+    with pytest.raises(ValueError):
+        PersistenceWriter(BlockingWrite(), 'never')
+
+
+def test_failed_write_is_retried(monkeypatch):
+    monkeypatch.setattr(persistence, 'RETRY_DELAY', 0.01)
+    writes = list()
+
+    def write(kinds):
+        writes.append(set(kinds))
+        if len(writes) == 1:
+            raise IOError('disk full')
+    writer = PersistenceWriter(write)
+    ticket = writer.request('blocks')
+    with pytest.raises(PersistenceError):
+        writer.wait(ticket)
+    # The failed kinds are written again with the next change.
+    writer.wait(writer.request('peers'))
+    assert writes[0] == {'blocks'}
+    assert writes[-1] == {'blocks', 'peers'}
+    writer.close()
@@ -0,0 +1,94 @@
+import blockChain
+from fake_peers import chain_peer
+
+
+def mined_blockchain(make_wallet, make_blockchain, node_id, blocks):
+    blockchain = make_blockchain(make_wallet(node_id).public_key, node_id)
+    for _ in range(blocks):
+        blockchain.mine_block(broadcast=False)
+    return blockchain
+
+
+def hashes(chain):
+    return [block.hash() for block in chain]
+
+
+def test_only_longer_chains_are_downloaded(make_wallet, make_blockchain,
+                                          network):
+    local = mined_blockchain(make_wallet, make_blockchain, 1, 2)
+    short = mined_blockchain(make_wallet, make_blockchain, 2, 1)
+    longer = mined_blockchain(make_wallet, make_blockchain, 3, 3)
+    longest = mined_blockchain(make_wallet, make_blockchain, 4, 4)
+    network.peers.update({'short:1': chain_peer(short),
+                          'longer:1': chain_peer(longer),
+                          'longest:1': chain_peer(longest)})
+    for node in network.peers:
+        local.add_peer_node(node)
+    assert local.resolve()
+    assert hashes(local.chain) == hashes(longest.chain)
+    assert ('GET', '/chain') not in network.paths('short:1')
+    assert ('GET', '/chain') not in network.paths('longer:1')
+    assert not local.resolve()
+
+
+def test_invalid_chain_falls_back_to_the_next_peer(make_wallet,
+                                                   make_blockchain,
+                                                   network):
+    local = mined_blockchain(make_wallet, make_blockchain, 1, 1)
+    valid = mined_blockchain(make_wallet, make_blockchain, 2, 3)
+    # A peer which claims a longer chain than it has and an older peer
+    # without /chain/tip.
+    network.peers.update({'liar:1': chain_peer(local, length=10),
+                          'old:1': chain_peer(valid, tip=False,
+                                              sync=False)})
+    local.add_peer_node('liar:1')
+    local.add_peer_node('old:1')
+    # An unreachable peer is skipped.
+    local.add_peer_node('gone:1')
+    assert local.resolve()
+    assert hashes(local.chain) == hashes(valid.chain)
+    assert ('GET', '/blocks?start=2&stop=10') in network.paths('liar:1')
+    assert ('GET', '/chain') in network.paths('old:1')
+    assert not local.resolve_conflicts
+
+
+def blocks_requests(network, node):
+    return [path for method, path in network.paths(node)
+            if path.startswith('/blocks')]
+
+
+def test_extending_chain_downloads_only_the_missing_blocks(
+        make_wallet, make_blockchain, network, monkeypatch):
+    monkeypatch.setattr(blockChain, 'SYNC_PAGE_SIZE', 2)
+    local = mined_blockchain(make_wallet, make_blockchain, 1, 0)
+    peer = mined_blockchain(make_wallet, make_blockchain, 2, 2)
+    assert local.adopt_blocks(0, list(peer.chain)[1:])
+    for _ in range(3):
+        peer.mine_block(broadcast=False)
+    network.peers['peer:1'] = chain_peer(peer)
+    local.add_peer_node('peer:1')
+    assert local.resolve()
+    assert hashes(local.chain) == hashes(peer.chain)
+    # A single header finds the local tip in the peer's chain.
+    assert [path for method, path in network.paths('peer:1')
+            if path.startswith('/headers')] == ['/headers?start=2&stop=3']
+    assert blocks_requests(network, 'peer:1') == \
+        ['/blocks?start=3&stop=5', '/blocks?start=5&stop=6']
+
+
+def test_fork_is_replaced_after_the_common_ancestor(make_wallet,
+                                                    make_blockchain,
+                                                    network):
+    local = mined_blockchain(make_wallet, make_blockchain, 1, 1)
+    peer = mined_blockchain(make_wallet, make_blockchain, 2, 0)
+    assert peer.adopt_blocks(0, list(local.chain)[1:])
+    local.mine_block(broadcast=False)
+    for _ in range(3):
+        peer.mine_block(broadcast=False)
+    network.peers['peer:1'] = chain_peer(peer)
+    local.add_peer_node('peer:1')
+    assert local.resolve()
+    assert hashes(local.chain) == hashes(peer.chain)
+    assert blocks_requests(network, 'peer:1') == ['/blocks?start=2&stop=5']
+    assert local.get_balance() == 10
+    assert local.verify_chain(full=True)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from utility.rwlock import ReadWriteLock
+
+
+def start(lock_method, events, name):
+    """Take a lock on a thread and record when it got in."""
+    def run():
+        with lock_method():
+            events.append(name)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    events = list()
+    with lock.read_lock():
+        start(lock.read_lock, events, 'read').join(5)
+        assert events == ['read']
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    events = list()
+    with lock.write_lock():
+        reader = start(lock.read_lock, events, 'read')
+        time.sleep(0.1)
+        assert events == []
+        events.append('written')
+    reader.join(5)
+    assert events == ['written', 'read']
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    events = list()
+    with lock.read_lock():
+        writer = start(lock.write_lock, events, 'write')
+        time.sleep(0.1)
+        reader = start(lock.read_lock, events, 'read')
+        time.sleep(0.1)
+        # Neither the writer nor the later reader got in yet.
+        assert events == []
+    writer.join(5)
+    reader.join(5)
+    assert events == ['write', 'read']
+
+
+def test_writer_may_reenter_and_read():
+    lock = ReadWriteLock()
+    events = list()
+    with lock.write_lock():
+        with lock.write_lock():
+            with lock.read_lock():
+                events.append('nested')
+    # The lock is free again.
+    start(lock.write_lock, events, 'write').join(5)
+    assert events == ['nested', 'write']
@@ -0,0 +1,319 @@
+import json
+import os
+import struct
+
+import pytest
+
+import storage as storage_module
+from block import Block
+from storage import INDEX_ENTRY, BlockStorage, ChainView, StoredChain
+from transaction import Transaction
+from utility.hash_utils import hash_block
+
+
+def make_chain(length):
+    blocks = [Block(0, '', [], 100, 0)]
+    for index in range(1, length):
+        transactions = [
+            Transaction('aa' * 8, 'bb' * 8, 'cc' * 8, index),
+            Transaction('MINING', 'dd{}'.format(index) * 8, '', 10)]
+        blocks.append(Block(index, hash_block(blocks[-1]), transactions, index,
+                            float(index)))
+    return blocks
+
+
+def hashes(blocks):
+    return [hash_block(block) for block in blocks]
+
+
+def load_blocks(node_id=1):
+    storage = BlockStorage(node_id)
+    storage.open()
+    try:
+        return list(StoredChain(storage))
+    finally:
+        storage.close()
+
+
+def test_appended_blocks_are_read_back():
+    blocks = make_chain(5)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks[:2])
+    storage.append_blocks(blocks[2:])
+    assert storage.height == 5
+    loaded = load_blocks()
+    assert hashes(loaded) == hashes(blocks)
+
+
+def test_torn_log_tail_is_dropped():
+    blocks = make_chain(3)
+    BlockStorage(1).append_blocks(blocks)
+    size = os.path.getsize('blockchain-1.log')
+    with open('blockchain-1.log', 'ab') as file:
+        # A record header promising more bytes than were written.
+        file.write(b'\x00\x00\x01\x00\x12\x34\x56\x78partial')
+    storage = BlockStorage(1)
+    assert storage.open() == 3
+    assert hashes(StoredChain(storage)) == hashes(blocks)
+    storage.close()
+    assert os.path.getsize('blockchain-1.log') == size
+
+
+def test_corrupted_record_ends_the_log():
+    blocks = make_chain(3)
+    BlockStorage(1).append_blocks(blocks)
+    with open('blockchain-1.log', 'r+b') as file:
+        file.truncate(os.path.getsize('blockchain-1.log') - 5)
+    storage = BlockStorage(1)
+    storage.open()
+    # The torn last record is dropped from the index, too.
+    assert hashes(StoredChain(storage)) == hashes(blocks[:2])
+    assert os.path.getsize('blockchain-1.idx') == 2 * INDEX_ENTRY.size
+    # New blocks are appended after the last intact record.
+    storage.append_blocks(blocks[2:])
+    storage.close()
+    assert hashes(load_blocks()) == hashes(blocks)
+
+
+def test_missing_index_entries_are_rebuilt():
+    blocks = make_chain(4)
+    BlockStorage(1).append_blocks(blocks)
+    with open('blockchain-1.idx', 'r+b') as file:
+        file.truncate(INDEX_ENTRY.size)
+    assert hashes(load_blocks()) == hashes(blocks)
+    assert os.path.getsize('blockchain-1.idx') == 4 * INDEX_ENTRY.size
+    os.remove('blockchain-1.idx')
+    assert hashes(load_blocks()) == hashes(blocks)
+
+
+def test_stored_chain_reads_and_saves_blocks():
+    blocks = make_chain(5)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks[:3])
+    storage.open()
+    chain = StoredChain(storage)
+    assert len(chain) == 3
+    assert hash_block(chain[-1]) == hash_block(blocks[2])
+    # Decoded blocks are served from the cache.
+    assert chain[1] is chain[1]
+    for block in blocks[3:]:
+        chain.append(block)
+    assert len(chain) == 5
+    assert hashes(chain[3:]) == hashes(blocks[3:])
+    chain.save()
+    assert chain.pending == []
+    storage.close()
+    assert hashes(load_blocks()) == hashes(blocks)
+
+
+def test_rewrite_replaces_the_log():
+    storage = BlockStorage(1)
+    storage.append_blocks(make_chain(4))
+    fork = make_chain(2)
+    storage.rewrite_blocks(fork)
+    assert storage.height == 2
+    assert hashes(load_blocks()) == hashes(fork)
+
+
+def test_open_transactions_and_peers_round_trip():
+    storage = BlockStorage(1)
+    tx = Transaction('aa', 'bb', 'cc', 2.5)
+    storage.save_open_transactions([tx])
+    storage.save_peer_nodes({'localhost:5001', 'localhost:5002'})
+    assert [t.to_dict() for t in storage.load_open_transactions()] == \
+        [tx.to_dict()]
+    assert storage.load_peer_nodes() == {'localhost:5001', 'localhost:5002'}
+
+
+def test_legacy_chain_file_is_read():
+    blocks = make_chain(2)
+    tx = Transaction('aa', 'bb', 'cc', 1)
+    with open('blockchain-1.txt', 'w') as file:
+        file.write(json.dumps([block.to_dict() for block in blocks]))
+        file.write('\n')
+        file.write(json.dumps([tx.to_dict()]))
+        file.write('\n')
+        file.write(json.dumps(['localhost:5001']))
+    loaded, open_transactions, peer_nodes = BlockStorage(1).load_legacy()
+    assert hashes(loaded) == hashes(blocks)
+    assert open_transactions[0].to_dict() == tx.to_dict()
+    assert peer_nodes == {'localhost:5001'}
+    assert BlockStorage(2).load_legacy() is None
+
+
+def test_json_records_of_older_versions_are_read():
+    blocks = make_chain(3)
+    with open('blockchain-1.log', 'wb') as file:
+        for block in blocks[:2]:
+            file.write(BlockStorage.encode_record(
+                json.dumps(block.to_dict()).encode()))
+    # Binary records are appended after the JSON ones.
+    storage = BlockStorage(1)
+    storage.open()
+    storage.append_blocks(blocks[2:])
+    storage.close()
+    assert hashes(load_blocks()) == hashes(blocks)
+    assert os.path.getsize('blockchain-1.addr') > 0
+
+
+def test_chain_view_reads_without_copying():
+    blocks = make_chain(4)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    storage.open()
+    chain = StoredChain(storage)
+    view = ChainView(chain)
+    assert len(view) == 4
+    assert view.height == 3
+    assert view.tip is chain[-1]
+    assert view.block(1) is chain[1]
+    assert hashes(view.slice(1, 3)) == hashes(blocks[1:3])
+    assert hashes(view) == hashes(blocks)
+    assert not hasattr(view, 'append')
+    storage.close()
+
+
+def test_truncated_blocks_are_replaced_on_save():
+    blocks = make_chain(5)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    storage.open()
+    chain = StoredChain(storage)
+    fork = Block(2, hash_block(blocks[1]), [], 99, 2.5)
+    chain.truncate(2)
+    assert len(chain) == 2
+    # The log is only cut on the next save.
+    assert storage.height == 5
+    chain.append(fork)
+    chain.save()
+    storage.close()
+    assert hashes(load_blocks()) == hashes(blocks[:2] + [fork])
+    assert os.path.getsize('blockchain-1.idx') == 3 * INDEX_ENTRY.size
+
+
+def test_truncate_drops_pending_blocks():
+    blocks = make_chain(4)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks[:2])
+    storage.open()
+    chain = StoredChain(storage)
+    chain.append(blocks[2])
+    chain.append(blocks[3])
+    chain.truncate(3)
+    chain.save()
+    storage.close()
+    assert hashes(load_blocks()) == hashes(blocks[:3])
+
+
+def test_failed_address_write_is_rolled_back(monkeypatch):
+    blocks = make_chain(3)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks[:2])
+    known = len(storage.addresses)
+    size = os.path.getsize('blockchain-1.addr')
+    fsync = os.fsync
+
+    def fail(fd):
+        raise OSError('disk full')
+    monkeypatch.setattr(storage_module.os, 'fsync', fail)
+    with pytest.raises(OSError):
+        storage.append_blocks(blocks[2:])
+    assert len(storage.addresses) == known
+    assert os.path.getsize('blockchain-1.addr') == size
+    monkeypatch.setattr(storage_module.os, 'fsync', fsync)
+    # The next save writes the new addresses again.
+    storage.append_blocks(blocks[2:])
+    assert hashes(load_blocks()) == hashes(blocks)
+
+
+def make_block_of_known_addresses(blocks):
+    """Return a block following blocks[1] of make_chain() whose addresses
+    are all stored already, so only the log is synced on append."""
+    transactions = [Transaction('aa' * 8, 'bb' * 8, 'cc' * 8, 2),
+                    Transaction('MINING', 'dd1' * 8, '', 10)]
+    return Block(2, hash_block(blocks[1]), transactions, 2, 2.0)
+
+
+def test_failed_log_write_is_rolled_back(monkeypatch):
+    blocks = make_chain(2)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    log_size = os.path.getsize('blockchain-1.log')
+    index_size = os.path.getsize('blockchain-1.idx')
+    block = make_block_of_known_addresses(blocks)
+    fsync = os.fsync
+
+    def fail(fd):
+        raise OSError('disk full')
+    monkeypatch.setattr(storage_module.os, 'fsync', fail)
+    with pytest.raises(OSError):
+        storage.append_blocks([block])
+    monkeypatch.setattr(storage_module.os, 'fsync', fsync)
+    assert os.path.getsize('blockchain-1.log') == log_size
+    assert os.path.getsize('blockchain-1.idx') == index_size
+    assert storage.height == 2
+    # A retry appends the block once.
+    storage.append_blocks([block])
+    assert hashes(load_blocks()) == hashes(blocks + [block])
+
+
+def test_failed_index_write_rolls_back_the_log(monkeypatch):
+    blocks = make_chain(2)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    log_size = os.path.getsize('blockchain-1.log')
+    index_size = os.path.getsize('blockchain-1.idx')
+
+    class FailingEntry(struct.Struct):
+        def pack(self, *values):
+            raise OSError('disk full')
+    monkeypatch.setattr(storage_module, 'INDEX_ENTRY',
+                        FailingEntry(INDEX_ENTRY.format))
+    with pytest.raises(OSError):
+        storage.append_blocks([make_block_of_known_addresses(blocks)])
+    assert os.path.getsize('blockchain-1.log') == log_size
+    assert os.path.getsize('blockchain-1.idx') == index_size
+    assert storage.height == 2
+
+
+def test_block_read_before_a_truncation_is_not_cached(monkeypatch):
+    blocks = make_chain(4)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    storage.open()
+    chain = StoredChain(storage)
+    fork = Block(2, hash_block(blocks[1]), [], 99, 2.5)
+    read_block = storage.read_block
+
+    def racing_read_block(height):
+        # The chain is reorganized while a reader decodes the old block.
+        block = read_block(height)
+        monkeypatch.setattr(storage, 'read_block', read_block)
+        chain.truncate(2)
+        chain.append(fork)
+        chain.save()
+        return block
+    monkeypatch.setattr(storage, 'read_block', racing_read_block)
+    assert hash_block(chain[2]) == hash_block(blocks[2])
+    assert hash_block(chain[2]) == hash_block(fork)
+    storage.close()
+
+
+def test_truncated_block_is_read_from_the_current_chain(monkeypatch):
+    blocks = make_chain(4)
+    storage = BlockStorage(1)
+    storage.append_blocks(blocks)
+    storage.open()
+    chain = StoredChain(storage)
+    read_block = storage.read_block
+
+    def racing_read_block(height):
+        monkeypatch.setattr(storage, 'read_block', read_block)
+        chain.truncate(2)
+        chain.save()
+        return read_block(height)
+    monkeypatch.setattr(storage, 'read_block', racing_read_block)
+    # The tip was truncated before it was read.
+    assert hash_block(chain[-1]) == hash_block(blocks[1])
+    assert storage.read_block(3) is None
+    storage.close()
@@ -0,0 +1,179 @@
+import pytest
+
+from block import Block
+from transaction import Transaction
+from utility import verification
+from utility.hash_utils import hash_block, hash_transaction, merkle_root
+from utility.verification import ChainVerifier, Verification
+from wallet import Wallet
+
+
+def test_mined_chain_is_valid(make_wallet, make_blockchain, send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    assert send(blockchain, wallet, 'bob', 3)
+    block = blockchain.mine_block()
+    assert block.merkle_root == merkle_root(block.transactions)
+    assert Verification.valid_block_proof(block)
+    assert Verification.verify_chain(blockchain.chain)
+
+
+def test_changed_transaction_breaks_the_merkle_root(make_wallet,
+                                                    make_blockchain, send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    blockchain.mine_block()
+    assert send(blockchain, wallet, 'bob', 3)
+    block = blockchain.mine_block()
+    block.transactions[0] = Transaction(wallet.public_key, 'bob',
+                                        block.transactions[0].signature, 9)
+    assert not Verification.valid_block_proof(block)
+
+
+def test_blocks_without_merkle_root_keep_the_old_proof():
+    genesis = Block(0, '', [], 100, 0)
+    transactions = [Transaction('ab' * 8, 'cd' * 8, 'ef' * 8, 1)]
+    proof = 0
+    while not Verification.valid_proof(transactions, hash_block(genesis),
+                                       proof):
+        proof += 1
+    reward = Transaction('MINING', 'ab' * 8, '', 10)
+    block = Block(1, hash_block(genesis), transactions + [reward], proof, 1)
+    assert block.merkle_root is None
+    assert Verification.verify_chain([genesis, block])
+
+
+@pytest.fixture
+def verify_pool(monkeypatch):
+    """Verify every batch in a small process pool, which is shut down after
+    the test."""
+    monkeypatch.setattr(verification, 'PARALLEL_VERIFY_THRESHOLD', 0)
+    monkeypatch.setattr(verification, 'VERIFY_CHUNK_SIZE', 2)
+    monkeypatch.setattr(verification, 'VERIFY_WORKERS', 2)
+    monkeypatch.setattr(verification, '_pool', None)
+    yield
+    if verification._pool is not None:
+        verification._pool.shutdown()
+
+
+def test_batch_verification_in_worker_processes(make_wallet, verify_pool):
+    wallet = make_wallet(1)
+    transactions = [
+        Transaction(wallet.public_key, 'bob',
+                    wallet.sign_transaction(wallet.public_key, 'bob', amount),
+                    amount)
+        for amount in range(1, 6)]
+    # A copied signature of another amount and a malformed signature.
+    transactions[2] = Transaction(wallet.public_key, 'bob',
+                                  transactions[1].signature, 3)
+    transactions[4] = Transaction(wallet.public_key, 'bob', 'xyz', 5)
+    assert Verification.verify_signatures(transactions) == \
+        [True, True, False, True, False]
+    assert Wallet.verification_cache.get(
+        hash_transaction(transactions[2])) is False
+    assert not Verification.all_signatures_valid(transactions)
+    assert Verification.all_signatures_valid(transactions[:2])
+
+
+def test_verify_pool_spawns_its_workers(verify_pool):
+    # Forked workers could inherit a lock held by another server thread.
+    pool = verification.get_verify_pool()
+    assert pool._mp_context.get_start_method() == 'spawn'
+
+
+def test_chain_verifier_checks_only_new_blocks(make_wallet, make_blockchain,
+                                               monkeypatch):
+    blockchain = make_blockchain(make_wallet(1).public_key, 1)
+    for _ in range(3):
+        blockchain.mine_block()
+    checked = list()
+    verify_block = Verification.verify_block
+
+    def counting_verify_block(block, previous_block):
+        checked.append(block.index)
+        return verify_block(block, previous_block)
+    monkeypatch.setattr(Verification, 'verify_block', counting_verify_block)
+
+    verifier = ChainVerifier()
+    chain = list(blockchain.chain)
+    assert verifier.verify(chain)
+    assert checked == [1, 2, 3]
+    del checked[:]
+    assert verifier.verify(chain)
+    assert checked == []
+    blockchain.mine_block()
+    assert verifier.verify(blockchain.chain)
+    assert checked == [4]
+    del checked[:]
+    assert verifier.verify(blockchain.chain, full=True)
+    assert checked == [1, 2, 3, 4]
+
+
+def test_chain_verifier_verifies_a_replaced_chain_again(make_wallet,
+                                                        make_blockchain):
+    blockchain = make_blockchain(make_wallet(1).public_key, 1)
+    other = make_blockchain(make_wallet(2).public_key, 2)
+    for _ in range(2):
+        blockchain.mine_block()
+    for _ in range(3):
+        other.mine_block()
+    verifier = ChainVerifier()
+    assert verifier.verify(blockchain.chain)
+    assert verifier.verify(other.chain)
+    assert verifier.verified_height == 4
+    # A block of the replaced chain which does not link to its predecessor.
+    forged = list(other.chain)
+    forged[2] = blockchain.chain[2]
+    verifier.reset()
+    assert not verifier.verify(forged)
+
+
+def test_rewind_keeps_the_verified_prefix(make_wallet, make_blockchain,
+                                          monkeypatch):
+    blockchain = make_blockchain(make_wallet(1).public_key, 1)
+    fork = make_blockchain(make_wallet(2).public_key, 2)
+    for _ in range(3):
+        blockchain.mine_block(broadcast=False)
+    verifier = ChainVerifier()
+    chain = list(blockchain.chain)
+    assert verifier.verify(chain)
+    # A fork of the first block replaces the blocks from height 2 on.
+    assert fork.adopt_blocks(0, chain[1:2])
+    fork.mine_block(broadcast=False)
+    fork.mine_block(broadcast=False)
+    checked = list()
+    verify_block = Verification.verify_block
+
+    def counting_verify_block(block, previous_block):
+        checked.append(block.index)
+        return verify_block(block, previous_block)
+    monkeypatch.setattr(Verification, 'verify_block', counting_verify_block)
+    verifier.rewind(chain, 2)
+    assert verifier.verified_height == 2
+    assert verifier.verify(list(fork.chain))
+    assert checked == [2, 3]
+    verifier.rewind(chain, 0)
+    assert verifier.verified_height == 1
+
+
+def test_block_repeating_transactions_is_rejected(make_wallet,
+                                                  make_blockchain, send):
+    wallet = make_wallet(1)
+    blockchain = make_blockchain(wallet.public_key, 1)
+    peer = make_blockchain(make_wallet(2).public_key, 2)
+    assert peer.add_block(blockchain.mine_block(broadcast=False))
+    for recipient in ('a', 'b', 'c', 'd', 'e'):
+        assert send(blockchain, wallet, recipient, 1)
+    block = blockchain.mine_block(broadcast=False)
+    transactions = block.transactions
+    # Repeating the last two transactions keeps the Merkle root.
+    repeated = Block(block.index, block.previous_hash,
+                     transactions + transactions[-2:], block.proof,
+                     block.timestamp, block.merkle_root)
+    assert merkle_root(repeated.transactions) == block.merkle_root
+    assert repeated.hash() == block.hash()
+    assert not Verification.valid_block_proof(repeated)
+    assert not peer.add_block(repeated)
+    assert peer.add_block(block)
+    assert peer.get_balance('e') == 1
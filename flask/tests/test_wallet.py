@@ -0,0 +1,80 @@
+import pytest
+
+from transaction import Transaction
+from utility.cache import LRUCache
+from wallet import Wallet
+
+
+def signed_transaction(wallet, recipient, amount):
+    return Transaction(wallet.public_key, recipient,
+                       wallet.sign_transaction(wallet.public_key, recipient,
+                                               amount), amount)
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 2,
+                             'misses': 1}
+
+
+def test_verification_result_is_cached(make_wallet, monkeypatch):
+    wallet = make_wallet(1)
+    tx = signed_transaction(wallet, 'bob', 5)
+    assert Wallet.verify_transaction(tx)
+
+    def verify_signature(transaction):
+        raise AssertionError('signature verified again')
+    monkeypatch.setattr(Wallet, 'verify_signature', verify_signature)
+    assert Wallet.verify_transaction(
+        Transaction(tx.sender, tx.recipient, tx.signature, tx.amount))
+    # A changed amount is a different cache entry.
+    with pytest.raises(AssertionError):
+        Wallet.verify_transaction(
+            Transaction(tx.sender, tx.recipient, tx.signature, 6))
+
+
+def test_invalid_signature_is_rejected(make_wallet):
+    wallet = make_wallet(1)
+    tx = signed_transaction(wallet, 'bob', 5)
+    assert not Wallet.verify_transaction(
+        Transaction(tx.sender, 'carol', tx.signature, tx.amount))
+
+
+def test_public_key_is_parsed_once(make_wallet):
+    wallet = make_wallet(1)
+    public_key = Wallet.get_public_key(wallet.public_key)
+    hits = Wallet.public_key_cache.hits
+    assert Wallet.get_public_key(wallet.public_key) is public_key
+    assert Wallet.public_key_cache.hits == hits + 1
+
+
+def test_ed25519_signatures(make_wallet):
+    wallet = make_wallet(1, 'ed25519')
+    assert wallet.public_key.startswith('ed25519:')
+    tx = signed_transaction(wallet, 'bob', 2.5)
+    assert tx.signature.startswith('ed25519:')
+    assert Wallet.verify_signature(tx)
+    assert not Wallet.verify_signature(
+        Transaction(tx.sender, tx.recipient, tx.signature, 3))
+
+
+def test_signature_of_another_key_type_is_rejected(make_wallet):
+    ed25519 = make_wallet(1, 'ed25519')
+    rsa = make_wallet(2)
+    tx = signed_transaction(rsa, 'bob', 1)
+    assert not Wallet.verify_signature(
+        Transaction(ed25519.public_key, 'bob', tx.signature, 1))
+    tx = signed_transaction(ed25519, 'bob', 1)
+    assert not Wallet.verify_signature(
+        Transaction(rsa.public_key, 'bob', tx.signature, 1))
+
+
+def test_unknown_key_type_is_rejected():
+    with pytest.raises(ValueError):
+        Wallet(1).create_keys('dsa')
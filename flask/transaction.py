@@ -1,10 +1,28 @@
 from collections import OrderedDict
+import math
+from utility.hash_utils import hash_transaction
 from utility.printable import Printable
 
+# The largest integer which can be stored (as a signed 64-bit integer).
+MAX_INT = 2 ** 63 - 1
+
+
+def valid_number(value, minimum=-MAX_INT - 1):
+    """Return whether a value is an int (but not a bool) or a finite float
+    which can be stored and is not less than minimum."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    if isinstance(value, float) and not math.isfinite(value):
+        return False
+    return minimum <= value <= MAX_INT
+
 
 class Transaction(Printable):
     """A transaction which can be added to a block in the blockchain.
 
+    Transactions are not changed after they were created, so their id is
+    computed once.
+
     Arguments:
         :sender: The sender of coins.
         :recipient: The recipient of coins.
@@ -17,9 +35,48 @@ class Transaction(Printable):
         self.recipient = recipient
         self.amount = amount
         self.signature = signature
+        self.__tx_id = None
+
+    def tx_id(self):
+        """Return the canonical id of this transaction, the SHA256 hash of
+        its content including the signature."""
+        if self.__tx_id is None:
+            self.__tx_id = hash_transaction(self)
+        return self.__tx_id
+
+    def has_valid_fields(self):
+        """Return whether the keys and the signature are strings and the
+        amount is a non-negative number which can be stored."""
+        return (isinstance(self.sender, str) and
+                isinstance(self.recipient, str) and
+                isinstance(self.signature, str) and
+                valid_number(self.amount, 0))
 
     def to_ordered_dict(self):
         """Convert this transaction into (hashable) ordered dict."""
         return OrderedDict([('sender', self.sender),
                             ('recipient', self.recipient),
                             ('amount', self.amount)])
+
+    def to_dict(self):
+        """Convert this transaction into a (JSON serializable) dict."""
+        return {'sender': self.sender,
+                'recipient': self.recipient,
+                'amount': self.amount,
+                'signature': self.signature}
+
+    @classmethod
+    def from_dict(cls, tx):
+        """Create a transaction from its dict representation.
+
+        Raises ValueError if the fields have invalid types or ranges (see
+        has_valid_fields()).
+
+        Arguments:
+            :tx: The dict (e.g. loaded from JSON) describing the transaction.
+        """
+        transaction = cls(tx['sender'], tx['recipient'], tx['signature'],
+                          tx['amount'])
+        if not transaction.has_valid_fields():
+            raise ValueError('Invalid transaction fields')
+        return transaction
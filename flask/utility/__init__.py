@@ -1,3 +1,4 @@
 from utility.hash_utils import hash_string_256
+from utility.cache import LRUCache
 
-__all__ = ['hash_string_256']
+__all__ = ['hash_string_256', 'LRUCache']
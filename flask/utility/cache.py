@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """A bounded, thread-safe mapping which evicts the least recently used
+    entry.
+
+    Attributes:
+        :maxsize: The maximum number of entries kept in the cache.
+        :hits: The number of lookups which found an entry.
+        :misses: The number of lookups which found nothing.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key, default=None):
+        """Return the cached value of a key and mark it as recently used.
+
+        Arguments:
+            :key: The key which should be looked up.
+            :default: The value returned if the key is not cached.
+        """
+        with self.__lock:
+            try:
+                value = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entry if full.
+
+        Arguments:
+            :key: The key of the value.
+            :value: The value which should be cached.
+        """
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """Return the size and the hit/miss counters as a dict."""
+        return {
+            'size': len(self.__entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -11,15 +11,94 @@ def hash_string_256(string):
     return hashlib.sha256(string).hexdigest()
 
 
+class PrefixHasher:
+    """Hashes many strings sharing a common prefix with SHA256.
+
+    The prefix is fed into the hash state once; every hash of a suffix then
+    only copies the state and hashes the suffix.
+
+    Arguments:
+        :prefix: The bytes all hashed strings start with.
+    """
+
+    def __init__(self, prefix):
+        self.__state = hashlib.sha256(prefix)
+
+    def hexdigest(self, suffix):
+        """Return the SHA256 hash of prefix + suffix.
+
+        Arguments:
+            :suffix: The bytes which follow the prefix.
+        """
+        state = self.__state.copy()
+        state.update(suffix)
+        return state.hexdigest()
+
+
+def hash_transaction(transaction):
+    """Hash a transaction (including its signature).
+
+    Arguments:
+        :transaction: The transaction that should be hashed.
+    """
+    return hash_string_256(
+        json.dumps(transaction.to_dict(), sort_keys=True).encode())
+
+
+def merkle_root(transactions):
+    """Return the Merkle root over the hashes of a list of transactions.
+
+    Odd levels are padded with their last hash, so a list which repeats its
+    last transactions can have the same root; blocks must not contain a
+    transaction twice (see Verification.valid_block_proof()).
+
+    Arguments:
+        :transactions: The transactions of a block.
+    """
+    level = [hash_transaction(tx) for tx in transactions]
+    if not level:
+        return hash_string_256(b'')
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [hash_string_256((level[i] + level[i + 1]).encode())
+                 for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def block_header(index, previous_hash, merkle_root, timestamp):
+    """Return the fixed-size header of a block (without the proof) which the
+    proof of work and the hash of the block are computed over.
+
+    Arguments:
+        :index: The index of the block.
+        :previous_hash: The hash of the previous block.
+        :merkle_root: The Merkle root over the block's transactions.
+        :timestamp: The timestamp of the block.
+    """
+    return json.dumps([index, previous_hash, merkle_root, timestamp]).encode()
+
+
 def hash_block(block):
     """Hashing a block and returns a string reprensentation of it.
 
+    Blocks with a Merkle root are hashed over their header and proof, older
+    blocks over all of their content.
+
     Arguments:
         :block: The block that should be hashed.
     """
-    hashable_block = block.__dict__.copy()
-    hashable_block['transactions'] = [tx.to_ordered_dict()
-                                      for tx in hashable_block['transactions']]
+    if block.merkle_root is not None:
+        return hash_string_256(
+            block_header(block.index, block.previous_hash, block.merkle_root,
+                         block.timestamp) + str(block.proof).encode())
+    hashable_block = {
+        'index': block.index,
+        'previous_hash': block.previous_hash,
+        'timestamp': block.timestamp,
+        'transactions': [tx.to_ordered_dict() for tx in block.transactions],
+        'proof': block.proof
+    }
     # Converting the "block" (which is dictionary) to 'string' and then
     # encoding it to UTF-8.
     return hash_string_256(json.dumps(hashable_block, sort_keys=True).encode())
@@ -2,4 +2,6 @@ class Printable:
     """A base class which implements printing functionality."""
 
     def __repr__(self):
-        return str(self.__dict__)
+        # Private (e.g. memoized) attributes are left out.
+        return str({key: value for key, value in self.__dict__.items()
+                    if not key.startswith('_')})
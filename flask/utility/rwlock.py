@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    """A lock which is shared by readers and exclusive for writers.
+
+    Waiting writers block new readers, so writes are not starved by a steady
+    stream of reads. The thread holding the write lock may re-enter it and
+    may also take the read lock (e.g. to read a balance while admitting a
+    transaction).
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = 0
+        self.__writer = None
+        self.__write_depth = 0
+        self.__waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        """Hold the lock shared with other readers."""
+        with self.__condition:
+            if self.__writer == threading.get_ident():
+                reentered = True
+            else:
+                reentered = False
+                while self.__writer is not None or self.__waiting_writers:
+                    self.__condition.wait()
+                self.__readers += 1
+        try:
+            yield
+        finally:
+            if not reentered:
+                with self.__condition:
+                    self.__readers -= 1
+                    if self.__readers == 0:
+                        self.__condition.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        """Hold the lock exclusively."""
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__writer != me:
+                self.__waiting_writers += 1
+                try:
+                    while self.__writer is not None or self.__readers:
+                        self.__condition.wait()
+                finally:
+                    self.__waiting_writers -= 1
+                self.__writer = me
+            self.__write_depth += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__write_depth -= 1
+                if self.__write_depth == 0:
+                    self.__writer = None
+                    self.__condition.notify_all()
@@ -1,13 +1,64 @@
 """Privides verification helper function."""
 
-from utility.hash_utils import hash_block, hash_string_256
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import os
+import threading
+
+from utility.hash_utils import hash_string_256, hash_transaction, merkle_root
 from wallet import Wallet
 
+# The number of processes verifying signatures (None: number of cores).
+VERIFY_WORKERS = None
+# Batches with fewer signatures than this are verified in-process.
+PARALLEL_VERIFY_THRESHOLD = 64
+# The number of signatures a worker verifies per task.
+VERIFY_CHUNK_SIZE = 256
+# Worker processes (of the verification pool and the proof of work search)
+# are spawned, not forked: a fork of the multi-threaded server could copy a
+# lock (e.g. of the verification cache) held by another thread and deadlock.
+MP_CONTEXT = multiprocessing.get_context('spawn')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_verify_pool():
+    """Return the (lazily started) process pool verifying signatures."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(VERIFY_WORKERS or os.cpu_count(),
+                                        mp_context=MP_CONTEXT)
+        return _pool
+
+
+def verify_signature_chunk(transactions):
+    """Verify the signatures of a chunk of transactions (in a worker)."""
+    return [Wallet.verify_signature(tx) for tx in transactions]
+
 
 class Verification:
 
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
+    def proof_prefix(transactions, last_hash):
+        """Return the part of a proof of work guess which precedes the proof.
+
+        Arguments:
+            transactions: Transaction of the block for which the proof is \
+            created.
+            last_hash: The stored previous_hash.
+        """
+        return (str([tx.to_ordered_dict() for tx in transactions]) +
+                str(last_hash)).encode()
+
+    @staticmethod
+    def valid_hash(guess_hash):
+        """Define the conditions for a new valid hash."""
+        return guess_hash[0:2] == "00"
+
+    @classmethod
+    def valid_proof(cls, transactions, last_hash, proof):
         """Validate a proof.
 
         Arguments:
@@ -16,28 +67,76 @@ class Verification:
             last_hash: The stored previous_hash.
             proof: The proof number we are testing.
         """
-        guess = (str([tx.to_ordered_dict() for tx in transactions]) +
-                 str(last_hash) + str(proof)).encode()
+        guess = (cls.proof_prefix(transactions, last_hash) +
+                 str(proof).encode())
         # Hash the string.
         guess_hash = hash_string_256(guess)
         # Printing all the hashes performed.
         # print(guess_hash)
-        # Define the conditions for a new valid hash.
-        return guess_hash[0:2] == "00"
+        return cls.valid_hash(guess_hash)
+
+    @classmethod
+    def valid_block_proof(cls, block):
+        """Validate the proof (and the Merkle root) of a block.
+
+        Arguments:
+            block: The block which should be validated.
+        """
+        if block.merkle_root is None:
+            # Blocks of older versions: the proof was computed before the
+            # reward transaction was added.
+            return cls.valid_proof(block.transactions[:-1],
+                                   block.previous_hash, block.proof)
+        if len(set(hash_transaction(tx) for tx in block.transactions)) != \
+                len(block.transactions):
+            print("Transaction is duplicated!!!")
+            return False
+        if block.merkle_root != merkle_root(block.transactions):
+            print("Merkle root is Invalid!!!")
+            return False
+        return cls.valid_hash(block.hash())
 
     @classmethod
-    def verify_chain(cls, blockchain):
+    def verify_block(cls, block, previous_block):
+        """Verify that a block links to its predecessor and has a valid proof.
+
+        Arguments:
+            block: The block which should be verified.
+            previous_block: The block before it in the chain.
+        """
+        if block.previous_hash != previous_block.hash():
+            return False
+        if not cls.valid_block_proof(block):
+            print("Proof of work is Invalid!!!")
+            return False
+        return True
+
+    @classmethod
+    def verify_chain(cls, blockchain, check_signatures=False, start=1):
         """Verify the current blockchain and return True if it's valid, False
-        otherwise"""
-        for index, block in enumerate(blockchain):
-            if index == 0:
-                continue
-            if block.previous_hash != hash_block(blockchain[index - 1]):
-                return False
-            if not cls.valid_proof(block.transactions[:-1],
-                                   block.previous_hash, block.proof):
-                print("Proof of work is Invalid!!!")
+        otherwise
+
+        Arguments:
+            blockchain: The blocks of the chain.
+            check_signatures: Whether the signatures of all transactions
+            (except the mining rewards) are verified, e.g. for chains of
+            other nodes.
+            start: The index of the first block which is verified.
+        """
+        signed = list()
+        start = max(start, 1)
+        previous_block = blockchain[start - 1] if start < len(blockchain) \
+            else None
+        for index in range(start, len(blockchain)):
+            block = blockchain[index]
+            if not cls.verify_block(block, previous_block):
                 return False
+            # The last transaction of a block is the mining reward.
+            signed.extend(block.transactions[:-1])
+            previous_block = block
+        if check_signatures and not cls.all_signatures_valid(signed):
+            print("Signature is Invalid!!!")
+            return False
         return True
 
     @staticmethod
@@ -59,5 +158,114 @@ class Verification:
     @classmethod
     def verify_transactions(cls, open_transactions, get_balance):
         """Verifies all the transactions."""
-        return all([cls.verify_transaction(tx, get_balance, False)
-                    for tx in open_transactions])
+        return cls.all_signatures_valid(open_transactions)
+
+    @staticmethod
+    def verify_signatures(transactions, fail_fast=False):
+        """Verify the signatures of a batch of transactions.
+
+        Signatures which are not in the verification cache are spread across
+        a process pool in chunks. Returns a list with the result of every
+        transaction; with fail_fast, the remaining chunks are cancelled after
+        the first invalid signature and their results are None.
+
+        Arguments:
+            transactions: The transactions which should be verified.
+            fail_fast: Whether to stop at the first invalid signature.
+        """
+        keys = [hash_transaction(tx) for tx in transactions]
+        results = [Wallet.verification_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if fail_fast and False in results:
+            return results
+        if len(missing) < PARALLEL_VERIFY_THRESHOLD:
+            for i in missing:
+                results[i] = Wallet.verify_transaction(transactions[i])
+                if fail_fast and not results[i]:
+                    break
+            return results
+
+        pool = get_verify_pool()
+        chunks = [missing[i:i + VERIFY_CHUNK_SIZE]
+                  for i in range(0, len(missing), VERIFY_CHUNK_SIZE)]
+        pending = {
+            pool.submit(verify_signature_chunk,
+                        [transactions[i] for i in chunk]): chunk
+            for chunk in chunks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                for i, result in zip(chunk, future.result()):
+                    results[i] = result
+                    Wallet.verification_cache.put(keys[i], result)
+                if fail_fast and not all(future.result()):
+                    for future in pending:
+                        future.cancel()
+                    return results
+        return results
+
+    @classmethod
+    def all_signatures_valid(cls, transactions):
+        """Return whether all signatures of a batch of transactions are
+        valid, stopping at the first invalid one.
+
+        Arguments:
+            transactions: The transactions which should be verified.
+        """
+        return all(cls.verify_signatures(transactions, fail_fast=True))
+
+
+class ChainVerifier:
+    """Verifies a chain incrementally.
+
+    The verifier remembers up to which height (and tip hash) the chain was
+    already verified, so routine checks only verify the new blocks. If the
+    remembered tip is not part of the chain anymore (the chain was
+    replaced), the chain is verified from the genesis block again.
+
+    Attributes:
+        :verified_height: The number of blocks already verified.
+    """
+
+    def __init__(self):
+        self.verified_height = 1
+        self.__tip_hash = None
+
+    def reset(self):
+        """Forget the verified blocks, the next check verifies everything."""
+        self.verified_height = 1
+        self.__tip_hash = None
+
+    def rewind(self, blockchain, height):
+        """Forget the verified blocks from a height on, e.g. the blocks of a
+        fork which was abandoned at that height.
+
+        Arguments:
+            :blockchain: The blocks of the chain.
+            :height: The number of blocks which are kept.
+        """
+        if height < 1:
+            self.reset()
+        elif self.verified_height > height:
+            self.verified_height = height
+            self.__tip_hash = blockchain[height - 1].hash()
+
+    def verify(self, blockchain, full=False):
+        """Verify the blocks added since the last call.
+
+        Arguments:
+            :blockchain: The blocks of the chain.
+            :full: Whether the whole chain is verified again.
+        """
+        if full or self.verified_height > len(blockchain) or (
+                self.__tip_hash is not None and
+                blockchain[self.verified_height - 1].hash() !=
+                self.__tip_hash):
+            self.reset()
+        if not Verification.verify_chain(blockchain,
+                                         start=self.verified_height):
+            return False
+        self.verified_height = len(blockchain)
+        self.__tip_hash = blockchain[-1].hash()
+        return True
@@ -4,19 +4,49 @@ from Crypto.Hash import SHA256
 import Crypto.Random
 import binascii
 
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey, Ed25519PublicKey)
+
+from utility.cache import LRUCache
+from utility.hash_utils import hash_transaction
+
+# The number of signature verification results kept in memory.
+VERIFICATION_CACHE_SIZE = 10000
+# The number of parsed public keys kept in memory.
+PUBLIC_KEY_CACHE_SIZE = 1000
+# The supported key types. RSA keys and signatures are plain hex strings,
+# Ed25519 ones are tagged with the ED25519_PREFIX.
+KEY_TYPES = ('rsa', 'ed25519')
+ED25519_PREFIX = 'ed25519:'
+
 
 class Wallet:
     """Creates, loads and holds private and public keys. Manages transaction
-    signing and verification."""
+    signing and verification.
+
+    Attributes:
+        :verification_cache: The results of verified signatures, keyed by the
+        hash of (sender, recipient, amount, signature).
+        :public_key_cache: The parsed public keys, keyed by sender.
+    """
+
+    verification_cache = LRUCache(VERIFICATION_CACHE_SIZE)
+    public_key_cache = LRUCache(PUBLIC_KEY_CACHE_SIZE)
 
     def __init__(self, node_id):
         self.private_key = None
         self.public_key = None
         self.node_id = node_id
 
-    def create_keys(self):
-        """Create a new pair of Public and Private Key."""
-        private_key, public_key = self.generate_keys()
+    def create_keys(self, key_type='rsa'):
+        """Create a new pair of Public and Private Key.
+
+        Arguments:
+            :key_type: The type of the keys, one of KEY_TYPES.
+        """
+        private_key, public_key = self.generate_keys(key_type)
         self.private_key = private_key
         self.public_key = public_key
 
@@ -48,8 +78,27 @@ class Wallet:
             print("Loading wallet failed!!!")
             return False
 
-    def generate_keys(self):
-        """Generate a new pair of private and public key."""
+    def generate_keys(self, key_type='rsa'):
+        """Generate a new pair of private and public key.
+
+        Arguments:
+            :key_type: The type of the keys, one of KEY_TYPES.
+        """
+        if key_type == 'ed25519':
+            private_key = Ed25519PrivateKey.generate()
+            private_bytes = private_key.private_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PrivateFormat.Raw,
+                encryption_algorithm=serialization.NoEncryption())
+            public_bytes = private_key.public_key().public_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PublicFormat.Raw)
+            return (ED25519_PREFIX +
+                    binascii.hexlify(private_bytes).decode('ascii'),
+                    ED25519_PREFIX +
+                    binascii.hexlify(public_bytes).decode('ascii'))
+        if key_type != 'rsa':
+            raise ValueError('Unknown key type {}'.format(key_type))
         private_key = RSA.generate(1024, Crypto.Random.new().read)
         public_key = private_key.publickey()
         return (binascii.hexlify(private_key.exportKey(format='DER')).
@@ -65,27 +114,91 @@ class Wallet:
             :recipient: The recipient of the transaction.
             :amount: The amount of the transaction.
         """
+        message = (str(sender) + str(recipient) + str(amount)).encode('utf8')
+        if self.private_key.startswith(ED25519_PREFIX):
+            signer = Ed25519PrivateKey.from_private_bytes(binascii.unhexlify(
+                self.private_key[len(ED25519_PREFIX):]))
+            return ED25519_PREFIX + binascii.hexlify(
+                signer.sign(message)).decode('ascii')
         # Converting back to 'binary' from string (we converted above).
         signer = PKCS1_v1_5.new(RSA.importKey(
             binascii.unhexlify(self.private_key)))
         # Converting to string and enconding.
-        new_hash = SHA256.new(
-            (str(sender) + str(recipient) + str(amount)).encode('utf8'))
+        new_hash = SHA256.new(message)
         signature = signer.sign(new_hash)
         # Converting back to 'string'
         return binascii.hexlify(signature).decode('ascii')
 
+    @staticmethod
+    def get_public_key(sender):
+        """Return the parsed public key of a sender (cached).
+
+        Arguments:
+            :sender: The hex encoded public key.
+        """
+        public_key = Wallet.public_key_cache.get(sender)
+        if public_key is None:
+            if sender.startswith(ED25519_PREFIX):
+                public_key = Ed25519PublicKey.from_public_bytes(
+                    binascii.unhexlify(sender[len(ED25519_PREFIX):]))
+            else:
+                public_key = RSA.importKey(binascii.unhexlify(sender))
+            Wallet.public_key_cache.put(sender, public_key)
+        return public_key
+
     @staticmethod
     def verify_transaction(transaction):
         """Verify the signature of the transaction.
 
+        The result is cached, so verifying an already checked transaction
+        again costs one hash.
+
+        Arguments:
+            transaction: The transaction that should be verified.
+        """
+        key = hash_transaction(transaction)
+        result = Wallet.verification_cache.get(key)
+        if result is None:
+            result = Wallet.verify_signature(transaction)
+            Wallet.verification_cache.put(key, result)
+        return result
+
+    @staticmethod
+    def verify_signature(transaction):
+        """Verify the signature of the transaction without using the cache.
+
+        The type of the sender's key decides how the signature is checked.
+
         Arguments:
             transaction: The transaction that should be verified.
         """
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
+        message = (str(transaction.sender) + str(transaction.recipient) +
+                   str(transaction.amount)).encode('utf8')
+        is_ed25519 = str(transaction.sender).startswith(ED25519_PREFIX)
+        signature = str(transaction.signature)
+        if is_ed25519 != signature.startswith(ED25519_PREFIX):
+            return False
+        try:
+            public_key = Wallet.get_public_key(transaction.sender)
+            if is_ed25519:
+                signature = signature[len(ED25519_PREFIX):]
+            signature = binascii.unhexlify(signature)
+        except (ValueError, IndexError, TypeError):
+            # Malformed keys or signatures are invalid.
+            return False
+        if is_ed25519:
+            try:
+                public_key.verify(signature, message)
+                return True
+            except InvalidSignature:
+                return False
         verifier = PKCS1_v1_5.new(public_key)
-        new_hash = SHA256.new(
-            (str(transaction.sender) + str(transaction.recipient) +
-             str(transaction.amount)).encode('utf8'))
-        return (verifier.verify(new_hash, binascii.
-                                unhexlify(transaction.signature)))
+        return bool(verifier.verify(SHA256.new(message), signature))
+
+    @staticmethod
+    def cache_stats():
+        """Return the hit/miss counters of the verification caches."""
+        return {
+            'verification': Wallet.verification_cache.stats(),
+            'public_keys': Wallet.public_key_cache.stats()
+        }
@@ -0,0 +1,25 @@
+"""WSGI entry point for serving a node with a production server.
+
+The port of the node is read from the NODE_PORT environment variable
+(default: 5000), the durability mode of its persistence writer from
+NODE_DURABILITY ('fsync' or 'async', default: 'fsync'). Serve the node
+from a single process with many threads, e.g. (from the flask folder):
+
+    NODE_PORT=5000 waitress-serve --threads=16 --port=5000 wsgi:app
+
+or
+
+    NODE_PORT=5000 gunicorn --workers=1 --threads=16 -b 0.0.0.0:5000 wsgi:app
+
+Every process holds its own in-memory chain and writes the node's files,
+so never run more than one worker process per node.
+"""
+
+import os
+
+import node
+from persistence import DURABILITY
+
+node.init_node(int(os.environ.get('NODE_PORT', 5000)),
+               os.environ.get('NODE_DURABILITY', DURABILITY))
+app = node.app